@@ -0,0 +1,11 @@
+-- Multi-marketplace Amazon scraping.
+-- The worker scrapes the marketplace of the submitted URL (amazon.de -> DE, amazon.co.uk -> GB, ...)
+-- plus any extra RapidAPI country codes listed on the submission. Every stored review
+-- records the marketplace it came from.
+ALTER TABLE submissions
+  ADD COLUMN IF NOT EXISTS marketplaces TEXT[];
+
+ALTER TABLE reviews
+  ADD COLUMN IF NOT EXISTS country TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_reviews_submission_country ON reviews (submission_id, country);
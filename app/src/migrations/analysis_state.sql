@@ -0,0 +1,9 @@
+-- Mergeable analysis state.
+-- Each analysis stores the counts its numeric columns are computed from (rating histogram,
+-- per-month rating sums, sentiment counts, word counts). A refresh folds only the new
+-- reviews into this state instead of re-analysing the whole history.
+ALTER TABLE analyses
+  ADD COLUMN IF NOT EXISTS analysis_state JSONB;
+
+-- Refreshes check which scraped review ids a submission already has
+CREATE INDEX IF NOT EXISTS idx_reviews_submission_api_review_id ON reviews (submission_id, api_review_id);
@@ -0,0 +1,17 @@
+-- Raw RapidAPI payloads are archived once per response (compressed, content-addressed)
+-- by the worker's payload archive instead of being stored as JSON text on every row.
+-- Rows reference the archived blob by its SHA-256; reviews also keep their offset
+-- inside the page's data.reviews array.
+ALTER TABLE reviews
+  ADD COLUMN IF NOT EXISTS raw_payload_sha256 TEXT,
+  ADD COLUMN IF NOT EXISTS raw_payload_offset INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_reviews_raw_payload_sha256 ON reviews (raw_payload_sha256);
+
+-- submissions.api_response_product_details now holds {"raw_payload_sha256": "<hash>"}
+-- rather than the full product-details response.
+
+-- When the worker runs with RAW_PAYLOAD_ARCHIVE=supabase, blobs go to this private bucket.
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('raw-payloads', 'raw-payloads', false)
+ON CONFLICT (id) DO NOTHING;
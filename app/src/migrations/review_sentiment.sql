@@ -0,0 +1,10 @@
+-- Local per-review sentiment.
+-- The worker scores every review with a lexicon scorer (backend/worker/sentiment.py) as it
+-- is stored; the analysis sentiment_*_score columns are the label shares over all reviews.
+-- Reviews stored before this migration keep NULLs and are scored in memory when analysed.
+ALTER TABLE reviews
+  ADD COLUMN IF NOT EXISTS sentiment_score REAL,
+  ADD COLUMN IF NOT EXISTS sentiment_label TEXT
+    CHECK (sentiment_label IN ('positive', 'negative', 'neutral'));
+
+CREATE INDEX IF NOT EXISTS idx_reviews_submission_sentiment ON reviews (submission_id, sentiment_label);
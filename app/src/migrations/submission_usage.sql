@@ -0,0 +1,48 @@
+-- Per-submission usage accounting.
+-- Each worker stage (scrape, analyze, refresh) stores one row with what it consumed:
+-- LLM tokens (prompt, completion, served from the provider's context cache), LLM calls
+-- and latency, RapidAPI and Shopify storefront calls and response bytes, and Supabase
+-- round trips (backend/worker/usage.py). Rows sit next to the submission's analyses,
+-- keyed by submission_id.
+CREATE TABLE IF NOT EXISTS submission_usage (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  submission_id UUID NOT NULL REFERENCES submissions(id) ON DELETE CASCADE,
+  stage TEXT NOT NULL, -- 'scrape', 'analyze', 'refresh'
+  prompt_tokens INTEGER NOT NULL DEFAULT 0,
+  completion_tokens INTEGER NOT NULL DEFAULT 0,
+  cached_prompt_tokens INTEGER NOT NULL DEFAULT 0,
+  llm_calls INTEGER NOT NULL DEFAULT 0,
+  llm_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+  rapidapi_calls INTEGER NOT NULL DEFAULT 0,
+  rapidapi_bytes BIGINT NOT NULL DEFAULT 0,
+  storefront_calls INTEGER NOT NULL DEFAULT 0,
+  storefront_bytes BIGINT NOT NULL DEFAULT 0,
+  db_round_trips INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_submission_usage_submission_id ON submission_usage (submission_id);
+CREATE INDEX IF NOT EXISTS idx_submission_usage_created_at ON submission_usage (created_at);
+
+-- Written by the worker with the service role only
+ALTER TABLE submission_usage ENABLE ROW LEVEL SECURITY;
+
+-- Usage per user and (UTC) day, for quotas and for finding the products that cost the most
+CREATE OR REPLACE VIEW user_usage_daily AS
+SELECT
+  s.user_id,
+  (u.created_at AT TIME ZONE 'UTC')::date AS day,
+  COUNT(DISTINCT u.submission_id) AS submissions,
+  SUM(u.prompt_tokens) AS prompt_tokens,
+  SUM(u.completion_tokens) AS completion_tokens,
+  SUM(u.cached_prompt_tokens) AS cached_prompt_tokens,
+  SUM(u.llm_calls) AS llm_calls,
+  SUM(u.llm_seconds) AS llm_seconds,
+  SUM(u.rapidapi_calls) AS rapidapi_calls,
+  SUM(u.rapidapi_bytes) AS rapidapi_bytes,
+  SUM(u.storefront_calls) AS storefront_calls,
+  SUM(u.storefront_bytes) AS storefront_bytes,
+  SUM(u.db_round_trips) AS db_round_trips
+FROM submission_usage u
+JOIN submissions s ON s.id = u.submission_id
+GROUP BY s.user_id, (u.created_at AT TIME ZONE 'UTC')::date;
@@ -0,0 +1,6 @@
+-- Local theme clusters.
+-- The worker clusters every review (TF-IDF over words and word pairs, mini-batch k-means;
+-- backend/worker/themes.py) and sends the cluster summaries to the LLM instead of raw
+-- snippets. The clusters are kept with the analysis so themes can be compared across runs.
+ALTER TABLE analyses
+  ADD COLUMN IF NOT EXISTS theme_clusters JSONB;
@@ -0,0 +1,97 @@
+"""
+Parse-CPU benchmark for storefront product pages.
+
+Compares each installed HTML parser backend in ``worker.html_extract`` (selectolax, lxml,
+BeautifulSoup's html.parser) running the theme selectors on a synthetic storefront page,
+against the DOM-free fast path that reads JSON-LD and og: tags with regexes. The page is
+generated to the size of a typical theme's product page (head, mega-menu, product grid
+and inline scripts), so no network or fixtures are needed.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.html_parse_benchmark
+    python -m benchmarks.html_parse_benchmark --page-kb 800 --repeat 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker.html_extract import (available_backends, extract_structured_data, get_html_parser,  # noqa: E402
+                                 product_from_structured_data)
+from worker.shopify import THEME_SELECTORS  # noqa: E402
+
+
+def storefront_page(target_kb: int) -> str:
+    """A product page roughly `target_kb` KB long with JSON-LD, og: tags and theme markup."""
+    json_ld = {
+        "@context": "https://schema.org", "@type": "Product", "name": "Bakuchiol Retinol Alternative Serum",
+        "brand": {"@type": "Brand", "name": "Herbivore"}, "image": ["https://cdn.shopify.com/s/files/serum.jpg"],
+        "description": "A gentle, plant-based alternative to retinol.",
+        "offers": {"@type": "Offer", "price": "54.00", "priceCurrency": "USD",
+                   "availability": "https://schema.org/InStock"},
+        "aggregateRating": {"@type": "AggregateRating", "ratingValue": "4.6", "reviewCount": "1873"},
+    }
+    head = (
+        '<!doctype html><html><head><meta charset="utf-8"><title>Bakuchiol Serum</title>'
+        '<meta property="og:title" content="Bakuchiol Retinol Alternative Serum">'
+        '<meta property="og:price:amount" content="54.00"><meta property="og:price:currency" content="USD">'
+        '<meta property="og:image" content="https://cdn.shopify.com/s/files/serum.jpg">'
+        f'<script type="application/ld+json">{json.dumps(json_ld)}</script>'
+        '<script>var ShopifyAnalytics = {"meta": {"product": {"id": 6543210987, "vendor": "Herbivore"}}};</script>'
+        '</head><body>'
+    )
+    menu_item = '<li class="menu__item"><a class="menu__link" href="/collections/c{0}">Collection {0}</a></li>'
+    card = ('<div class="grid__item product-card" data-id="{0}"><a href="/products/p{0}"><img src="/img/{0}.jpg" '
+            'alt="Product {0}" loading="lazy"><span class="product-card__title">Product {0}</span>'
+            '<span class="price">$ {0}.00</span></a></div>')
+    script = '<script>window.theme = window.theme || {};' + 'theme.settings.push({"k": 1});' * 40 + '</script>'
+    product = ('<main><h1 class="product-single__title">Bakuchiol Retinol Alternative Serum</h1>'
+               '<span class="price__current">$54.00</span><div id="judgeme_product_reviews"></div></main>')
+    parts: List[str] = [head, '<nav><ul>', *(menu_item.format(i) for i in range(200)), '</ul></nav>', product]
+    i = 0
+    while sum(len(p) for p in parts) < target_kb * 1024:
+        parts.append(card.format(i) if i % 10 else script)
+        i += 1
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def cpu_per_call(fn: Callable[[], object], repeat: int) -> float:
+    """Mean process CPU seconds per call."""
+    fn()  # warm up imports and regex caches
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-kb', type=int, default=400, help='size of the synthetic product page')
+    parser.add_argument('--repeat', type=int, default=20, help='parses per backend')
+    args = parser.parse_args(argv)
+
+    page = storefront_page(args.page_kb)
+    results: Dict[str, float] = {}
+    for name in available_backends():
+        backend = get_html_parser(name)
+        results[f"{name} (theme selectors)"] = cpu_per_call(lambda: backend.select_text(page, THEME_SELECTORS), args.repeat)
+    results["fast path (JSON-LD + og:)"] = cpu_per_call(
+        lambda: product_from_structured_data(extract_structured_data(page)), args.repeat)
+
+    baseline = results.get("html.parser (theme selectors)")
+    print(f"Page: {len(page) / 1024:.0f} KB, {args.repeat} parses each")
+    header = f"{'backend':<32} {'CPU ms/page':>12} {'vs html.parser':>15}"
+    print(header)
+    print('-' * len(header))
+    for name, seconds in results.items():
+        print(f"{name:<32} {seconds * 1000:>12.2f} {baseline / seconds if baseline else 0:>14.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""
+Local stand-ins for the external services the worker talks to.
+
+One threaded HTTP server answers three kinds of request:
+
+- RapidAPI Amazon data: ``/product-details`` and ``/product-reviews``, replaying the
+  recorded pages in ``fixtures/`` with configurable latency and 429 rate.
+- Supabase/PostgREST: ``/rest/v1/<table>`` backed by an in-memory table store that
+  understands the filters, ordering and Prefer/Accept headers supabase-py sends.
+- DeepSeek: ``/chat/completions`` returning a canned analysis after a configurable delay.
+
+Every request is counted per service so the benchmark can report API calls and DB
+round trips per run.
+"""
+import copy
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+REVIEWS_PER_PAGE = 10
+
+# Dates handed out to generated reviews so monthly aggregation has realistic spread
+_MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+           "August", "September", "October", "November", "December"]
+
+
+def _load_fixture(name: str) -> Dict[str, Any]:
+    with open(FIXTURES_DIR / name) as f:
+        return json.load(f)
+
+
+class MockConfig:
+    """Knobs the benchmark turns between runs; read by the request handler on every call."""
+
+    def __init__(self):
+        self.total_reviews = 100          # reviews available per ASIN
+        self.api_latency = 0.0            # seconds added to each RapidAPI response
+        self.rate_429 = 0.0               # probability a RapidAPI call returns 429
+        self.llm_latency = 0.0            # seconds added to each DeepSeek response
+        self.db_latency = 0.0             # seconds added to each PostgREST call
+        self.seed = 1234
+
+
+class TableStore:
+    """Tiny in-memory PostgREST: tables are lists of dict rows guarded by one lock."""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.tables.clear()
+
+    def seed(self, table: str, rows: List[Dict[str, Any]]):
+        with self.lock:
+            self.tables[table].extend(copy.deepcopy(rows))
+
+    @staticmethod
+    def _matches(row: Dict[str, Any], filters: List[tuple]) -> bool:
+        for column, negate, op, value in filters:
+            actual = row.get(column)
+            if op == 'is':
+                ok = (actual is None) if value == 'null' else (str(actual).lower() == value)
+            elif op == 'in':
+                ok = str(actual) in value.strip('()').split(',')
+            elif actual is None:
+                ok = False
+            elif op == 'eq':
+                ok = str(actual) == value or (isinstance(actual, bool) and str(actual).lower() == value)
+            elif op == 'neq':
+                ok = str(actual) != value
+            elif op == 'gt':
+                ok = str(actual) > value
+            elif op == 'gte':
+                ok = str(actual) >= value
+            elif op == 'lt':
+                ok = str(actual) < value
+            elif op == 'lte':
+                ok = str(actual) <= value
+            else:
+                ok = True
+            if ok == negate:
+                return False
+        return True
+
+    @staticmethod
+    def parse_query(query: str):
+        """Split a PostgREST query string into (select, filters, order, limit)."""
+        select, order, limit = None, None, None
+        filters = []
+        for key, raw in parse_qsl(query, keep_blank_values=True):
+            if key == 'select':
+                select = [c.strip() for c in raw.split(',') if c.strip() and c.strip() != '*'] or None
+            elif key == 'order':
+                order = raw
+            elif key == 'limit':
+                limit = int(raw)
+            elif key in ('offset', 'columns', 'on_conflict'):
+                continue
+            else:
+                negate = raw.startswith('not.')
+                if negate:
+                    raw = raw[4:]
+                op, _, value = raw.partition('.')
+                filters.append((key, negate, op, value))
+        return select, filters, order, limit
+
+    def select(self, table: str, query: str) -> List[Dict[str, Any]]:
+        select, filters, order, limit = self.parse_query(query)
+        with self.lock:
+            rows = [r for r in self.tables[table] if self._matches(r, filters)]
+        if order:
+            column, _, direction = order.partition('.')
+            rows.sort(key=lambda r: str(r.get(column) or ''), reverse=direction.startswith('desc'))
+        if limit is not None:
+            rows = rows[:limit]
+        if select:
+            rows = [{c: r.get(c) for c in select} for r in rows]
+        return copy.deepcopy(rows)
+
+    def insert(self, table: str, payload: Any) -> List[Dict[str, Any]]:
+        rows = payload if isinstance(payload, list) else [payload]
+        now = datetime.utcnow().isoformat()
+        stored = []
+        for row in rows:
+            row = dict(row)
+            row.setdefault('id', str(uuid.uuid4()))
+            row.setdefault('created_at', now)
+            stored.append(row)
+        with self.lock:
+            self.tables[table].extend(stored)
+        return copy.deepcopy(stored)
+
+    def update(self, table: str, query: str, patch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        _, filters, _, _ = self.parse_query(query)
+        updated = []
+        with self.lock:
+            for row in self.tables[table]:
+                if self._matches(row, filters):
+                    row.update(patch)
+                    updated.append(copy.deepcopy(row))
+        return updated
+
+    def delete(self, table: str, query: str) -> List[Dict[str, Any]]:
+        _, filters, _, _ = self.parse_query(query)
+        with self.lock:
+            keep, removed = [], []
+            for row in self.tables[table]:
+                (removed if self._matches(row, filters) else keep).append(row)
+            self.tables[table] = keep
+        return removed
+
+
+class MockServices:
+    """Owns the HTTP server thread, its configuration, the table store and request counters."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.config = MockConfig()
+        self.store = TableStore()
+        self.counts: Counter = Counter()
+        self.bytes_sent: Counter = Counter()
+        self.llm_tokens: Counter = Counter()  # 'prompt' and 'cached' prompt tokens reported
+        self._counts_lock = threading.Lock()
+        self._rng = random.Random(self.config.seed)
+        self._product = _load_fixture('product_details.json')
+        self._review_page = _load_fixture('product_reviews_page.json')
+        self._analysis = _load_fixture('deepseek_analysis.json')
+        self._llm_prompts: List[str] = []  # recent prompts, for the simulated context cache
+
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment; otherwise delayed ACKs add ~40ms per call
+            disable_nagle_algorithm = True
+            wbufsize = 64 * 1024
+
+            def log_message(self, format, *args):  # keep benchmark output clean
+                pass
+
+            def _body(self) -> Any:
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length)) if length else None
+
+            def _send(self, service: str, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+                services._count(service, len(data))
+
+            def do_GET(self):
+                services._dispatch(self, 'GET')
+
+            def do_POST(self):
+                services._dispatch(self, 'POST')
+
+            def do_PATCH(self):
+                services._dispatch(self, 'PATCH')
+
+            def do_DELETE(self):
+                services._dispatch(self, 'DELETE')
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockServices':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self._counts_lock:
+            self.counts.clear()
+            self.bytes_sent.clear()
+            self.llm_tokens.clear()
+        self._rng = random.Random(self.config.seed)
+
+    def _count(self, service: str, nbytes: int):
+        with self._counts_lock:
+            self.counts[service] += 1
+            self.bytes_sent[service] += nbytes
+
+    # --- Routing ---
+
+    def _dispatch(self, handler, method: str):
+        parts = urlsplit(handler.path)
+        path = parts.path
+        try:
+            if path.startswith('/rest/v1/'):
+                self._postgrest(handler, method, path[len('/rest/v1/'):], parts.query)
+            elif path.endswith('/product-details'):
+                self._rapidapi(handler, 'rapidapi_product', lambda params: self._product)
+            elif path.endswith('/product-reviews'):
+                self._rapidapi(handler, 'rapidapi_reviews', self._reviews_page)
+            elif path.endswith('/chat/completions'):
+                self._deepseek(handler)
+            else:
+                handler._send('unknown', 404, {'error': f'No mock for {path}'})
+        except Exception as e:  # surface handler bugs to the client instead of hanging it
+            handler._send('error', 500, {'message': str(e)})
+
+    def _rapidapi(self, handler, service: str, build):
+        params = dict(parse_qsl(urlsplit(handler.path).query))
+        if self.config.api_latency:
+            time.sleep(self.config.api_latency)
+        if self.config.rate_429 and self._rng.random() < self.config.rate_429:
+            handler._send(service, 429, {'message': 'You have exceeded the rate limit per second for your plan'})
+            return
+        handler._send(service, 200, build(params))
+
+    def _reviews_page(self, params: Dict[str, str]) -> Dict[str, Any]:
+        """Replay the recorded page, re-keyed so every page/position has a unique review."""
+        page = max(1, int(params.get('page', '1')))
+        start = (page - 1) * REVIEWS_PER_PAGE
+        end = min(start + REVIEWS_PER_PAGE, self.config.total_reviews)
+        template = self._review_page['data']['reviews']
+        star_filter = params.get('star_rating', 'ALL')
+        reviews = []
+        for index in range(start, end):
+            review = dict(template[index % len(template)])
+            # Each marketplace has its own reviews; US ids stay as they were
+            country = params.get('country', 'US')
+            review['review_id'] = f"R{params.get('asin', 'X')}{'' if country == 'US' else country}{star_filter[:1]}{index:07d}"
+            month = _MONTHS[index % 12]
+            year = 2024 - (index // 120) % 5
+            review['review_date'] = f"Reviewed in the United States on {month} {index % 28 + 1}, {year}"
+            if star_filter[:1].isdigit():
+                review['review_star_rating'] = star_filter[:1]
+            reviews.append(review)
+        payload = copy.copy(self._review_page)
+        payload['parameters'] = dict(payload['parameters'], page=page, star_rating=star_filter)
+        payload['data'] = dict(payload['data'], reviews=reviews)
+        return payload
+
+    def _deepseek(self, handler):
+        body = handler._body() or {}
+        prompt = ''.join(str(message.get('content', '')) for message in body.get('messages', []))
+        prompt_tokens, cached_tokens = self._context_cache(prompt)
+        if self.config.llm_latency:
+            time.sleep(self.config.llm_latency)
+        handler._send('deepseek', 200, {
+            'id': str(uuid.uuid4()),
+            'object': 'chat.completion',
+            'model': 'deepseek-chat',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': json.dumps(self._analysis)},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 0, 'total_tokens': prompt_tokens,
+                      'prompt_cache_hit_tokens': cached_tokens,
+                      'prompt_cache_miss_tokens': prompt_tokens - cached_tokens},
+        })
+
+    def _context_cache(self, prompt: str):
+        """
+        (prompt tokens, cached tokens) the way DeepSeek's context cache reports them: the longest
+        prefix shared with an earlier request, in whole 64-token units (~4 characters a token).
+        """
+        with self._counts_lock:
+            shared = max((len(os.path.commonprefix([prompt, seen])) for seen in self._llm_prompts), default=0)
+            self._llm_prompts.append(prompt)
+            del self._llm_prompts[:-20]
+            prompt_tokens, cached_tokens = len(prompt) // 4, (shared // 4) // 64 * 64
+            self.llm_tokens['prompt'] += prompt_tokens
+            self.llm_tokens['cached'] += cached_tokens
+        return prompt_tokens, cached_tokens
+
+    def _postgrest(self, handler, method: str, table: str, query: str):
+        if self.config.db_latency:
+            time.sleep(self.config.db_latency)
+        single = 'vnd.pgrst.object' in (handler.headers.get('Accept') or '')
+        if method == 'GET':
+            rows = self.store.select(table, query)
+        elif method == 'POST':
+            rows = self.store.insert(table, handler._body())
+        elif method == 'PATCH':
+            rows = self.store.update(table, query, handler._body() or {})
+        else:
+            rows = self.store.delete(table, query)
+        status = 201 if method == 'POST' else 200
+        headers = {'Content-Range': f"0-{max(len(rows) - 1, 0)}/{len(rows)}"}
+        if 'return=minimal' in (handler.headers.get('Prefer') or ''):
+            handler._send('postgrest', status, None, headers)
+            return
+        if single:
+            if len(rows) != 1:
+                handler._send('postgrest', 406, {
+                    'code': 'PGRST116',
+                    'message': 'JSON object requested, multiple (or no) rows returned',
+                    'details': f'The result contains {len(rows)} rows', 'hint': None,
+                })
+                return
+            handler._send('postgrest', status, rows[0], headers)
+            return
+        handler._send('postgrest', status, rows, headers)
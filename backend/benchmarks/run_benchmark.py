@@ -0,0 +1,221 @@
+"""
+Offline throughput benchmark for the scrape -> analyze pipeline.
+
+Runs ``scrape_reviews`` followed by ``analyze_reviews`` end to end against the local
+stand-ins in ``mock_services`` (RapidAPI, Supabase/PostgREST, DeepSeek), so nothing
+touches live Amazon, Supabase or the queue. Each review count runs in its own
+subprocess so peak RSS is measured per size.
+
+Usage (from the backend directory, with the worker requirements installed):
+
+    python -m benchmarks.run_benchmark
+    python -m benchmarks.run_benchmark --sizes 10 100 --repeat 5 --api-latency-ms 80 --rate-429 0.02
+    python -m benchmarks.run_benchmark --json bench_output.json
+    python -m benchmarks.run_benchmark --sizes 1000 --repeat 10 --api-latency-ms 150 --batch
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+BENCH_URL = "https://www.amazon.com/Herbivore-Bakuchiol-Natural-Retinol-Alternative/dp/B07YZNT3RV"
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# supabase-py validates that the key looks like a JWT; the mock never checks it
+FAKE_SERVICE_KEY = "bench.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; good enough for a handful of repeats."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_child(submission_ids: List[str], batch: bool = False) -> Dict[str, Any]:
+    """Runs inside the per-size subprocess: import the worker and time each pipeline run."""
+    from worker.worker import analyze_reviews, scrape_reviews, scrape_reviews_batch
+
+    if batch:
+        return run_child_batch(submission_ids, scrape_reviews_batch, analyze_reviews)
+
+    timings: Dict[str, List[float]] = {'scrape': [], 'analyze': [], 'total': []}
+    statuses = []
+    for submission_id in submission_ids:
+        started = time.perf_counter()
+        scrape_result = scrape_reviews(submission_id, BENCH_URL)
+        scraped = time.perf_counter()
+        analyze_result = analyze_reviews({'submission_id': submission_id})
+        finished = time.perf_counter()
+        timings['scrape'].append(scraped - started)
+        timings['analyze'].append(finished - scraped)
+        timings['total'].append(finished - started)
+        statuses.append({
+            'scrape': scrape_result.get('status') if isinstance(scrape_result, dict) else None,
+            'reviews': scrape_result.get('reviews_count') if isinstance(scrape_result, dict) else None,
+            'analyze': analyze_result.get('status') if isinstance(analyze_result, dict) else None,
+        })
+    return {'timings': timings, 'statuses': statuses, 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_child_batch(submission_ids: List[str], scrape_reviews_batch, analyze_reviews) -> Dict[str, Any]:
+    """Scrape all submissions as one competitor set (scrape_reviews_batch), then analyze each."""
+    started = time.perf_counter()
+    batch_result = scrape_reviews_batch([[sid, BENCH_URL] for sid in submission_ids], analyze=False)
+    scraped = time.perf_counter()
+    analyze_times = []
+    statuses = []
+    for submission_id in submission_ids:
+        analyze_started = time.perf_counter()
+        analyze_result = analyze_reviews({'submission_id': submission_id})
+        analyze_times.append(time.perf_counter() - analyze_started)
+        scrape_result = batch_result['submissions'].get(submission_id, {})
+        statuses.append({'scrape': scrape_result.get('status'), 'reviews': scrape_result.get('reviews_count'),
+                         'analyze': analyze_result.get('status') if isinstance(analyze_result, dict) else None})
+    # One batch covers every "run", so the scrape figure is the wall time of the whole set
+    timings = {'scrape': [scraped - started], 'analyze': analyze_times, 'total': [scraped - started + sum(analyze_times)]}
+    return {'timings': timings, 'statuses': statuses, 'peak_rss_mb': peak_rss_mb()}
+
+
+def child_env(base_url: str, size: int, args) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        'SUPABASE_URL': base_url,
+        'SUPABASE_SERVICE_ROLE_KEY': FAKE_SERVICE_KEY,
+        'RAPIDAPI_KEY': 'bench',
+        'RAPIDAPI_HOST': 'real-time-amazon-data.p.rapidapi.com',
+        'RAPIDAPI_BASE_URL': base_url,
+        'DEEPSEEK_API_KEY': 'bench',
+        'DEEPSEEK_API_URL': f"{base_url}/chat/completions",
+        'AMAZON_MAX_REVIEWS': str(size),
+        'AMAZON_MAX_REVIEW_PAGES': str(math.ceil(size / 10) + 1),
+        'AMAZON_PAGE_DELAY': str(args.page_delay),
+        'RAPIDAPI_RATE_LIMIT': str(args.rate_limit),
+        'RAPIDAPI_COUNTRY_RATE_LIMIT': str(args.rate_limit),
+        'LOG_LEVEL': args.log_level,
+        'RAW_PAYLOAD_ARCHIVE': 'local',
+        'RAW_PAYLOAD_DIR': os.path.join(tempfile.gettempdir(), 'rivalrecon-bench-payloads'),
+        'PYTHONPATH': BACKEND_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+    })
+    return env
+
+
+def run_size(services, size: int, args) -> Dict[str, Any]:
+    services.store.reset()
+    services.reset_counts()
+    services.config.total_reviews = size
+
+    submission_ids = [str(uuid.uuid4()) for _ in range(args.repeat)]
+    services.store.seed('submissions', [
+        {'id': sid, 'url': BENCH_URL, 'user_id': 'bench-user', 'status': 'pending',
+         'is_competitor_product': False, 'product_title': None}
+        for sid in submission_ids
+    ])
+
+    proc = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.run_benchmark', *(['--batch'] if args.batch else []),
+         '--child', *submission_ids],
+        cwd=BACKEND_DIR, env=child_env(services.base_url, size, args),
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Benchmark child failed for size {size}:\n{proc.stderr[-4000:]}")
+    child = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    counts = dict(services.counts)
+    per_run = lambda service: counts.get(service, 0) / args.repeat
+    timings = child['timings']
+    return {
+        'size': size,
+        'repeat': args.repeat,
+        'latency_s': {stage: {'p50': percentile(values, 50), 'p95': percentile(values, 95)}
+                      for stage, values in timings.items()},
+        'api_requests_per_run': {
+            'rapidapi': per_run('rapidapi_product') + per_run('rapidapi_reviews'),
+            'deepseek': per_run('deepseek'),
+        },
+        'db_round_trips_per_run': per_run('postgrest'),
+        'llm_prompt_tokens_per_run': services.llm_tokens['prompt'] / args.repeat,
+        'llm_cached_share': services.llm_tokens['cached'] / max(1, services.llm_tokens['prompt']),
+        'bytes_received_per_run': sum(services.bytes_sent.values()) / args.repeat,
+        'peak_rss_mb': child['peak_rss_mb'],
+        'statuses': child['statuses'],
+    }
+
+
+def print_table(results: List[Dict[str, Any]]):
+    header = (f"{'reviews':>8} {'scrape p50':>11} {'scrape p95':>11} {'analyze p50':>12} {'analyze p95':>12} "
+              f"{'total p95':>10} {'api req':>8} {'llm req':>8} {'llm cache':>10} {'db trips':>9} {'peak MB':>8}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        lat = r['latency_s']
+        print(f"{r['size']:>8} {lat['scrape']['p50']:>10.3f}s {lat['scrape']['p95']:>10.3f}s "
+              f"{lat['analyze']['p50']:>11.3f}s {lat['analyze']['p95']:>11.3f}s {lat['total']['p95']:>9.3f}s "
+              f"{r['api_requests_per_run']['rapidapi']:>8.0f} {r['api_requests_per_run']['deepseek']:>8.0f} "
+              f"{r['llm_cached_share']:>9.0%} "
+              f"{r['db_round_trips_per_run']:>9.0f} {r['peak_rss_mb']:>8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='review counts to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='pipeline runs per size (for p50/p95)')
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help='added latency per RapidAPI call')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of RapidAPI calls answered with 429')
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help='added latency per DeepSeek call')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help='added latency per Supabase call')
+    parser.add_argument('--page-delay', type=float, default=0.0,
+                        help='AMAZON_PAGE_DELAY for the scraper (production default is 0.5s)')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='RapidAPI requests/s for the shared and per-country budgets; 0 leaves them unpaced '
+                             '(production defaults are 10 and 5)')
+    parser.add_argument('--log-level', default='WARNING', help='LOG_LEVEL for the worker under test')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    parser.add_argument('--batch', action='store_true',
+                        help='scrape the --repeat submissions as one competitor set via scrape_reviews_batch')
+    parser.add_argument('--child', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(run_child(args.child, batch=args.batch)))
+        return
+
+    from benchmarks.mock_services import MockServices
+
+    services = MockServices().start()
+    services.config.api_latency = args.api_latency_ms / 1000.0
+    services.config.rate_429 = args.rate_429
+    services.config.llm_latency = args.llm_latency_ms / 1000.0
+    services.config.db_latency = args.db_latency_ms / 1000.0
+    try:
+        results = []
+        for size in args.sizes:
+            print(f"Benchmarking {size} reviews x {args.repeat} runs...", file=sys.stderr)
+            results.append(run_size(services, size, args))
+        print_table(results)
+    finally:
+        services.stop()
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -80,6 +80,73 @@ router.post('/', async (req, res) => {
   }
 });
 
+// Submit a product together with its competitors; they are scraped as one batch
+router.post('/batch', async (req, res) => {
+  try {
+    const { url, competitor_urls = [] } = req.body;
+    const userId = req.user.id;
+
+    if (!url) {
+      return res.status(400).json({ error: 'URL is required' });
+    }
+    if (!Array.isArray(competitor_urls) || competitor_urls.some((competitorUrl) => !competitorUrl)) {
+      return res.status(400).json({ error: 'competitor_urls must be a list of URLs' });
+    }
+
+    // Create one submission record per URL, the product first
+    const { data: submissions, error: submissionError } = await supabase
+      .from('submissions')
+      .insert([
+        { url, user_id: userId, status: 'pending', is_competitor_product: false },
+        ...competitor_urls.map((competitorUrl) => ({
+          url: competitorUrl,
+          user_id: userId,
+          status: 'pending',
+          is_competitor_product: true
+        }))
+      ])
+      .select();
+
+    if (submissionError) {
+      console.error('Supabase error:', submissionError);
+      throw submissionError;
+    }
+
+    try {
+      // One task scrapes every URL concurrently and queues an analysis for each submission
+      const taskId = await taskManager.queueBatchScrapeTask(
+        submissions.map((submission) => ({ submissionId: submission.id, url: submission.url }))
+      );
+
+      await Promise.all(submissions.map((submission) => redis.set(`submission:${submission.id}:task_id`, taskId)));
+
+      res.json({
+        message: 'Submissions created successfully',
+        submissions: submissions.map((submission) => ({
+          id: submission.id,
+          url: submission.url,
+          status: 'pending',
+          is_competitor_product: submission.is_competitor_product
+        }))
+      });
+    } catch (taskError) {
+      console.error('Error queueing batch task:', taskError);
+
+      // Update the submissions to failed status since task queueing failed
+      await supabase
+        .from('submissions')
+        .update({ status: 'failed' })
+        .in('id', submissions.map((submission) => submission.id));
+
+      throw new Error(`Failed to queue task: ${taskError.message}`);
+    }
+
+  } catch (error) {
+    console.error('Batch submission error:', error);
+    res.status(500).json({ error: 'Failed to process submissions: ' + error.message });
+  }
+});
+
 // Get all submissions for user
 router.get('/', async (req, res) => {
   try {
@@ -14,7 +14,7 @@ class TaskManager {
     this.redis.on('connect', () => console.log('Connected to Redis'));
 
     this.taskResultPrefix = 'celery-task-meta-';
-    this.defaultQueue = 'celery'; // Default Celery queue name
+    this.defaultQueue = 'celery'; // Default Celery queue: the interactive one, served before refresh and recurring work (worker/queues.py)
   }
 
   /**
@@ -131,6 +131,34 @@ class TaskManager {
     }
   }
 
+  /**
+   * Queue one scrape for a product and its competitors.
+   * The worker scrapes every URL concurrently under a shared RapidAPI rate limit and
+   * queues worker.analyze_reviews for each submission once its reviews are stored.
+   * @param {Array<{submissionId: string, url: string}>} items - Submissions to scrape together
+   * @returns {Promise<string>} - Task ID
+   */
+  async queueBatchScrapeTask(items) {
+    console.log(`Creating batch scrape task for ${items.length} submissions`);
+    const submissions = items.map(({ submissionId, url }) => ({ submission_id: submissionId, url }));
+    const { messageString, taskId } = this.createTaskMessage(
+      'worker.scrape_reviews_batch',
+      [submissions],
+      { analyze: true }
+    );
+    const queueName = this.defaultQueue;
+
+    try {
+      console.log(`Safe RPUSH to queue: ${queueName}, message length: ${messageString.length}`);
+      const result = await this.redis.rpush(queueName, messageString);
+      console.log(`Task ${taskId} queued successfully, RPUSH result: ${result}`);
+      return taskId;
+    } catch (error) {
+      console.error(`Error queueing batch scrape task ${taskId}:`, error);
+      throw new Error('Failed to queue batch scrape task');
+    }
+  }
+
   /**
    * Queue a review analysis task
    * @param {Object} reviewsData - The reviews data to analyze
@@ -6,8 +6,11 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import the worker modules
+from worker.logging_config import configure_logging
 from worker.worker import scrape_reviews
 
+configure_logging()
+
 # Generate a unique test submission ID
 test_submission_id = f"test-{int(datetime.now().timestamp())}"
 
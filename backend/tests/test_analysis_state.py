@@ -0,0 +1,37 @@
+from worker.analysis_state import WORD_STATE_LIMIT, AnalysisState
+
+
+def _reviews(start, count):
+    return [
+        {
+            'review_text': f"Great serum, gentle on skin. Batch {i % 7} smelled like citrus{i % 3}.",
+            'review_rating': str(1 + i % 5),
+            'review_date': f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}",
+            'sentiment_label': ('positive', 'negative', 'neutral')[i % 3],
+        }
+        for i in range(start, start + count)
+    ]
+
+
+def _figures(state):
+    return (state.rating_count, round(state.average_rating, 6), dict(state.rating_distribution),
+            state.ratings_over_time(months=24), state.sentiment_scores(), state.reviews_folded)
+
+
+def test_merge_into_stored_state_matches_rebuild():
+    first, second = _reviews(0, 120), _reviews(120, 45)
+    rebuilt = AnalysisState().add_reviews(first + second)
+
+    stored = AnalysisState.from_json(AnalysisState().add_reviews(first).to_json())
+    merged = stored.merge(AnalysisState().add_reviews(second))
+
+    assert _figures(merged) == _figures(rebuilt)
+    assert merged.word_map() == rebuilt.word_map()
+
+
+def test_stored_words_are_truncated_to_the_limit():
+    state = AnalysisState()
+    state.add_words(' '.join(f"word{chr(97 + i % 26)}{chr(97 + i // 26 % 26)}{chr(97 + i // 676)}"
+                             for i in range(WORD_STATE_LIMIT + 10)))
+
+    assert len(AnalysisState.from_json(state.to_json()).words) == WORD_STATE_LIMIT
@@ -0,0 +1,101 @@
+import time
+import types
+
+import pytest
+
+from worker import circuit_breaker
+from worker.circuit_breaker import (CIRCUIT_MIN_CALLS, CIRCUIT_OPEN_SECONDS, CircuitBreaker, CircuitOpenError,
+                                    failed_status)
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=time.time())
+    monkeypatch.setattr(circuit_breaker, 'time', types.SimpleNamespace(
+        time=lambda: clock.now, monotonic=time.monotonic))
+    monkeypatch.setattr(circuit_breaker, 'CIRCUIT_BREAKER', 'redis')
+    return clock
+
+
+def _breaker():
+    return CircuitBreaker('rapidapi', 'product-reviews', slow_call_seconds=15, redis_client=fakeredis.FakeRedis())
+
+
+def _open(breaker):
+    for _ in range(CIRCUIT_MIN_CALLS):
+        breaker.before_call()
+        breaker.after_call(failed=True, seconds=0.1)
+
+
+def test_opens_once_enough_calls_fail_and_then_fails_fast(clock):
+    breaker = _breaker()
+    for _ in range(CIRCUIT_MIN_CALLS - 1):
+        breaker.after_call(failed=True, seconds=0.1)
+    breaker.before_call()  # too few calls to judge yet
+
+    breaker.after_call(failed=False, seconds=20)  # slow calls count as failures
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.before_call()
+    assert raised.value.retry_after == pytest.approx(CIRCUIT_OPEN_SECONDS)
+
+
+def test_successes_keep_the_circuit_closed(clock):
+    breaker = _breaker()
+    for i in range(4 * CIRCUIT_MIN_CALLS):
+        breaker.before_call()
+        breaker.after_call(failed=i % 3 == 0, seconds=0.1)
+    breaker.before_call()
+
+
+def test_half_open_probe_success_closes_the_circuit(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.now += CIRCUIT_OPEN_SECONDS + 1
+
+    breaker.before_call()  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # only one probe at a time
+    breaker.after_call(failed=False, seconds=0.1)
+    for _ in range(3):
+        breaker.before_call()
+
+
+def test_half_open_probe_failure_reopens_the_circuit(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.now += CIRCUIT_OPEN_SECONDS + 1
+
+    breaker.before_call()
+    breaker.after_call(failed=True, seconds=0.1)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += CIRCUIT_OPEN_SECONDS + 1
+    breaker.before_call()
+
+
+def test_lost_probes_are_replaced_after_the_open_period(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.now += CIRCUIT_OPEN_SECONDS + 1
+    breaker.before_call()  # a probe whose worker never reports back
+
+    clock.now += CIRCUIT_OPEN_SECONDS + 1
+    breaker.before_call()
+
+
+def test_redis_errors_let_calls_through(clock):
+    class Broken:
+        def register_script(self, script):
+            raise ConnectionError('redis down')
+
+    breaker = CircuitBreaker('deepseek', 'chat', slow_call_seconds=120, redis_client=Broken())
+    breaker.before_call()
+    breaker.after_call(failed=True, seconds=0.1)
+    assert not breaker.enabled
+
+
+def test_429_counts_only_when_asked():
+    assert failed_status(503) and failed_status(429, count_429=True)
+    assert not failed_status(429) and not failed_status(404)
@@ -0,0 +1,44 @@
+from worker.near_duplicates import cluster_near_duplicates, collapse_near_duplicates
+
+WORDS = ("this cream went on smooth and left my skin soft without any greasy film and the smell "
+         "faded after a minute which I liked because strong scents usually bother me a lot so "
+         "overall I would buy it again for the price and recommend it to friends with dry skin "
+         "who want something gentle for daily use in the winter months").split()
+
+
+def _text(replace_at=None):
+    words = list(WORDS)
+    if replace_at is not None:
+        words[replace_at] = 'unusually'
+    return ' '.join(words)
+
+
+def test_copies_and_punctuation_variants_collapse_into_the_longest():
+    reviews = [
+        {'review_text': _text(), 'review_rating': 5},
+        {'review_text': 'Broke after two days, the pump never worked.', 'review_rating': 1},
+        {'review_text': _text().upper() + '!!!', 'review_rating': 5},
+        {'review_text': _text() + ' Thanks', 'review_rating': 4},
+    ]
+    representatives, collapsed = collapse_near_duplicates(reviews)
+
+    assert collapsed == 2
+    assert [r['review_rating'] for r in representatives] == [4, 1]
+    assert representatives[0]['duplicate_count'] == 3
+    assert 'duplicate_count' not in representatives[1]
+
+
+def test_threshold_is_an_exact_jaccard_cut():
+    # One changed word alters 3 of ~58 shingles: Jaccard ~0.9
+    texts = [_text(), _text(replace_at=30)]
+
+    assert cluster_near_duplicates(texts, threshold=0.8) == [0, 0]
+    assert cluster_near_duplicates(texts, threshold=0.95) == [0, 1]
+
+
+def test_short_and_empty_texts():
+    roots = cluster_near_duplicates(['Love it!', 'love it', 'Hate it', '', ''])
+
+    assert roots[:3] == [0, 0, 2]
+    # Empty texts have no shingles and never cluster
+    assert roots[3:] == [3, 4]
@@ -0,0 +1,38 @@
+from worker.prompt_sampler import estimate_tokens, review_snippets
+
+
+def _reviews(count_by_star):
+    reviews = []
+    for star, count in count_by_star.items():
+        for i in range(count):
+            reviews.append({
+                'review_text': f"{star} star review number {i}. " + "The texture was fine and it absorbed quickly. " * (1 + i % 4),
+                'review_rating': str(star),
+                'review_date': f"2024-{1 + i % 6:02d}-10",
+                'helpful_votes_text': f"{i % 5} people found this helpful",
+            })
+    return reviews
+
+
+def test_snippets_stay_within_the_token_budget():
+    snippets, used = review_snippets(_reviews({5: 300, 4: 80, 1: 40}), token_budget=1500)
+
+    assert used <= 1500
+    assert used == sum(estimate_tokens(snippet) + 1 for snippet in snippets)
+    # The budget is filled, not left mostly empty
+    assert used > 1500 - 100
+
+
+def test_every_star_rating_is_represented_before_the_majority_fills_the_budget():
+    snippets, _ = review_snippets(_reviews({5: 500, 4: 3, 3: 2, 2: 2, 1: 3}), token_budget=800)
+
+    assert {snippet.split(',')[0] for snippet in snippets} == {f"Rating: {star}" for star in range(1, 6)}
+
+
+def test_small_inputs_are_included_whole_and_sampling_is_deterministic():
+    reviews = _reviews({5: 3, 2: 2})
+    snippets, _ = review_snippets(reviews, token_budget=5000)
+
+    assert len(snippets) == len(reviews)
+    assert review_snippets(_reviews({5: 200, 1: 50}), token_budget=900) == \
+        review_snippets(_reviews({5: 200, 1: 50}), token_budget=900)
@@ -0,0 +1,67 @@
+import contextlib
+import json
+import time
+import types
+
+import pytest
+
+from worker import queues
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+def _message(task_id, enqueued_at=None):
+    headers = {'id': task_id} if enqueued_at is None else {'id': task_id, 'enqueued_at': enqueued_at}
+    return json.dumps({'headers': headers, 'body': ''})
+
+
+def _push(client, queue, *messages):
+    # Kombu LPUSHes, so the oldest message ends up last in the list
+    for message in messages:
+        client.lpush(queue, message)
+
+
+def _ids(client, queue):
+    return [json.loads(raw)['headers']['id'] for raw in client.lrange(queue, 0, -1)]
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis()
+
+
+def test_only_messages_older_than_the_cutoff_move_oldest_first(client):
+    promote = client.register_script(queues._PROMOTE_SCRIPT)
+    _push(client, 'refresh', _message('a', 100), _message('b', 200), _message('c', 300))
+    _push(client, 'celery', _message('x', 50))
+
+    assert promote(keys=['refresh', 'celery'], args=[250, 20]) == 2
+    assert _ids(client, 'refresh') == ['c']
+    # Moved ahead of 'x' at the consuming end (the tail), the oldest taken first
+    assert _ids(client, 'celery') == ['x', 'b', 'a']
+
+
+def test_batch_limit_and_unstamped_messages_stop_the_scan(client):
+    promote = client.register_script(queues._PROMOTE_SCRIPT)
+    _push(client, 'refresh', _message('a', 100), _message('b', 110), _message('c', 120))
+    assert promote(keys=['refresh', 'celery'], args=[1000, 2]) == 2
+    assert _ids(client, 'refresh') == ['c']
+
+    _push(client, 'recurring', _message('unstamped'), _message('d', 100))
+    client.rpush('recurring', 'not json')
+    assert promote(keys=['recurring', 'refresh'], args=[1000, 20]) == 0
+    assert client.llen('recurring') == 3
+
+
+def test_long_waiting_recurring_work_moves_up_both_queues(client, monkeypatch):
+    old = time.time() - queues.QUEUE_STARVATION_SECONDS - 60
+    _push(client, queues.RECURRING_QUEUE, _message('old', old), _message('new', time.time()))
+    channel = types.SimpleNamespace(client=client)
+    app = types.SimpleNamespace(connection_for_write=lambda: contextlib.nullcontext(
+        types.SimpleNamespace(default_channel=channel)))
+    monkeypatch.setattr('celery.current_app', app)
+
+    assert queues.promote_starved_tasks() == {queues.RECURRING_QUEUE: 1, queues.REFRESH_QUEUE: 1}
+    assert _ids(client, queues.INTERACTIVE_QUEUE) == ['old']
+    assert _ids(client, queues.RECURRING_QUEUE) == ['new']
+    assert client.llen(queues.REFRESH_QUEUE) == 0
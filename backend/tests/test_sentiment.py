@@ -0,0 +1,39 @@
+import math
+
+from worker.sentiment import ALPHA, label_for, score_texts
+
+
+def _score(text):
+    return score_texts([text])[0]
+
+
+def test_single_word_matches_the_normalised_valence():
+    assert _score('Great') == round(3.1 / math.sqrt(3.1 ** 2 + ALPHA), 4)
+    assert label_for(_score('Great')) == 'positive'
+    assert label_for(_score('The box is blue')) == 'neutral'
+
+
+def test_negation_flips_words_within_its_span_only():
+    assert label_for(_score('This is not great')) == 'negative'
+    assert label_for(_score("It's not bad at all")) == 'positive'
+    # "great" is four words after "not", past NEGATION_SPAN
+    assert label_for(_score('Not what I expected, great')) == 'positive'
+
+
+def test_clause_after_but_decides():
+    # Unweighted the sum would be positive (3.1 - 2.0)
+    assert label_for(_score('The smell is great but it broke after a week')) == 'negative'
+    assert label_for(_score('It broke once but customer service was great')) == 'positive'
+
+
+def test_boosters_and_exclamations_strengthen():
+    assert _score('very good') > _score('good') > _score('slightly good') > 0
+    assert _score('good!!') > _score('good')
+
+
+def test_texts_in_a_batch_do_not_affect_each_other():
+    texts = ['not', 'great', 'bad but', 'fine', '', None]
+    scores = score_texts(texts)
+
+    assert scores[:4] == [_score(text) for text in texts[:4]]
+    assert scores[4:] == [None, None]
@@ -0,0 +1,43 @@
+from worker.themes import THEME_MIN_REVIEWS, render_theme_clusters, theme_clusters
+
+BATTERY = ["battery died after {n} days and charging takes hours",
+           "charging port stopped working, battery drains overnight {n}",
+           "battery life is terrible, charging cable broke on day {n}"]
+SCENT = ["lovely lavender scent, skin feels soft after {n} uses",
+         "the scent is lovely and my skin stays soft all day {n}",
+         "soft skin and a gentle lavender scent, bottle {n} already"]
+
+
+def _reviews(per_topic=60):
+    reviews = []
+    for n in range(per_topic):
+        reviews.append({'review_text': BATTERY[n % 3].format(n=n), 'review_rating': '1', 'sentiment_label': 'negative'})
+        reviews.append({'review_text': SCENT[n % 3].format(n=n), 'review_rating': '5', 'sentiment_label': 'positive'})
+    return reviews
+
+
+def test_too_few_reviews_gives_no_clusters():
+    assert theme_clusters(_reviews()[:THEME_MIN_REVIEWS - 1]) == []
+
+
+def test_separate_topics_become_separate_clusters():
+    clusters = theme_clusters(_reviews(), clusters=2)
+
+    assert [cluster['reviews'] for cluster in clusters] == [60, 60]
+    by_rating = {cluster['average_rating']: cluster for cluster in clusters}
+    assert set(by_rating) == {1.0, 5.0}
+    battery, scent = by_rating[1.0], by_rating[5.0]
+    assert 'battery' in ' '.join(battery['terms']) and 'scent' in ' '.join(scent['terms'])
+    assert battery['low_star_share'] == battery['negative_share'] == 1.0
+    assert battery['rating_skew'] == -2.0 and scent['rating_skew'] == 2.0
+    assert all('battery' in example for example in battery['examples'])
+    assert 'Cluster 1: 60 reviews (50%)' in render_theme_clusters(clusters)
+
+
+def test_near_duplicate_representatives_count_as_their_copies():
+    reviews = _reviews()
+    reviews[0] = {**reviews[0], 'duplicate_count': 21}
+    clusters = theme_clusters(reviews, clusters=2)
+
+    assert sorted(cluster['reviews'] for cluster in clusters) == [60, 80]
+    assert clusters == theme_clusters(reviews, clusters=2)
@@ -0,0 +1,111 @@
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
+from worker.prompt_sampler import estimate_tokens, review_snippets
+from worker.themes import render_theme_clusters
+
+logger = logging.getLogger(__name__)
+
+# Everything that is the same for every analysis lives in the system message, so the request
+# starts with the same bytes every time and DeepSeek's context cache can serve that prefix
+# (cached input tokens are billed at a fraction and skip prefill). Nothing per-product may be
+# interpolated here: the product name, metrics, prior analysis and reviews all go in the user
+# message, after it.
+ANALYSIS_SYSTEM_PROMPT = """You are an expert review analysis assistant. Your task is to analyze the provided review data and return insights ONLY in the specified JSON format.
+
+TASK: Analyze product reviews for key insights and generate a concise display name.
+
+The user message gives, in this order:
+- PRODUCT CONTEXT: the original product name.
+- Contextual Metrics: average rating, rating distribution, monthly average ratings and sentiment shares, all pre-calculated locally over every review. Use them as context and focus ONLY on the qualitative insights requested below. DO NOT RECALCULATE THEM OR INCLUDE THEM IN YOUR RESPONSE.
+- Optionally a Prior Analysis: the findings of an earlier analysis of this product. The review data then covers ONLY the reviews added since. Update these findings with the new reviews: keep points that still hold and revise what the new reviews change. The contextual metrics already include the new reviews.
+- The review data: either theme clusters computed locally over every review (size, top terms, rating skew and the most typical reviews of each cluster), or review snippets (rating, date, text; "[posted Nx near-identically]" marks text that N reviewers posted).
+
+**Analysis Tasks & REQUIRED JSON Output Structure:**
+
+You MUST return ONLY a single, valid JSON object containing EXACTLY the following keys and value types. DO NOT include any other keys or introductory text.
+
+1.  `"themes"`: (List of Strings, max 10) Main themes discussed (e.g., "Customer Service", "Battery Life"). When theme clusters are given, name what each cluster is about, largest first, merging clusters that share a theme.
+2.  `"top_positives"`: (List of Strings, max 5) Top positive points mentioned in text.
+3.  `"top_negatives"`: (List of Strings, max 5) Top negative points mentioned in text. Briefly explain any major discrepancies between sentiment/ratings if observed.
+4.  `"trending"`: (String) Analysis of *reasons* for rating changes over time, based on Monthly Average Ratings and review text themes.
+5.  `"improvement_opportunities"`: (List of Strings, max 5) Concrete suggestions for product improvements based on the negative feedback and themes.
+6.  `"competitive_insights"`: (List of Strings, max 5) Insights comparing this product to competitors *if explicitly mentioned* in the reviews, or potential competitive advantages/disadvantages identified.
+7.  `"high_level_summary"`: (String, 3-4 sentences) A concise summary of the overall findings, highlighting key sentiments, themes, and potential actions.
+8.  `"display_name"`: (String) A product display name that MUST start with the exact brand name followed by the specific product identifier. REQUIRED FORMAT: "[EXACT BRAND NAME] [SPECIFIC PRODUCT NAME]" where brand name is the manufacturer (e.g., "HERBIVORE", "SAMSUNG", "NIKE") and product name is the specific product (e.g., "Bakuchiol Retinol", "Galaxy S23", "Air Jordan 4"). NEVER use generic descriptors like "Gentle Serum" or "Retinol Alternative" alone. ALWAYS retain the exact brand name from the Original Product Name as the first word(s) and then the specific product identifier. Examples: For "HERBIVORE Bakuchiol Retinol Alternative" use "HERBIVORE Bakuchiol Retinol"; For "L'Oreal Paris Age Perfect Cell Renewal" use "L'Oreal Paris Age Perfect". Limit to 3-6 words total.
+
+**CRITICAL:** Your response MUST be ONLY the single, valid JSON object described above, containing exactly the 8 specified keys and adhering strictly to their defined types."""
+
+
+def review_data(analysis_input: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    The review section of the prompt: theme clusters when there are any, otherwise a sample.
+
+    Returns:
+        Tuple of (section heading, section text)
+    """
+    reviews = analysis_input.get('reviews', [])
+    clusters = analysis_input.get('theme_clusters')
+    if clusters:
+        # Every review, summarised as locally computed theme clusters (themes.py)
+        text = render_theme_clusters(clusters)
+        logger.info("Summarised %s reviews as %s theme clusters "
+                    "(~%s tokens) for analysis", len(reviews), len(clusters), estimate_tokens(text))
+        return f"Review Themes (all {sum(c['reviews'] for c in clusters)} reviews, clustered locally)", text
+    # Too few reviews to cluster: a representative sample (stratified by star and month,
+    # weighted by helpfulness and length) that fills the snippet token budget; see prompt_sampler.py
+    snippets, snippet_tokens = review_snippets(reviews)
+    logger.info("Sampled %s of %s reviews (~%s tokens) for analysis", len(snippets), len(reviews), snippet_tokens)
+    return "Review Data Snippets", "\n".join(snippets)
+
+
+def analysis_user_prompt(analysis_input: Dict[str, Any]) -> str:
+    """The per-product part of the prompt, ordered from least to most variable."""
+    heading, text = review_data(analysis_input)
+    prior_section = ""
+    prior_summary = analysis_input.get('prior_summary')
+    if prior_summary:
+        prior_section = f"""
+**Prior Analysis (of the {analysis_input.get('prior_review_count', 'earlier')} reviews analyzed before):**
+{json.dumps(prior_summary, ensure_ascii=False)}
+"""
+    return f"""PRODUCT CONTEXT:
+- Original Product Name: {analysis_input.get('original_product_name', 'Product')}
+
+**Contextual Metrics (PROVIDED FOR CONTEXT - DO NOT RECALCULATE OR INCLUDE IN RESPONSE):**
+- Average Rating: {analysis_input.get('calculated_average_rating', 'N/A')}
+- Rating Distribution (Star: Count): {analysis_input.get('calculated_distribution', 'N/A')}
+- Monthly Average Ratings ({len(analysis_input.get('calculated_monthly_averages', {}))} months): {analysis_input.get('calculated_monthly_averages', 'N/A')}
+- Sentiment (share of all reviews, scored locally): {analysis_input.get('calculated_sentiment', 'N/A')}
+{prior_section}
+**{heading}:**
+--- Start Review Data ---
+{text}
+--- End Review Data ---
+"""
+
+
+def analysis_messages(analysis_input: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Chat messages for an analysis: the static system prefix first, the product's data last."""
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": analysis_user_prompt(analysis_input)},
+    ]
+
+
+def llm_usage(response_json: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Token counts from a chat completion's `usage`, including the prompt tokens served from
+    the provider's context cache (DeepSeek: prompt_cache_hit_tokens; OpenAI-style APIs:
+    prompt_tokens_details.cached_tokens).
+    """
+    usage = response_json.get('usage') or {}
+    cached = usage.get('prompt_cache_hit_tokens')
+    if cached is None:
+        cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or 0,
+        'cached_prompt_tokens': cached,
+    }
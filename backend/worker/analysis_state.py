@@ -0,0 +1,242 @@
+import json
+import logging
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set
+
+from worker.logging_config import SampledLogger
+
+logger = logging.getLogger(__name__)
+review_log = SampledLogger(logger)
+
+# 2 added review_ids; older states are rebuilt by a full analysis on their next refresh
+STATE_VERSION = 2
+# Distinct words kept when the state is stored. The tail is dropped, so after a merge a word
+# from that tail restarts from zero and its count is only a lower bound.
+WORD_STATE_LIMIT = 2000
+SENTIMENT_CLASSES = ('positive', 'negative', 'neutral')
+
+_WORD_RE = re.compile(r"[a-z][a-z']{2,}")
+_ISO_DATE_RE = re.compile(r"(\d{4})-(\d{2})-\d{2}(?:$|[T ])")
+STOP_WORDS = frozenset("""
+a about above after again against all also am an and any are aren't as at be because been before being
+below between both but by can can't cannot could couldn't did didn't do does doesn't doing don't down
+during each even ever every few for from further get gets got had hadn't has hasn't have haven't having
+he her here hers herself him himself his how i i'm i've if in into is isn't it it's its itself just
+let's like me more most much my myself no nor not now of off on once one only or other ought our ours
+ourselves out over own product really same she should shouldn't so some still such than that that's
+the their theirs them themselves then there there's these they they're this those through to too
+under until up us use used using very was wasn't we we're were weren't what when where which while who
+whom why will with won't would wouldn't you you're your yours yourself yourselves
+""".split())
+
+
+def month_key(date_str: Optional[str]) -> Optional[str]:
+    """'YYYY-MM' for a review date (ISO datetime, YYYY-MM-DD, or anything dateutil reads), else None."""
+    if not date_str or not date_str.strip():
+        return None
+    iso = _ISO_DATE_RE.match(date_str)
+    if iso and 1 <= int(iso.group(2)) <= 12:  # stored dates; skips datetime parsing per review
+        return f"{iso.group(1)}-{iso.group(2)}"
+    try:
+        if 'T' in date_str:
+            return datetime.fromisoformat(date_str.split('.')[0]).strftime('%Y-%m')
+        if '-' in date_str and len(date_str.split('-')) == 3:
+            return datetime.strptime(date_str.strip(), '%Y-%m-%d').strftime('%Y-%m')
+        from dateutil import parser
+        return parser.parse(date_str).strftime('%Y-%m')
+    except Exception as e:
+        review_log.debug("Skipping unparseable date for monthly average: '%s'. Error: %s", date_str, e)
+        return None
+
+
+class AnalysisState:
+    """
+    Mergeable sufficient statistics behind an analysis.
+
+    Everything the numeric parts of an analysis are computed from (rating histogram, per-month
+    rating sums, sentiment counts and word counts) is kept as additive counts, so a refresh folds
+    in new reviews in O(new reviews); only the LLM's qualitative fields are regenerated.
+
+    The rating, monthly and sentiment figures of a merged state match a recomputation over all
+    reviews. Word counts are approximate: a stored state keeps only WORD_STATE_LIMIT words, and
+    near-duplicates are only collapsed within one fold (see add_representatives).
+
+    The state also keeps the review ids it has folded in, so a refresh folds exactly the
+    reviews it doesn't contain yet: reviews stored by a refresh whose merge failed are folded
+    by the next one, and no review is counted twice.
+    """
+
+    def __init__(self):
+        self.rating_distribution: Counter = Counter()  # star (1-5) -> reviews
+        self.rating_sum = 0.0
+        self.months: Dict[str, list] = {}  # 'YYYY-MM' -> [rating sum, reviews]
+        self.sentiment: Dict[str, float] = dict.fromkeys(SENTIMENT_CLASSES, 0.0)  # label -> reviews
+        self.words: Counter = Counter()
+        self.reviews_folded = 0  # every review seen, including ones without a valid rating
+        self.near_duplicates = 0  # reviews collapsed into a near-identical one (near_duplicates.py)
+        self.review_ids: Set[str] = set()  # api_review_id of every folded review that has one
+
+    @property
+    def rating_count(self) -> int:
+        return sum(self.rating_distribution.values())
+
+    @property
+    def sentiment_reviews(self) -> float:
+        return sum(self.sentiment.values())
+
+    @property
+    def duplicate_ratio(self) -> float:
+        return self.near_duplicates / self.reviews_folded if self.reviews_folded else 0.0
+
+    def add_review(self, review: Dict[str, Any], count_words: bool = True) -> None:
+        """Fold in one review row (review_text, review_rating, review_date, sentiment_label)."""
+        self.reviews_folded += 1
+        if review.get('api_review_id'):
+            self.review_ids.add(review['api_review_id'])
+        if count_words:
+            self.add_words(review.get('review_text'))
+        label = review.get('sentiment_label')  # see sentiment.py
+        if label in self.sentiment:
+            self.sentiment[label] += 1
+
+        rating_str = review.get('review_rating')
+        if rating_str is None:
+            return
+        try:
+            rating = float(rating_str)
+        except (ValueError, TypeError):
+            review_log.warning("Skipping invalid rating format: %s", rating_str)
+            return
+        if not 1.0 <= rating <= 5.0:
+            return
+        self.rating_distribution[int(rating)] += 1
+        self.rating_sum += rating
+        month = month_key(review.get('review_date', ''))
+        if month:
+            bucket = self.months.setdefault(month, [0.0, 0])
+            bucket[0] += rating
+            bucket[1] += 1
+
+    def add_reviews(self, reviews: Iterable[Dict[str, Any]], count_words: bool = True) -> 'AnalysisState':
+        for review in reviews:
+            self.add_review(review, count_words)
+        return self
+
+    def add_words(self, text: Optional[str]) -> None:
+        if text:
+            self.words.update(word for word in _WORD_RE.findall(text.lower()) if word not in STOP_WORDS)
+
+    def add_representatives(self, representatives: Iterable[Dict[str, Any]], collapsed: int) -> 'AnalysisState':
+        """
+        Count words from the near-duplicate representatives of reviews already folded in with
+        count_words=False, so copy-pasted reviews don't swamp the word map. Duplicates are
+        found within one fold; a refresh's copy of an older review still counts its words.
+        """
+        for review in representatives:
+            self.add_words(review.get('review_text'))
+        self.near_duplicates += collapsed
+        return self
+
+    def merge(self, other: 'AnalysisState') -> 'AnalysisState':
+        """Add another state's counts into this one."""
+        self.rating_distribution.update(other.rating_distribution)
+        self.rating_sum += other.rating_sum
+        for month, (rating_sum, count) in other.months.items():
+            bucket = self.months.setdefault(month, [0.0, 0])
+            bucket[0] += rating_sum
+            bucket[1] += count
+        for name in SENTIMENT_CLASSES:
+            self.sentiment[name] += other.sentiment.get(name, 0.0)
+        self.words.update(other.words)
+        self.reviews_folded += other.reviews_folded
+        self.near_duplicates += other.near_duplicates
+        self.review_ids.update(other.review_ids)
+        return self
+
+    def unfolded(self, review_ids: Iterable[Optional[str]]) -> Set[str]:
+        """The ids among `review_ids` that haven't been folded into this state."""
+        return {review_id for review_id in review_ids if review_id and review_id not in self.review_ids}
+
+    # --- Values stored on the analyses row ---
+
+    @property
+    def average_rating(self) -> float:
+        return self.rating_sum / self.rating_count if self.rating_count else 0.0
+
+    def ratings_over_time(self, months: int = 12) -> Dict[str, Dict[str, float]]:
+        """The newest `months` months as {month: {"average": ..., "count": ...}}."""
+        return {
+            month: {"average": round(self.months[month][0] / self.months[month][1], 2), "count": self.months[month][1]}
+            for month in sorted(self.months, reverse=True)[:months]
+        }
+
+    def sentiment_scores(self) -> Dict[str, Optional[float]]:
+        total = self.sentiment_reviews
+        return {
+            f'sentiment_{name}_score': round(self.sentiment[name] / total, 4) if total else None
+            for name in SENTIMENT_CLASSES
+        }
+
+    def word_map(self, limit: int = 50) -> Dict[str, int]:
+        return dict(self.words.most_common(limit))
+
+    # --- Serialisation (analyses.analysis_state) ---
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "version": STATE_VERSION,
+            "rating_distribution": {str(star): count for star, count in self.rating_distribution.items()},
+            "rating_sum": self.rating_sum,
+            "months": self.months,
+            "sentiment": self.sentiment,
+            "words": dict(self.words.most_common(WORD_STATE_LIMIT)),
+            "reviews_folded": self.reviews_folded,
+            "near_duplicates": self.near_duplicates,
+            "review_ids": sorted(self.review_ids),
+        }
+
+    @classmethod
+    def from_json(cls, data: Any) -> Optional['AnalysisState']:
+        """Load a stored state; None if it is missing or from an incompatible version."""
+        if isinstance(data, str):
+            data = json.loads(data)
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            return None
+        state = cls()
+        state.rating_distribution = Counter({int(star): count for star, count in data["rating_distribution"].items()})
+        state.rating_sum = data["rating_sum"]
+        state.months = {month: list(bucket) for month, bucket in data["months"].items()}
+        state.sentiment.update(data["sentiment"])
+        state.words = Counter(data["words"])
+        state.reviews_folded = data["reviews_folded"]
+        state.near_duplicates = data.get("near_duplicates", 0)
+        state.review_ids = set(data["review_ids"])
+        return state
+
+
+def compact_summary(analysis: Dict[str, Any], max_items: int = 5) -> Dict[str, Any]:
+    """
+    The qualitative part of a stored analysis, trimmed to what the LLM needs as context
+    when it updates the analysis from new reviews only.
+    """
+    def items(field: str):
+        value = analysis.get(field)
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError:
+                return []
+        return value[:max_items] if isinstance(value, list) else []
+
+    return {
+        "summary": analysis.get("summary"),
+        "themes": items("key_themes"),
+        "top_positives": items("top_positives"),
+        "top_negatives": items("top_negatives"),
+        "improvement_opportunities": items("opportunities"),
+        "competitive_insights": items("competitive_insights"),
+        "trending": analysis.get("trending"),
+        "display_name": analysis.get("display_name"),
+    }
@@ -3,20 +3,25 @@ from dotenv import load_dotenv
 import logging
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import setup_logging, worker_process_shutdown
+from kombu import Queue
+
+from worker.logging_config import configure_logging, stop_logging
+from worker.queues import INTERACTIVE_QUEUE, PRIORITY_QUEUES
 
 # Load environment variables from the project root directory (.env)
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path=dotenv_path)
-    logging.info(f".env file loaded successfully from {dotenv_path}")
+    logging.info(".env file loaded successfully from %s", dotenv_path)
 else:
-    logging.warning(f".env file not found at {dotenv_path}. Relying on system environment variables.")
+    logging.warning(".env file not found at %s. Relying on system environment variables.", dotenv_path)
 
 # Create Celery app
 app = Celery(
     'rival_recon_worker',
     broker=os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'),
-    include=['worker.tasks', 'worker.recurring_scheduler', 'worker.worker']
+    include=['worker.tasks', 'worker.recurring_scheduler', 'worker.worker', 'worker.queues']
 )
 
 # Configure Celery
@@ -27,8 +32,26 @@ app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # Interactive submissions, then refreshes, then recurring runs (see queues.py). Workers
+    # always poll the queues in this order and reserve one task at a time, so a newly queued
+    # interactive task is the next one any free slot takes.
+    task_default_queue=INTERACTIVE_QUEUE,
+    task_queues=[Queue(name, routing_key=name) for name in PRIORITY_QUEUES],
+    broker_transport_options={'queue_order_strategy': 'priority'},
+    worker_prefetch_multiplier=1,
 )
 
+@setup_logging.connect
+def on_setup_logging(loglevel=None, logfile=None, **kwargs):
+    """Replace Celery's logging setup with the queue-based handler; LOG_LEVEL overrides --loglevel."""
+    configure_logging(level=os.environ.get('LOG_LEVEL') or loglevel, log_file=logfile)
+
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kwargs):
+    """Flush any queued log records before the child process exits."""
+    stop_logging()
+
 # Configure scheduled tasks with Celery Beat
 app.conf.beat_schedule = {
     # 'process-pending-submissions': {
@@ -39,6 +62,10 @@ app.conf.beat_schedule = {
         'task': 'run_midnight_scheduler',
         'schedule': crontab(minute=0, hour=0),  # Every day at midnight
     },
+    'promote-starved-tasks': {
+        'task': 'promote_starved_tasks',
+        'schedule': 60.0,  # Every minute
+    },
     # 'process-pending-refreshes': {
     #     'task': 'process_pending_refreshes',
     #     'schedule': 60.0,  # Every minute
@@ -0,0 +1,223 @@
+import logging
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 'redis' shares breaker state between every worker; 'off' disables the breakers
+CIRCUIT_BREAKER = os.getenv('CIRCUIT_BREAKER', 'redis')
+# Calls are counted over the last one to two windows of this many seconds
+CIRCUIT_WINDOW_SECONDS = int(os.getenv('CIRCUIT_WINDOW_SECONDS', '60'))
+# The circuit opens once at least this many calls in the window failed at CIRCUIT_ERROR_RATE or more
+CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '5'))
+CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', '0.5'))
+# How long an open circuit fails fast before it lets probe requests through (half-open)
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))
+# Probe requests admitted while half-open; one success closes the circuit, one failure reopens it
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', '1'))
+# A task that hits an open circuit is retried after it may have closed, at most this many times;
+# 0 fails the submission straight away
+CIRCUIT_MAX_DEFERRALS = int(os.getenv('CIRCUIT_MAX_DEFERRALS', '3'))
+# Calls slower than this count as failures, so a provider that slows to a crawl trips the breaker too
+RAPIDAPI_SLOW_CALL_SECONDS = float(os.getenv('RAPIDAPI_SLOW_CALL_SECONDS', '15'))
+LLM_SLOW_CALL_SECONDS = float(os.getenv('LLM_SLOW_CALL_SECONDS', '120'))
+# After a Redis error, let calls through unchecked for this long instead of timing out on every call
+CIRCUIT_RETRY_AFTER = 60.0
+
+_KEY_PREFIX = 'rivalrecon:circuit:'
+# Breaker state outlives any open period by far; it only expires so abandoned endpoints disappear
+_STATE_TTL = 86400
+
+# Whether a call may go ahead. KEYS[1] is the state hash (state, since, probes);
+# ARGV: now, open seconds, half-open probes. Returns {allowed, milliseconds until it may be}.
+_ALLOW_SCRIPT = """
+local state = redis.call('hget', KEYS[1], 'state')
+if not state then return {1, 0} end
+local now = tonumber(ARGV[1])
+local wait = tonumber(redis.call('hget', KEYS[1], 'since')) + tonumber(ARGV[2]) - now
+if state == 'open' then
+    if wait > 0 then return {0, math.ceil(wait * 1000)} end
+    redis.call('hset', KEYS[1], 'state', 'half_open', 'since', ARGV[1], 'probes', 1)
+    return {1, 0}
+end
+-- half_open: probes that never reported back (their worker died) are replaced after a while
+if wait <= 0 then
+    redis.call('hset', KEYS[1], 'since', ARGV[1], 'probes', 0)
+    wait = tonumber(ARGV[2])
+end
+if tonumber(redis.call('hget', KEYS[1], 'probes')) < tonumber(ARGV[3]) then
+    redis.call('hincrby', KEYS[1], 'probes', 1)
+    return {1, 0}
+end
+return {0, math.ceil(wait * 1000)}
+"""
+
+# Record a call's outcome. KEYS: state hash, current window counts, previous window counts;
+# ARGV: now, failed (0/1), min calls, error rate, window seconds, state ttl.
+# Returns 'opened' or 'recovered' (half-open to closed) on a transition, else the unchanged state.
+_RECORD_SCRIPT = """
+local state = redis.call('hget', KEYS[1], 'state')
+if state == 'half_open' then
+    if ARGV[2] == '1' then
+        redis.call('hset', KEYS[1], 'state', 'open', 'since', ARGV[1])
+        return 'opened'
+    end
+    redis.call('del', KEYS[1], KEYS[2], KEYS[3])
+    return 'recovered'
+elseif state == 'open' then
+    return 'open'
+end
+redis.call('hincrby', KEYS[2], 'calls', 1)
+if ARGV[2] == '1' then redis.call('hincrby', KEYS[2], 'failures', 1) end
+redis.call('expire', KEYS[2], 2 * tonumber(ARGV[5]))
+local calls = (tonumber(redis.call('hget', KEYS[2], 'calls')) or 0) + (tonumber(redis.call('hget', KEYS[3], 'calls')) or 0)
+local failures = (tonumber(redis.call('hget', KEYS[2], 'failures')) or 0) + (tonumber(redis.call('hget', KEYS[3], 'failures')) or 0)
+if calls >= tonumber(ARGV[3]) and failures >= tonumber(ARGV[4]) * calls then
+    redis.call('hset', KEYS[1], 'state', 'open', 'since', ARGV[1])
+    redis.call('expire', KEYS[1], tonumber(ARGV[6]))
+    redis.call('del', KEYS[2], KEYS[3])
+    return 'opened'
+end
+return 'closed'
+"""
+
+
+class CircuitOpenError(Exception):
+    """A provider endpoint's circuit is open; the call was not made."""
+
+    def __init__(self, circuit: str, retry_after: float):
+        super().__init__(f"{circuit} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.circuit = circuit
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one provider endpoint, shared by every worker through Redis.
+
+    Closed, calls go ahead and their outcomes are counted over a sliding window; once
+    CIRCUIT_MIN_CALLS calls have failed (an error status, a network error, or slower
+    than `slow_call_seconds`) at CIRCUIT_ERROR_RATE or more, the circuit opens. Open,
+    before_call raises CircuitOpenError without calling the provider, so tasks fail fast
+    or are deferred instead of each waiting out the outage. After CIRCUIT_OPEN_SECONDS it
+    goes half-open and admits CIRCUIT_HALF_OPEN_PROBES probe calls: a success closes
+    it, a failure opens it again.
+
+    State changes run as Lua scripts, so concurrent workers agree on them. Like the
+    product cache, the breaker never fails a call itself: if Redis is unavailable, calls
+    go ahead unchecked.
+    """
+
+    def __init__(self, provider: str, endpoint: str, slow_call_seconds: float, redis_client=None):
+        self.name = f"{provider}:{endpoint}"
+        self.slow_call_seconds = slow_call_seconds
+        self.redis_client = redis_client
+        self._unavailable_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return CIRCUIT_BREAKER == 'redis' and time.monotonic() >= self._unavailable_until
+
+    def _redis(self):
+        if self.redis_client is not None:
+            return self.redis_client
+        from worker.clients import get_redis
+        return get_redis()
+
+    def _backend_failed(self, e: Exception) -> None:
+        logger.warning("Circuit breaker %s unavailable (%s); not checking it for %.0fs", self.name, e, CIRCUIT_RETRY_AFTER)
+        self._unavailable_until = time.monotonic() + CIRCUIT_RETRY_AFTER
+
+    def before_call(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: if the circuit is open, or half-open with its probes in flight
+        """
+        if not self.enabled:
+            return
+        try:
+            client = self._redis()
+            allowed, wait_ms = client.register_script(_ALLOW_SCRIPT)(
+                keys=[_KEY_PREFIX + self.name], args=[time.time(), CIRCUIT_OPEN_SECONDS, CIRCUIT_HALF_OPEN_PROBES])
+        except Exception as e:
+            self._backend_failed(e)
+            return
+        if not int(allowed):
+            raise CircuitOpenError(self.name, int(wait_ms) / 1000)
+
+    def after_call(self, failed: bool, seconds: float) -> None:
+        """Record a call's outcome; calls slower than slow_call_seconds count as failed."""
+        if not self.enabled:
+            return
+        failed = failed or seconds >= self.slow_call_seconds
+        now = time.time()
+        window = int(now // CIRCUIT_WINDOW_SECONDS)
+        key = _KEY_PREFIX + self.name
+        try:
+            transition = self._redis().register_script(_RECORD_SCRIPT)(
+                keys=[key, f"{key}:w:{window}", f"{key}:w:{window - 1}"],
+                args=[now, int(failed), CIRCUIT_MIN_CALLS, CIRCUIT_ERROR_RATE, CIRCUIT_WINDOW_SECONDS, _STATE_TTL])
+        except Exception as e:
+            self._backend_failed(e)
+            return
+        transition = transition.decode() if isinstance(transition, bytes) else transition
+        if transition == 'opened':
+            logger.error("Circuit %s opened: failing calls fast for %.0fs", self.name, CIRCUIT_OPEN_SECONDS)
+        elif transition == 'recovered':
+            logger.info("Circuit %s closed: probe call succeeded", self.name)
+
+
+def failed_status(status: int, count_429: bool = False) -> bool:
+    """
+    Responses that count against a provider: server errors, and 429 only with `count_429`.
+
+    A RapidAPI 429 means our own plan budget ran over. The rate limiter backs off and
+    retries those, and counting them would let one burst open the circuit for every
+    worker. Nothing of ours paces DeepSeek, so there a 429 means it is overloaded.
+    """
+    return status >= 500 or (count_429 and status == 429)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str, endpoint: str, slow_call_seconds: float) -> CircuitBreaker:
+    """Process-wide breaker for a provider endpoint, e.g. get_breaker('rapidapi', 'product-reviews', ...)."""
+    name = f"{provider}:{endpoint}"
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(provider, endpoint, slow_call_seconds)
+        return _breakers[name]
+
+
+def deferral_countdown(retry_after: float) -> int:
+    """Seconds to defer a task by: until the circuit may half-open, spread so deferred tasks don't all probe at once."""
+    return math.ceil(retry_after + random.uniform(0, CIRCUIT_OPEN_SECONDS))
+
+
+def defer_task(task, submission_id: Optional[str], reason: str, retry_after: float) -> None:
+    """
+    Retry the running Celery task once the circuit may have closed.
+
+    Args:
+        task: The running task (its request holds the retry count)
+        submission_id: For the log
+        reason: Why the task stopped (the CircuitOpenError message)
+        retry_after: Seconds until the circuit half-opens (CircuitOpenError.retry_after)
+
+    Raises celery's Retry; returns only when the task has already been deferred
+    CIRCUIT_MAX_DEFERRALS times, and the caller should then fail the submission.
+    """
+    retries = task.request.retries or 0
+    if retries >= CIRCUIT_MAX_DEFERRALS:
+        logger.error("[Submission ID: %s] %s; deferred %s times already, giving up", submission_id, reason, retries)
+        return
+    countdown = deferral_countdown(retry_after)
+    logger.warning("[Submission ID: %s] %s; deferring %s by %ss "
+                   "(deferral %s of %s)", submission_id, reason, task.name, countdown, retries + 1, CIRCUIT_MAX_DEFERRALS)
+    raise task.retry(countdown=countdown, max_retries=CIRCUIT_MAX_DEFERRALS)
@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger(__name__)
+
+# One Supabase client (and one Redis client) per process, created on first use. Importing
+# worker modules therefore needs no credentials and opens no connections.
+_supabase: Optional['Client'] = None
+_supabase_lock = threading.Lock()
+_redis = None
+_redis_lock = threading.Lock()
+
+# Redis for shared worker state (product cache, locks); defaults to the Celery broker
+REDIS_URL = os.getenv('REDIS_URL') or os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+
+
+def get_supabase() -> 'Client':
+    """
+    Return the process-wide Supabase client, creating it on first call.
+
+    Raises:
+        ValueError: if SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY is not set.
+    """
+    global _supabase
+    if _supabase is not None:
+        return _supabase
+    with _supabase_lock:
+        if _supabase is None:
+            supabase_url = os.getenv('SUPABASE_URL')
+            supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')  # Use the service role key
+            if not supabase_url or not supabase_key:
+                logger.error("Supabase credentials not found in environment variables")
+                raise ValueError("Supabase credentials not configured")
+
+            from supabase import create_client
+            from worker.usage import count_db_round_trip
+            client = create_client(supabase_url, supabase_key)
+            # Every PostgREST request is counted against the running task's usage ledger
+            client.postgrest.session.event_hooks['request'].append(count_db_round_trip)
+            _supabase = client
+            logger.info("Supabase client initialized successfully")
+    return _supabase
+
+
+def get_redis():
+    """
+    Return the process-wide Redis client for REDIS_URL, creating it on first call.
+
+    Timeouts are short: callers treat Redis as an optimisation and carry on without it.
+    """
+    global _redis
+    if _redis is not None:
+        return _redis
+    with _redis_lock:
+        if _redis is None:
+            import redis
+            _redis = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=1.0, socket_timeout=2.0)
+    return _redis
+
+
+def _reset_after_fork() -> None:
+    """HTTP and Redis connection pools must not be shared with prefork children; each builds its own."""
+    global _supabase, _supabase_lock, _redis, _redis_lock
+    _supabase = None
+    _supabase_lock = threading.Lock()
+    _redis = None
+    _redis_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
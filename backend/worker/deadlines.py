@@ -0,0 +1,126 @@
+import contextlib
+import contextvars
+import os
+import time
+from typing import Iterator, Optional, Tuple
+
+# Wall-clock budget for one submission, from the start of its scrape to its stored analysis
+SUBMISSION_TIME_BUDGET = float(os.getenv('SUBMISSION_TIME_BUDGET', '900'))
+# Share of the budget the scrape gets; analysis gets the rest, a refresh (both in one task) all of it
+SCRAPE_BUDGET_SHARE = float(os.getenv('SCRAPE_BUDGET_SHARE', '0.7'))
+# Fetching stops this long before a stage's soft time limit, leaving time to store what was fetched
+DEADLINE_STORE_RESERVE = float(os.getenv('DEADLINE_STORE_RESERVE', '60'))
+# Celery kills a task this long after its soft time limit
+TASK_TIME_LIMIT_GRACE = float(os.getenv('TASK_TIME_LIMIT_GRACE', '60'))
+
+# Per-request timeouts: connecting, and waiting for the next bytes of a response
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '10'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '180'))
+
+STAGE_BUDGETS = {
+    'scrape': SUBMISSION_TIME_BUDGET * SCRAPE_BUDGET_SHARE,
+    'analyze': SUBMISSION_TIME_BUDGET * (1 - SCRAPE_BUDGET_SHARE),
+    'refresh': SUBMISSION_TIME_BUDGET,
+}
+
+# Submission status for a scrape or analysis that ran out of time and stored what it had
+PARTIAL_STATUS = 'partially_completed'
+
+_current: contextvars.ContextVar[Optional['Deadline']] = contextvars.ContextVar('stage_deadline', default=None)
+
+
+def soft_time_limit(stage: str) -> int:
+    """Celery soft_time_limit for a stage's task: its share of SUBMISSION_TIME_BUDGET."""
+    return int(STAGE_BUDGETS[stage])
+
+
+def time_limit(stage: str) -> int:
+    """Celery (hard) time_limit for a stage's task."""
+    return int(STAGE_BUDGETS[stage] + TASK_TIME_LIMIT_GRACE)
+
+
+class Deadline:
+    """
+    When the running stage has to stop fetching, and whether it had to.
+
+    The deadline falls DEADLINE_STORE_RESERVE before the task's soft time limit (at most a
+    quarter of the stage), so scrapes stop paging and the LLM call gives up in time to
+    store what they have; Celery's limits are only the backstop for code that never checks.
+    Like the usage ledger, the current deadline lives in a context variable, which asyncio
+    tasks and asyncio.to_thread carry along.
+    """
+
+    __slots__ = ('stage', 'expires_at', 'reached')
+
+    def __init__(self, stage: str, expires_at: float):
+        self.stage = stage
+        self.expires_at = expires_at
+        # Set once something stopped early because of this deadline
+        self.reached = False
+
+    @classmethod
+    def for_stage(cls, stage: str) -> 'Deadline':
+        budget = STAGE_BUDGETS[stage]
+        return cls(stage, time.monotonic() + budget - min(DEADLINE_STORE_RESERVE, budget / 4))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self) -> bool:
+        """True (and remembered in `reached`) once the deadline has passed; call before starting more work."""
+        if self.remaining() <= 0:
+            self.reached = True
+        return self.reached
+
+    def cap(self, seconds: float) -> float:
+        """A timeout of at most `seconds` that ends no later than the deadline (never zero)."""
+        return max(0.1, min(seconds, self.remaining()))
+
+
+@contextlib.contextmanager
+def stage_deadline(stage: str) -> Iterator[Deadline]:
+    """
+    Make a deadline for `stage` the current one for the duration of the block.
+
+    Inside a block for the same stage (each submission of a batch scrape) the new deadline
+    keeps the outer expiry but has its own `reached` flag, so only the submissions that
+    were cut short are marked partial.
+    """
+    outer = _current.get()
+    if outer is not None and outer.stage == stage:
+        deadline = Deadline(stage, outer.expires_at)
+    else:
+        deadline = Deadline.for_stage(stage)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """The running stage's deadline, or None outside stage_deadline."""
+    return _current.get()
+
+
+def deadline_reached() -> bool:
+    """Whether the running stage is out of time (always False without a deadline)."""
+    deadline = _current.get()
+    return deadline is not None and deadline.check()
+
+
+def http_timeout():
+    """aiohttp timeout for one scraper request: connect and read limits, capped by the deadline."""
+    import aiohttp
+    deadline = _current.get()
+    read = deadline.cap(HTTP_READ_TIMEOUT) if deadline is not None else HTTP_READ_TIMEOUT
+    return aiohttp.ClientTimeout(total=None, connect=min(HTTP_CONNECT_TIMEOUT, read), sock_read=read)
+
+
+def llm_timeout() -> Tuple[float, float]:
+    """(connect, read) timeout for an LLM request, as `requests` takes it, capped by the deadline."""
+    deadline = _current.get()
+    read = deadline.cap(LLM_READ_TIMEOUT) if deadline is not None else LLM_READ_TIMEOUT
+    return min(LLM_CONNECT_TIMEOUT, read), read
@@ -0,0 +1,195 @@
+import html
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as _SelectolaxParser
+except ImportError:  # selectolax is optional; lxml or the stdlib parser are used instead
+    _SelectolaxParser = None
+
+try:
+    import lxml.html as _lxml_html
+    import cssselect  # noqa: F401  (lxml needs it for .cssselect())
+except ImportError:
+    _lxml_html = None
+
+logger = logging.getLogger(__name__)
+
+# 'auto' picks the fastest installed backend: selectolax, then lxml, then BeautifulSoup's html.parser
+HTML_PARSER = os.getenv('HTML_PARSER', 'auto')
+
+_JSON_LD_RE = re.compile(r'<script\b[^>]*?type\s*=\s*["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.I | re.S)
+_OG_META_RE = re.compile(r'<meta\b[^>]*?\bproperty\s*=\s*["\']((?:og|product):[^"\']+)["\'][^>]*>', re.I)
+_CONTENT_ATTR_RE = re.compile(r'\bcontent\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.I)
+
+
+class HtmlParserBackend:
+    """
+    One HTML parser library behind a single call: parse a page once and return the
+    stripped text of the first match for each CSS selector.
+    """
+
+    name = ''
+
+    def select_text(self, page_html: str, selectors: Dict[str, List[str]]) -> Dict[str, Optional[str]]:
+        """
+        Args:
+            page_html: The page source
+            selectors: Field name -> CSS selectors to try in order
+
+        Returns:
+            Field name -> text of the first selector that matched, or None
+        """
+        root = self.parse(page_html)
+        found = {}
+        for field, candidates in selectors.items():
+            found[field] = None
+            for selector in candidates:
+                text = self.first_text(root, selector)
+                if text:
+                    found[field] = text
+                    break
+        return found
+
+    def parse(self, page_html: str) -> Any:
+        raise NotImplementedError
+
+    def first_text(self, root: Any, selector: str) -> Optional[str]:
+        raise NotImplementedError
+
+
+class SelectolaxBackend(HtmlParserBackend):
+    name = 'selectolax'
+
+    def parse(self, page_html):
+        return _SelectolaxParser(page_html)
+
+    def first_text(self, root, selector):
+        node = root.css_first(selector)
+        return node.text(strip=True) if node is not None else None
+
+
+class LxmlBackend(HtmlParserBackend):
+    name = 'lxml'
+
+    def parse(self, page_html):
+        return _lxml_html.fromstring(page_html)
+
+    def first_text(self, root, selector):
+        nodes = root.cssselect(selector)
+        return nodes[0].text_content().strip() if nodes else None
+
+
+class SoupBackend(HtmlParserBackend):
+    name = 'html.parser'
+
+    def parse(self, page_html):
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(page_html, 'html.parser')
+
+    def first_text(self, root, selector):
+        node = root.select_one(selector)
+        return node.get_text(strip=True) if node is not None else None
+
+
+_BACKENDS = {'selectolax': SelectolaxBackend, 'lxml': LxmlBackend, 'html.parser': SoupBackend}
+
+
+def available_backends() -> List[str]:
+    """Installed backends, fastest first."""
+    names = []
+    if _SelectolaxParser is not None:
+        names.append('selectolax')
+    if _lxml_html is not None:
+        names.append('lxml')
+    names.append('html.parser')
+    return names
+
+
+def get_html_parser(name: str = HTML_PARSER) -> HtmlParserBackend:
+    """The configured backend, falling back to the fastest installed one if it is missing."""
+    installed = available_backends()
+    if name != 'auto' and name not in installed:
+        logger.warning("HTML parser backend %r is not installed; using %s", name, installed[0])
+        name = 'auto'
+    return _BACKENDS[installed[0] if name == 'auto' else name]()
+
+
+def extract_structured_data(page_html: str) -> Dict[str, Any]:
+    """
+    Pull JSON-LD blocks and Open Graph meta tags out of a page without building a DOM.
+
+    Storefront themes put the product's name, price, brand and AggregateRating in
+    `<script type="application/ld+json">` and `<meta property="og:*">` tags, so a couple
+    of regex scans over the raw text replace a full parse for these fields.
+
+    Returns:
+        Dictionary with `json_ld` (list of decoded objects, `@graph` entries flattened)
+        and `meta` (property -> content for og:* and product:* tags; first one wins)
+    """
+    json_ld = []
+    for match in _JSON_LD_RE.finditer(page_html):
+        try:
+            data = json.loads(match.group(1))
+        except json.JSONDecodeError:
+            continue
+        for item in data if isinstance(data, list) else [data]:
+            if isinstance(item, dict):
+                json_ld.extend(g for g in item.get('@graph', [item]) if isinstance(g, dict))
+
+    meta = {}
+    for match in _OG_META_RE.finditer(page_html):
+        content = _CONTENT_ATTR_RE.search(match.group(0))
+        if content:
+            meta.setdefault(match.group(1).lower(), html.unescape(content.group(1) or content.group(2) or ''))
+    return {"json_ld": json_ld, "meta": meta}
+
+
+def _is_type(item: Dict[str, Any], name: str) -> bool:
+    kind = item.get('@type')
+    return name in kind if isinstance(kind, list) else kind == name
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(str(value).replace(',', '')) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def product_from_structured_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flatten the JSON-LD Product (and its AggregateRating/Offer) plus og:* tags into one dict.
+
+    Args:
+        data: Output of extract_structured_data
+
+    Returns:
+        Dictionary with title, description, brand, price, currency, availability, images,
+        rating and review_count; fields the page does not provide are None
+    """
+    meta = data.get("meta", {})
+    product = next((item for item in data.get("json_ld", []) if _is_type(item, 'Product')), {})
+    rating = product.get("aggregateRating") or next(
+        (item for item in data.get("json_ld", []) if _is_type(item, 'AggregateRating')), {})
+    offers = product.get("offers") or {}
+    offer = (offers[0] if offers else {}) if isinstance(offers, list) else offers
+    brand = product.get("brand")
+    images = product.get("image") or meta.get("og:image")
+    images = images if isinstance(images, list) else [images] if images else []
+
+    return {
+        "title": product.get("name") or meta.get("og:title"),
+        "description": product.get("description") or meta.get("og:description"),
+        "brand": brand.get("name") if isinstance(brand, dict) else brand,
+        "price": _number(offer.get("price") or offer.get("lowPrice") or meta.get("og:price:amount")
+                         or meta.get("product:price:amount")),
+        "currency": offer.get("priceCurrency") or meta.get("og:price:currency") or meta.get("product:price:currency"),
+        "availability": str(offer.get("availability") or '').rsplit('/', 1)[-1] or None,
+        "images": [image.get("url") if isinstance(image, dict) else image for image in images],
+        "rating": _number(rating.get("ratingValue")),
+        "review_count": int(_number(rating.get("reviewCount") or rating.get("ratingCount")) or 0) or None,
+    }
@@ -0,0 +1,136 @@
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from typing import Dict, Optional, Union
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Listener draining the shared log queue. Only one per process; see configure_logging.
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+def _resolve_level(level: Union[str, int, None]) -> int:
+    """Turn a level name ('debug', 'INFO') or number into a logging level, defaulting to INFO."""
+    if isinstance(level, int):
+        return level
+    if level:
+        resolved = logging.getLevelName(str(level).upper())
+        if isinstance(resolved, int):
+            return resolved
+    return logging.INFO
+
+
+def configure_logging(level: Union[str, int, None] = None, log_file: Optional[str] = None) -> None:
+    """
+    Configure root logging for a worker process.
+
+    Records are handed to a QueueHandler, so the calling thread never writes them; a
+    background QueueListener applies LOG_FORMAT and does the (possibly blocking)
+    stream/file writes. The caller still builds each emitted message (QueueHandler.prepare
+    merges it with its args and any traceback), so hot paths pass %-style args, which
+    are only merged for records that pass the level check. Safe to call more than
+    once - later calls only adjust the level.
+
+    Args:
+        level: Log level name or number. Falls back to the LOG_LEVEL env var, then INFO.
+        log_file: Optional file to write to in addition to stderr. Falls back to the
+            LOG_FILE env var; no file handler is created when neither is set.
+    """
+    global _listener
+
+    root = logging.getLogger()
+    root.setLevel(_resolve_level(level or os.getenv('LOG_LEVEL')))
+
+    with _listener_lock:
+        if _listener is not None:
+            return
+
+        formatter = logging.Formatter(os.getenv('LOG_FORMAT', DEFAULT_FORMAT))
+        handlers = [logging.StreamHandler()]
+        log_file = log_file or os.getenv('LOG_FILE')
+        if log_file:
+            handlers.append(logging.FileHandler(log_file))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue: queue.Queue = queue.Queue(-1)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def _restart_listener_after_fork() -> None:
+    """Prefork pool children don't inherit the listener thread; give each child its own."""
+    global _listener
+    if _listener is None:
+        return
+    log_queue: queue.Queue = queue.Queue(-1)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+
+def stop_logging() -> None:
+    """Flush and stop the background log listener (e.g. on worker shutdown)."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class SampledLogger:
+    """
+    Wrapper for per-review / per-page log lines that would otherwise flood the logs.
+
+    Each distinct message template is rate limited to `max_per_second` records and,
+    beyond that, only a random `sample_rate` fraction is emitted. The enabled-level
+    check happens first, so disabled levels cost a single method call and no
+    string formatting. Arguments are passed through unformatted (lazy %-style).
+    """
+
+    def __init__(self, logger: logging.Logger, sample_rate: Optional[float] = None,
+                 max_per_second: Optional[int] = None):
+        self.logger = logger
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+        self.max_per_second = max_per_second if max_per_second is not None else int(os.getenv('LOG_MAX_PER_SECOND', '20'))
+        self._windows: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def _should_emit(self, key: str) -> bool:
+        now = int(time.monotonic())
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window[0] != now:
+                window = self._windows[key] = [now, 0]
+            window[1] += 1
+            if window[1] <= self.max_per_second:
+                return True
+        return random.random() < self.sample_rate
+
+    def log(self, level: int, msg: str, *args, **kwargs) -> None:
+        if self.logger.isEnabledFor(level) and self._should_emit(msg):
+            self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg: str, *args, **kwargs) -> None:
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg: str, *args, **kwargs) -> None:
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg: str, *args, **kwargs) -> None:
+        self.log(logging.WARNING, msg, *args, **kwargs)
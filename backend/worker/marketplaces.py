@@ -0,0 +1,71 @@
+import logging
+from typing import Iterable, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Amazon storefront domains and the RapidAPI `country` code for each
+# (see .cursor/rules/RAPIDAPI_AMAZON_CONFIG.mdc for the supported list)
+AMAZON_MARKETPLACES = {
+    'amazon.com': 'US',
+    'amazon.com.au': 'AU',
+    'amazon.com.br': 'BR',
+    'amazon.ca': 'CA',
+    'amazon.cn': 'CN',
+    'amazon.fr': 'FR',
+    'amazon.de': 'DE',
+    'amazon.in': 'IN',
+    'amazon.it': 'IT',
+    'amazon.com.mx': 'MX',
+    'amazon.nl': 'NL',
+    'amazon.sg': 'SG',
+    'amazon.es': 'ES',
+    'amazon.com.tr': 'TR',
+    'amazon.ae': 'AE',
+    'amazon.co.uk': 'GB',
+    'amazon.co.jp': 'JP',
+    'amazon.sa': 'SA',
+    'amazon.pl': 'PL',
+    'amazon.se': 'SE',
+    'amazon.com.be': 'BE',
+    'amazon.eg': 'EG',
+}
+COUNTRY_DOMAINS = {country: domain for domain, country in AMAZON_MARKETPLACES.items()}
+DEFAULT_COUNTRY = 'US'
+
+
+def country_from_url(url: str) -> str:
+    """Marketplace country for an Amazon URL, e.g. 'https://www.amazon.co.uk/dp/...' -> 'GB'."""
+    host = (urlparse(url).hostname or '').lower()
+    for domain, country in AMAZON_MARKETPLACES.items():
+        if host == domain or host.endswith('.' + domain):
+            return country
+    return DEFAULT_COUNTRY
+
+
+def marketplace_url(country: str, asin: str) -> str:
+    """Clean product URL for an ASIN on a marketplace."""
+    return f"https://www.{COUNTRY_DOMAINS.get(country, 'amazon.com')}/dp/{asin}"
+
+
+def resolve_marketplaces(url: str, requested: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Countries to scrape for a submission.
+
+    Args:
+        url: The submitted product URL; its domain is the primary marketplace
+        requested: Optional country codes from the submission (submissions.marketplaces)
+
+    Returns:
+        De-duplicated, upper-cased country codes with the URL's marketplace first
+    """
+    countries = [country_from_url(url)]
+    for code in requested or []:
+        code = str(code).strip().upper()
+        if code == 'UK':
+            code = 'GB'
+        if code not in COUNTRY_DOMAINS:
+            logger.warning("Ignoring unsupported marketplace country: %s", code)
+        elif code not in countries:
+            countries.append(code)
+    return countries
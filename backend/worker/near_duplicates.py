@@ -0,0 +1,157 @@
+import logging
+import os
+import string
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Jaccard similarity of word-shingle sets at which two reviews count as the same text
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.8'))
+SHINGLE_WORDS = 3
+# One-permutation MinHash: SIGNATURE_BINS = LSH_BANDS * LSH_ROWS. 8 bands of 2 rows make
+# pairs at Jaccard 0.8 candidates with probability ~1 - (1 - 0.8**2)**8 > 0.999, and the
+# exact Jaccard check removes the false positives.
+LSH_BANDS = 8
+LSH_ROWS = 2
+SIGNATURE_BINS = LSH_BANDS * LSH_ROWS
+
+# Odd 64-bit multipliers that mix word hashes into a shingle hash (position-dependent)
+_MIX = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9)
+_MASK = (1 << 64) - 1
+_PUNCTUATION = str.maketrans({c: ' ' for c in string.punctuation if c != "'"})
+_SEPARATOR = ' \x00 '
+
+
+def _words(text: str) -> List[str]:
+    return text.lower().translate(_PUNCTUATION).split()
+
+
+def _short_shingle(words: List[str]) -> int:
+    """The single shingle of a text shorter than SHINGLE_WORDS words."""
+    return sum((hash(word) & _MASK) * mix for word, mix in zip(words, _MIX)) & _MASK
+
+
+def cluster_near_duplicates(texts: Sequence[str], threshold: float = NEAR_DUPLICATE_THRESHOLD) -> List[int]:
+    """
+    Group near-identical texts with MinHash signatures and an LSH index, in one numpy pass.
+
+    Words are hashed once; every word 3-gram's hash is then mixed from its three word hashes
+    for all texts at once. Each text's one-permutation MinHash signature (the smallest
+    shingle hash in each of SIGNATURE_BINS bins, empty bins filled from their right-hand
+    neighbour) is computed with a single sort. Signatures are cut into LSH bands; texts
+    sharing a band bucket are candidates, and a candidate joins its bucket's first text
+    (union-find) only if their exact shingle Jaccard reaches `threshold`.
+
+    Args:
+        texts: Review texts
+        threshold: Minimum Jaccard similarity of the word 3-gram sets
+
+    Returns:
+        For each text, the index of its cluster's root (the lowest index in the cluster)
+    """
+    import numpy as np
+
+    n = len(texts)
+    parent = list(range(n))
+    if n < 2:
+        return parent
+
+    # Tokenise and hash every text in one go; a NUL token (never in stored text) separates them
+    tokens = _SEPARATOR.join(text or '' for text in texts).lower().translate(_PUNCTUATION).split()
+    flat = np.fromiter(map(hash, tokens), dtype=np.int64, count=len(tokens)).view(np.uint64)
+    separators = flat == np.uint64(hash(_SEPARATOR.strip()) & _MASK)
+    doc_of_word = np.cumsum(separators)
+    words_per_doc = np.bincount(doc_of_word, minlength=n) - (np.arange(n) > 0)  # less the separator
+
+    # Shingle p covers words p..p+2 and is kept only if all three are words of the same text
+    if len(flat) >= SHINGLE_WORDS:
+        mixed = flat[:-2] * np.uint64(_MIX[0]) + flat[1:-1] * np.uint64(_MIX[1]) + flat[2:] * np.uint64(_MIX[2])
+        keep = (doc_of_word[:-2] == doc_of_word[2:]) & ~separators[:-2]
+        shingle_docs, shingle_values = doc_of_word[:-2][keep], mixed[keep]
+    else:
+        shingle_docs, shingle_values = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+    short = np.flatnonzero((words_per_doc > 0) & (words_per_doc < SHINGLE_WORDS)).tolist()
+    if short:
+        shingle_docs = np.concatenate([shingle_docs, np.array(short, dtype=np.int64)])
+        shingle_values = np.concatenate([shingle_values, np.array(
+            [_short_shingle(_words(texts[i])) for i in short], dtype=np.uint64)])
+
+    # Signatures: the smallest shingle hash in each (text, bin) cell
+    empty = np.iinfo(np.uint64).max
+    signatures = np.full(n * SIGNATURE_BINS, empty, dtype=np.uint64)
+    cells = shingle_docs * SIGNATURE_BINS + (shingle_values % np.uint64(SIGNATURE_BINS)).astype(np.int64)
+    np.minimum.at(signatures, cells, shingle_values)
+    signatures = signatures.reshape(n, SIGNATURE_BINS)
+    has_shingles = signatures.min(axis=1) != empty
+    for _ in range(SIGNATURE_BINS - 1):  # densify: an empty bin borrows the next bin's value, plus one per step
+        holes = signatures == empty
+        if not holes[has_shingles].any():
+            break
+        borrowed = np.roll(signatures, -1, axis=1)
+        fill = holes & (borrowed != empty)
+        signatures[fill] = borrowed[fill] + np.uint64(1)
+
+    # Exact shingle sets, built only for texts that turn out to be candidates
+    by_doc = np.argsort(shingle_docs, kind='stable')
+    bounds = np.searchsorted(shingle_docs[by_doc], np.arange(n + 1))
+    sets: Dict[int, set] = {}
+
+    def shingle_set(i: int) -> set:
+        if i not in sets:
+            sets[i] = set(shingle_values[by_doc[bounds[i]:bounds[i + 1]]].tolist())
+        return sets[i]
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    docs = np.flatnonzero(has_shingles)
+    for band in range(LSH_BANDS):
+        columns = signatures[docs, band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        keys = columns[:, 0] * np.uint64(_MIX[0]) + columns[:, 1] * np.uint64(_MIX[1])
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        group_first = order[np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))]
+        for a, b in zip(docs[group_first[~starts]].tolist(), docs[order[~starts]].tolist()):
+            root_a, root_b = find(a), find(b)
+            if root_a == root_b:
+                continue
+            set_a, set_b = shingle_set(a), shingle_set(b)
+            if len(set_a & set_b) >= threshold * len(set_a | set_b):
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+    return [find(i) for i in range(n)]
+
+
+def collapse_near_duplicates(reviews: Sequence[Dict[str, Any]],
+                             threshold: float = NEAR_DUPLICATE_THRESHOLD) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Collapse clusters of near-identical reviews to one representative each.
+
+    The representative is the cluster's longest text; it is returned as a copy carrying
+    `duplicate_count` (cluster size). Reviews without text are kept as they are.
+
+    Args:
+        reviews: Review rows with review_text
+        threshold: Minimum Jaccard similarity, see cluster_near_duplicates
+
+    Returns:
+        Tuple of (representatives in input order, number of reviews collapsed into them)
+    """
+    roots = cluster_near_duplicates([review.get('review_text') or '' for review in reviews], threshold)
+    members: Dict[int, List[int]] = defaultdict(list)
+    for index, root in enumerate(roots):
+        members[root].append(index)
+
+    representatives = []
+    for root in sorted(members):
+        cluster = members[root]
+        if len(cluster) == 1:
+            representatives.append(reviews[root])
+            continue
+        best = max(cluster, key=lambda i: len(reviews[i].get('review_text') or ''))
+        representatives.append({**reviews[best], 'duplicate_count': len(cluster)})
+    return representatives, len(reviews) - len(representatives)
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; gzip is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 'supabase' (Supabase Storage bucket), 'local' (content-addressed directory) or 'off'. Off, rows
+# keep the raw product JSON inline as before. 'local' is only for a single worker or a directory
+# every worker mounts, since a row's payload is readable only where it was written.
+RAW_PAYLOAD_ARCHIVE = os.getenv('RAW_PAYLOAD_ARCHIVE', 'off')
+# Resolved once at import, so the archive doesn't move with the working directory
+RAW_PAYLOAD_DIR = os.path.abspath(os.getenv('RAW_PAYLOAD_DIR', 'raw_payloads'))
+RAW_PAYLOAD_BUCKET = os.getenv('RAW_PAYLOAD_BUCKET', 'raw-payloads')
+
+_CODECS = ('zst', 'gz')
+
+
+class PayloadArchive:
+    """
+    Write-once store for raw API response bodies.
+
+    Each body is stored exactly once under the SHA-256 of its bytes, compressed with
+    zstd when the `zstandard` package is installed and gzip otherwise. Rows keep only
+    the hash (plus, for reviews, the offset of the review inside `data.reviews`), so the
+    same page is never serialised or written more than once.
+    """
+
+    def __init__(self, backend: str = RAW_PAYLOAD_ARCHIVE, directory: str = RAW_PAYLOAD_DIR,
+                 bucket: str = RAW_PAYLOAD_BUCKET, storage_client=None):
+        self.backend = backend
+        self.directory = Path(directory)
+        self.bucket = bucket
+        self.storage_client = storage_client
+        self.codec = 'zst' if zstandard else 'gz'
+        # Hashes already stored by this process, so repeat pages skip the existence check
+        self._recent: 'OrderedDict[str, None]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend in ('local', 'supabase')
+
+    def _storage(self):
+        """Supabase Storage API, using the process-wide client unless one was injected."""
+        if self.storage_client is None:
+            from worker.clients import get_supabase
+            self.storage_client = get_supabase()
+        return self.storage_client.storage
+
+    @staticmethod
+    def _object_name(digest: str, codec: str) -> str:
+        return f"{digest[:2]}/{digest}.json.{codec}"
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.codec == 'zst':
+            return zstandard.ZstdCompressor(level=3).compress(payload)
+        return gzip.compress(payload, compresslevel=5)
+
+    @staticmethod
+    def _decompress(data: bytes, codec: str) -> bytes:
+        if codec == 'zst':
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read .zst payloads")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _remember(self, digest: str) -> bool:
+        """Record a stored hash; returns True if it was already known."""
+        with self._lock:
+            if digest in self._recent:
+                self._recent.move_to_end(digest)
+                return True
+            self._recent[digest] = None
+            if len(self._recent) > 4096:
+                self._recent.popitem(last=False)
+            return False
+
+    def put(self, payload: bytes) -> Optional[str]:
+        """Store a raw response body and return its SHA-256, or None if archiving is off or fails."""
+        if not self.enabled or not payload:
+            return None
+        digest = hashlib.sha256(payload).hexdigest()
+        if self._remember(digest):
+            return digest
+        name = self._object_name(digest, self.codec)
+        try:
+            if self.backend == 'local':
+                path = self.directory / name
+                if not any((self.directory / self._object_name(digest, c)).exists() for c in _CODECS):
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp_path = path.with_suffix(path.suffix + f".{os.getpid()}.tmp")
+                    tmp_path.write_bytes(self._compress(payload))
+                    os.replace(tmp_path, path)
+            else:
+                try:
+                    self._storage().from_(self.bucket).upload(
+                        name, self._compress(payload), {"content-type": "application/octet-stream"})
+                except Exception as e:
+                    # Content-addressed: an existing object already holds these exact bytes
+                    if 'Duplicate' not in str(e) and 'already exists' not in str(e):
+                        raise
+            return digest
+        except Exception as e:
+            with self._lock:
+                self._recent.pop(digest, None)
+            logger.warning("Failed to archive raw payload %s: %s", digest[:12], e)
+            return None
+
+    def get(self, digest: str) -> bytes:
+        """Return the original (decompressed) bytes for a stored payload."""
+        for codec in _CODECS:
+            name = self._object_name(digest, codec)
+            if self.backend == 'supabase':
+                try:
+                    data = self._storage().from_(self.bucket).download(name)
+                except Exception:
+                    continue
+            else:
+                path = self.directory / name
+                if not path.exists():
+                    continue
+                data = path.read_bytes()
+            return self._decompress(data, codec)
+        raise KeyError(f"Raw payload {digest} not found in archive")
+
+    def get_json(self, digest: str, offset: Optional[int] = None) -> Any:
+        """Load a stored payload; with an offset, return that review from `data.reviews`."""
+        payload = json.loads(self.get(digest))
+        if offset is None:
+            return payload
+        return payload.get("data", {}).get("reviews", [])[offset]
+
+
+_archive: Optional[PayloadArchive] = None
+_archive_lock = threading.Lock()
+
+
+def get_payload_archive(storage_client=None) -> PayloadArchive:
+    """Process-wide archive configured from the RAW_PAYLOAD_* env vars."""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = PayloadArchive(storage_client=storage_client)
+        elif storage_client is not None and _archive.storage_client is None:
+            _archive.storage_client = storage_client
+        return _archive
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 'redis' (shared by every worker), 'local' (directory on this host) or 'off'
+PRODUCT_CACHE = os.getenv('PRODUCT_CACHE', 'redis')
+# How long a fetched product-details or review-page response may be reused, in seconds
+PRODUCT_CACHE_TTL = int(os.getenv('PRODUCT_CACHE_TTL', '21600'))
+PRODUCT_CACHE_DIR = os.getenv('PRODUCT_CACHE_DIR', 'product_cache')
+# After a Redis error, skip the cache for this long instead of timing out on every call
+PRODUCT_CACHE_RETRY_AFTER = 60.0
+
+_KEY_PREFIX = 'rivalrecon:rapidapi:'
+
+
+class ProductCache:
+    """
+    ASIN-level cache of RapidAPI responses shared across submissions.
+
+    Entries are the raw response bodies (zlib-compressed) keyed by endpoint and query
+    parameters, which include the ASIN, country and page. Every submission for the same
+    product within PRODUCT_CACHE_TTL reuses them, so only its own rows are written. The
+    cache never fails a scrape: any backend error is logged and treated as a miss.
+    """
+
+    def __init__(self, backend: str = PRODUCT_CACHE, ttl: int = PRODUCT_CACHE_TTL,
+                 directory: str = PRODUCT_CACHE_DIR, redis_client=None):
+        self.backend = backend if ttl > 0 else 'off'
+        self.ttl = ttl
+        self.directory = Path(directory)
+        self.redis_client = redis_client
+        self._unavailable_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend in ('redis', 'local') and time.monotonic() >= self._unavailable_until
+
+    @staticmethod
+    def key(endpoint: str, params: Dict[str, str]) -> str:
+        """Stable cache key, e.g. 'product-reviews:asin=B0..&country=US&page=2&...'."""
+        query = '&'.join(f"{k}={params[k]}" for k in sorted(params))
+        return f"{endpoint}:{query}"
+
+    def _redis(self):
+        if self.redis_client is None:
+            from worker.clients import get_redis
+            self.redis_client = get_redis()
+        return self.redis_client
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.z"
+
+    def _backend_failed(self, action: str, e: Exception) -> None:
+        logger.warning("Product cache %s failed (%s); bypassing cache for %.0fs", action, e, PRODUCT_CACHE_RETRY_AFTER)
+        self._unavailable_until = time.monotonic() + PRODUCT_CACHE_RETRY_AFTER
+
+    def get(self, endpoint: str, params: Dict[str, str]) -> Optional[bytes]:
+        """Return the cached response body if it is still fresh, else None."""
+        if not self.enabled:
+            return None
+        key = self.key(endpoint, params)
+        try:
+            if self.backend == 'redis':
+                data = self._redis().get(_KEY_PREFIX + key)
+            else:
+                path = self._path(key)
+                if not path.exists() or time.time() - path.stat().st_mtime > self.ttl:
+                    return None
+                data = path.read_bytes()
+            return zlib.decompress(data) if data else None
+        except Exception as e:
+            self._backend_failed('read', e)
+            return None
+
+    def set(self, endpoint: str, params: Dict[str, str], body: bytes) -> None:
+        """Store a successful response body for PRODUCT_CACHE_TTL seconds."""
+        if not self.enabled or not body:
+            return
+        key = self.key(endpoint, params)
+        try:
+            data = zlib.compress(body, 3)
+            if self.backend == 'redis':
+                self._redis().set(_KEY_PREFIX + key, data, ex=self.ttl)
+            else:
+                path = self._path(key)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+        except Exception as e:
+            self._backend_failed('write', e)
+
+
+_cache: Optional[ProductCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_product_cache() -> ProductCache:
+    """Process-wide cache configured from the PRODUCT_CACHE* env vars."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProductCache()
+        return _cache
@@ -0,0 +1,152 @@
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Where profiles are written: <PROFILE_DIR>/<submission_id>/<stage>-<timestamp>.*
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# 'cprofile' (deterministic, .prof + text summary) or 'sample' (stack sampler, collapsed stacks)
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'cprofile')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', '40'))
+
+
+def profiling_requested(submission_id: Optional[str], requested: bool = False) -> bool:
+    """
+    Decide whether this task run should be profiled.
+
+    Profiling is opt-in per submission, from any of:
+      - the task's `profile` kwarg (set by whoever queues a flagged submission),
+      - a `profile` message header on the current Celery task,
+      - the PROFILE_SUBMISSIONS env var: a comma-separated list of ids, or '*' for all.
+    """
+    if requested:
+        return True
+    try:
+        from celery import current_task
+        if current_task and current_task.request and current_task.request.get('profile'):
+            return True
+    except Exception:
+        pass
+    targets = os.getenv('PROFILE_SUBMISSIONS', '')
+    if not targets or not submission_id:
+        return False
+    targets = {t.strip() for t in targets.split(',') if t.strip()}
+    return '*' in targets or submission_id in targets
+
+
+class StackSampler:
+    """
+    Minimal py-spy style sampler: a background thread snapshots the profiled thread's
+    stack every `interval` seconds and counts identical stacks. The result is written
+    in collapsed-stack format ("frame;frame;frame count"), which flamegraph.pl and
+    speedscope read directly.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextlib.contextmanager
+def profile_submission(submission_id: str, stage: str) -> Iterator[Path]:
+    """
+    Profile the enclosed block and trace its allocations, then write the artefacts to
+    PROFILE_DIR/<submission_id>/. Failures while writing are logged, never raised.
+    """
+    out_dir = Path(PROFILE_DIR) / str(submission_id)
+    prefix = f"{stage}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}"
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(25)
+    profiler = sampler = None
+    if PROFILE_MODE == 'sample':
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started = time.perf_counter()
+    logger.info("[Submission ID: %s] Profiling %s (%s mode)", submission_id, stage, PROFILE_MODE)
+
+    try:
+        yield out_dir
+    finally:
+        elapsed = time.perf_counter() - started
+        if profiler:
+            profiler.disable()
+        if sampler:
+            sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+
+        try:
+            out_dir.mkdir(parents=True, exist_ok=True)
+            if profiler:
+                profiler.dump_stats(out_dir / f"{prefix}.prof")
+                summary = io.StringIO()
+                pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+                (out_dir / f"{prefix}-cumulative.txt").write_text(summary.getvalue())
+            if sampler:
+                sampler.write(out_dir / f"{prefix}.collapsed")
+
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ))
+            lines = [f"# {stage} for submission {submission_id}: {elapsed:.3f}s wall, "
+                     f"peak traced memory {peak / 1024 / 1024:.1f} MiB", ""]
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]:
+                lines.append(str(stat))
+            (out_dir / f"{prefix}-allocations.txt").write_text("\n".join(lines) + "\n")
+            logger.info("[Submission ID: %s] Wrote %s profile to %s", submission_id, stage, out_dir)
+        except Exception as e:
+            logger.warning("[Submission ID: %s] Failed to write profile for %s: %s", submission_id, stage, e)
+
+
+def maybe_profile(submission_id: Optional[str], stage: str, requested: bool = False):
+    """Return a profiling context for flagged submissions and a no-op context otherwise."""
+    if profiling_requested(submission_id, requested):
+        return profile_submission(submission_id or 'unknown', stage)
+    return contextlib.nullcontext()
@@ -0,0 +1,133 @@
+import heapq
+import math
+import os
+import random
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from worker.analysis_state import month_key
+from worker.review_record import extract_helpful_votes
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; the regex estimate is used without it
+    tiktoken = None
+
+# Tokens of review snippets per LLM prompt (the rest of the prompt is ~1.5k tokens)
+PROMPT_REVIEW_TOKEN_BUDGET = int(os.getenv('PROMPT_REVIEW_TOKEN_BUDGET', '12000'))
+# Longest text kept for one review; longer ones are cut at a word boundary
+PROMPT_REVIEW_MAX_CHARS = int(os.getenv('PROMPT_REVIEW_MAX_CHARS', '600'))
+# Reviews left with fewer tokens than this are not worth truncating into the remaining budget
+MIN_SNIPPET_TOKENS = 24
+
+# BPE tokenizers emit roughly one token per short word or punctuation mark and split long
+# words every ~6 characters; close enough to DeepSeek's tokenizer to budget with.
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count of `text`: exact cl100k_base count when tiktoken is installed, else a regex estimate."""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        return len(_encoding.encode(text))
+    return sum(1 + (len(piece) - 1) // 6 for piece in _PIECE_RE.findall(text))
+
+
+def format_snippet(review: Dict[str, Any], text: str) -> str:
+    """One review as it appears in the prompt, with `text` standing in for its (clipped) text."""
+    rating = review.get('review_rating', 'N/A')
+    date = review.get('review_date') or 'N/A'
+    copies = review.get('duplicate_count') or 1
+    repeated = f" [posted {copies}x near-identically]" if copies > 1 else ""
+    return f"Rating: {rating}, Date: {date}{repeated}, Text: {text}"
+
+
+def clip_text(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(' ', 0, max_chars)
+    return text[:cut if cut > max_chars // 2 else max_chars].rstrip() + '...'
+
+
+def _weight(review: Dict[str, Any], text: str) -> float:
+    """Higher for reviews other shoppers found helpful, ones with substance to them, and ones many reviewers posted."""
+    helpful = review.get('helpful_votes')
+    if helpful is None:
+        helpful = extract_helpful_votes(review.get('helpful_votes_text') or '')
+    copies = review.get('duplicate_count') or 1
+    return (1.0 + math.log1p(helpful)) * math.sqrt(1 + min(len(text), PROMPT_REVIEW_MAX_CHARS)) * math.sqrt(copies)
+
+
+def review_snippets(reviews: Sequence[Dict[str, Any]], token_budget: int = PROMPT_REVIEW_TOKEN_BUDGET,
+                    seed: int = 0) -> Tuple[List[str], int]:
+    """
+    Choose the reviews that go into the prompt and fill the token budget with them.
+
+    Reviews are grouped into strata by star rating and month. Strata are visited so that the
+    one with the smallest share taken so far goes next: every star/month combination is
+    represented before any gets a second review, and after that each stratum fills in
+    proportion to its size. Within a stratum reviews are drawn by weighted sampling without
+    replacement (Efraimidis-Spirakis keys), favouring helpful and substantive reviews. A
+    review that doesn't fit the remaining budget is truncated to fit, or skipped if too little
+    would remain, so the budget is filled rather than cut mid-review.
+
+    Args:
+        reviews: Review rows (review_text, review_rating, review_date, helpful_votes_text,
+            and duplicate_count on near-duplicate representatives)
+        token_budget: Estimated tokens available for the snippet lines
+        seed: Sampling seed; the same reviews always give the same prompt
+
+    Returns:
+        Tuple of (snippet lines ordered by review date, estimated tokens used)
+    """
+    rng = random.Random(seed)
+    strata: Dict[Tuple[int, str], List[Tuple[float, int]]] = defaultdict(list)
+    clipped: List[str] = []
+    for index, review in enumerate(reviews):
+        text = clip_text((review.get('review_text') or '').strip(), PROMPT_REVIEW_MAX_CHARS)
+        clipped.append(text)
+        if not text:
+            continue
+        try:
+            star = int(float(review.get('review_rating')))
+        except (TypeError, ValueError):
+            star = 0
+        key = (star, month_key(review.get('review_date')) or '')
+        # Efraimidis-Spirakis: the largest u ** (1 / w) wins; stored negated for a min-heap
+        heapq.heappush(strata[key], (-rng.random() ** (1.0 / _weight(review, text)), index))
+
+    # Strata ordered by (already drawn from, share taken if one more is drawn, tiebreak), so
+    # untouched strata come first however small they are
+    queue = [(False, 1.0 / len(items), key) for key, items in strata.items()]
+    heapq.heapify(queue)
+    taken: Dict[Tuple[int, str], int] = defaultdict(int)
+    chosen: List[Tuple[str, str]] = []  # (date, snippet)
+    used = 0
+    while queue and token_budget - used >= MIN_SNIPPET_TOKENS:
+        _, _, key = heapq.heappop(queue)
+        _, index = heapq.heappop(strata[key])
+        review = reviews[index]
+        snippet = format_snippet(review, clipped[index])
+        tokens = estimate_tokens(snippet) + 1  # newline
+        if used + tokens > token_budget:
+            remaining = token_budget - used - estimate_tokens(format_snippet(review, '')) - 1
+            if remaining >= MIN_SNIPPET_TOKENS // 2:
+                # Shorten to the remaining budget (chars per token taken from this review itself)
+                chars = int(len(clipped[index]) * remaining / max(1, tokens)) - 3
+                snippet = format_snippet(review, clip_text(clipped[index], max(1, chars)))
+                tokens = estimate_tokens(snippet) + 1
+            if used + tokens > token_budget:
+                tokens = 0
+        if tokens:
+            chosen.append((str(review.get('review_date') or ''), snippet))
+            used += tokens
+        taken[key] += 1
+        if strata[key]:
+            heapq.heappush(queue, (True, (taken[key] + 1) / (taken[key] + len(strata[key])), key))
+
+    chosen.sort(key=lambda item: item[0])
+    return [snippet for _, snippet in chosen], used
@@ -0,0 +1,100 @@
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Sequence
+
+from celery import shared_task
+
+logger = logging.getLogger(__name__)
+
+# Work is split by who is waiting for it. Workers consume the queues in this order and always
+# take from the first non-empty one (Redis transport queue_order_strategy='priority', set in
+# celery_app.py), so a user's submission never waits behind the nightly recurring batch.
+# Interactive work stays on Celery's default queue, which the Node backend pushes to.
+INTERACTIVE_QUEUE = os.getenv('INTERACTIVE_QUEUE', 'celery')
+REFRESH_QUEUE = os.getenv('REFRESH_QUEUE', 'refresh')
+RECURRING_QUEUE = os.getenv('RECURRING_QUEUE', 'recurring')
+PRIORITY_QUEUES = (INTERACTIVE_QUEUE, REFRESH_QUEUE, RECURRING_QUEUE)
+
+# Starvation protection: a message that has waited this long in a lower queue is moved to
+# the front of the queue above it (and on up, if it keeps waiting there)
+QUEUE_STARVATION_SECONDS = float(os.getenv('QUEUE_STARVATION_SECONDS', '900'))
+# Most messages promoted out of one queue per promote_starved_tasks run
+QUEUE_PROMOTE_BATCH = int(os.getenv('QUEUE_PROMOTE_BATCH', '20'))
+
+# Kombu's Redis transport LPUSHes messages and workers BRPOP them, so the oldest message is the
+# list's last element. Move messages enqueued before ARGV[1] from the end of KEYS[1] to the end
+# of KEYS[2] (where they are consumed next), at most ARGV[2] of them; they are pushed newest
+# first so that the oldest is consumed first. Messages without an enqueued_at header (not sent
+# through enqueue) stop the scan.
+_PROMOTE_SCRIPT = """
+local moved = {}
+for _ = 1, tonumber(ARGV[2]) do
+    local raw = redis.call('lindex', KEYS[1], -1)
+    if not raw then break end
+    local ok, message = pcall(cjson.decode, raw)
+    local enqueued_at = ok and type(message.headers) == 'table' and tonumber(message.headers.enqueued_at)
+    if not enqueued_at or enqueued_at > tonumber(ARGV[1]) then break end
+    moved[#moved + 1] = redis.call('rpop', KEYS[1])
+end
+for i = #moved, 1, -1 do
+    redis.call('rpush', KEYS[2], moved[i])
+end
+return #moved
+"""
+
+
+def enqueue(task, args: Sequence[Any] = (), queue: str = INTERACTIVE_QUEUE, link=None, **options):
+    """
+    Queue a task on one of the PRIORITY_QUEUES, stamped with its enqueue time so that
+    promote_starved_tasks can tell how long it has been waiting.
+
+    Args:
+        task: The Celery task to queue
+        args: Positional arguments for the task
+        queue: INTERACTIVE_QUEUE, REFRESH_QUEUE or RECURRING_QUEUE
+        link: Optional signature to run on success (put it on the same queue with .set(queue=...))
+        **options: Further apply_async options
+
+    Returns:
+        The AsyncResult of the queued task
+    """
+    headers = {**options.pop('headers', {}), 'enqueued_at': time.time()}
+    return task.apply_async(args=tuple(args), queue=queue, link=link, headers=headers, **options)
+
+
+def current_queue(default: str = INTERACTIVE_QUEUE) -> str:
+    """The queue the running task was taken from, so follow-up work keeps its priority."""
+    try:
+        from celery import current_task
+        delivery_info: Optional[Dict[str, Any]] = current_task.request.delivery_info if current_task else None
+    except Exception:
+        delivery_info = None
+    queue = (delivery_info or {}).get('routing_key')
+    return queue if queue in PRIORITY_QUEUES else default
+
+
+@shared_task(name="promote_starved_tasks")
+def promote_starved_tasks():
+    """
+    Move messages that have waited longer than QUEUE_STARVATION_SECONDS up one queue.
+
+    Strict queue order alone would let a steady stream of interactive submissions starve
+    refreshes and recurring runs; this beat task bounds how long they can wait. The lowest
+    queue is handled first, so a recurring run that has also outwaited the refresh queue's
+    limit goes straight on to the interactive queue.
+    """
+    from celery import current_app
+
+    cutoff = time.time() - QUEUE_STARVATION_SECONDS
+    promoted = {}
+    with current_app.connection_for_write() as connection:
+        client = connection.default_channel.client
+        promote = client.register_script(_PROMOTE_SCRIPT)
+        for lower, upper in reversed(list(zip(PRIORITY_QUEUES[1:], PRIORITY_QUEUES))):
+            moved = promote(keys=[lower, upper], args=[cutoff, QUEUE_PROMOTE_BATCH])
+            if moved:
+                promoted[lower] = moved
+                logger.warning("Promoted %s tasks waiting over %.0fs "
+                               "from queue '%s' to '%s'", moved, QUEUE_STARVATION_SECONDS, lower, upper)
+    return promoted
@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+import os
+import time
+from typing import AsyncIterator, Optional
+
+# Shared RapidAPI budget for scrapes that run in one event loop (see scrape_reviews_batch).
+# The per-key plan limit applies across every product being scraped, not per product.
+RAPIDAPI_RATE_LIMIT = float(os.getenv('RAPIDAPI_RATE_LIMIT', '10'))  # requests per second
+RAPIDAPI_BURST = int(os.getenv('RAPIDAPI_BURST', '5'))
+RAPIDAPI_MAX_CONCURRENCY = int(os.getenv('RAPIDAPI_MAX_CONCURRENCY', '10'))  # in-flight requests
+RAPIDAPI_RETRY_AFTER = float(os.getenv('RAPIDAPI_RETRY_AFTER', '2.0'))  # pause after a 429
+# Budget for each Amazon marketplace inside the shared one (scrapes of DE and FR pace independently)
+RAPIDAPI_COUNTRY_RATE_LIMIT = float(os.getenv('RAPIDAPI_COUNTRY_RATE_LIMIT', '5'))
+
+
+class AsyncRateLimiter:
+    """
+    Token bucket plus in-flight cap for one upstream API, shared by every coroutine in a loop.
+
+    `acquire()` waits for a token (refilled at `rate` per second, up to `burst`) and a
+    concurrency slot. `backoff()` is called on a 429 and pauses *all* callers, since the
+    limit that was hit is the shared one.
+    """
+
+    def __init__(self, rate: float = RAPIDAPI_RATE_LIMIT, burst: int = RAPIDAPI_BURST,
+                 max_concurrency: int = RAPIDAPI_MAX_CONCURRENCY):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _take_token(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self.rate <= 0:
+                    return
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """Hold a concurrency slot for the duration of one request."""
+        async with self._slots:
+            await self._take_token()
+            yield
+
+    def backoff(self, delay: Optional[float] = None) -> None:
+        """Pause every caller for `delay` seconds (defaults to RAPIDAPI_RETRY_AFTER)."""
+        resume_at = time.monotonic() + (RAPIDAPI_RETRY_AFTER if delay is None else delay)
+        self._paused_until = max(self._paused_until, resume_at)
+
+
+class RateBudgets:
+    """
+    A shared limiter plus one limiter per key (marketplace country) created on demand.
+
+    `for_key(key)` returns an object with the AsyncRateLimiter interface that takes a
+    token from the key's own budget first and then from the shared one, so a busy
+    marketplace cannot use up the slots of the others.
+    """
+
+    def __init__(self, shared: Optional[AsyncRateLimiter] = None, key_rate: float = RAPIDAPI_COUNTRY_RATE_LIMIT,
+                 key_burst: int = RAPIDAPI_BURST):
+        self.shared = shared or AsyncRateLimiter()
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self._limiters = {}
+
+    def for_key(self, key: str) -> '_KeyedLimiter':
+        if key not in self._limiters:
+            limiter = AsyncRateLimiter(rate=self.key_rate, burst=self.key_burst, max_concurrency=RAPIDAPI_MAX_CONCURRENCY)
+            self._limiters[key] = _KeyedLimiter(limiter, self.shared)
+        return self._limiters[key]
+
+
+class _KeyedLimiter:
+    def __init__(self, own: AsyncRateLimiter, shared: AsyncRateLimiter):
+        self.own = own
+        self.shared = shared
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        async with self.own.acquire(), self.shared.acquire():
+            yield
+
+    def backoff(self, delay: Optional[float] = None) -> None:
+        # 429s come from the provider's per-key limit, which every marketplace shares
+        self.shared.backoff(delay)
@@ -1,27 +1,15 @@
-import os
-import json
 import logging
 from datetime import datetime, timedelta
 
-import supabase
 from celery import shared_task
+
+from worker.clients import get_supabase
+from worker.queues import RECURRING_QUEUE, enqueue
 # from .tasks import process_pending_submissions
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logging is configured per process in celery_app.py (see logging_config.configure_logging)
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase client
-supabase_url = os.environ.get('SUPABASE_URL')
-supabase_key = os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
-
-if not supabase_url or not supabase_key:
-    logger.error("Supabase credentials not found in environment variables")
-    raise ValueError("Supabase credentials not configured")
-
-supabase_client = supabase.create_client(supabase_url, supabase_key)
-
-
 @shared_task(name="run_midnight_scheduler")
 def run_midnight_scheduler():
     """
@@ -29,6 +17,8 @@ def run_midnight_scheduler():
     This checks for all active recurring analyses with next_run date of today
     and triggers a new analysis for each.
     """
+    from worker.worker import analyze_reviews, scrape_reviews
+
     logger.info("Starting midnight scheduler for recurring analyses")
     
     # Get current date at midnight
@@ -38,29 +28,29 @@ def run_midnight_scheduler():
     today_str = today.isoformat()
     tomorrow_str = tomorrow.isoformat()
     
-    logger.info(f"Processing jobs due between {today_str} and {tomorrow_str}")
+    logger.info("Processing jobs due between %s and %s", today_str, tomorrow_str)
     
     # Find all active recurring analyses due today
     try:
-        response = supabase_client.table('recurring_analyses').select(
+        response = get_supabase().table('recurring_analyses').select(
             "id, user_id, submission_id, interval, day_of_week, last_run, next_run"
         ).eq('status', 'active') \
          .gte('next_run', today_str) \
          .lt('next_run', tomorrow_str).execute()
         
         due_jobs = response.data
-        logger.info(f"Found {len(due_jobs)} jobs to process for today")
+        logger.info("Found %s jobs to process for today", len(due_jobs))
         
         # Process each job
         for job in due_jobs:
             try:
                 # Get the original submission
-                submission_response = supabase_client.table('submissions').select(
+                submission_response = get_supabase().table('submissions').select(
                     "*"
                 ).eq('id', job['submission_id']).limit(1).execute()
                 
                 if not submission_response.data:
-                    logger.error(f"Original submission not found for job {job['id']}")
+                    logger.error("Original submission not found for job %s", job['id'])
                     continue
                 
                 original_submission = submission_response.data[0]
@@ -75,40 +65,41 @@ def run_midnight_scheduler():
                 }
                 
                 # Insert the new submission
-                insert_response = supabase_client.table('submissions').insert(
+                insert_response = get_supabase().table('submissions').insert(
                     new_submission
                 ).execute()
                 
                 if not insert_response.data:
-                    logger.error(f"Failed to create new submission for job {job['id']}")
+                    logger.error("Failed to create new submission for job %s", job['id'])
                     continue
                 
                 new_submission_id = insert_response.data[0]['id']
-                logger.info(f"Created new submission {new_submission_id} for recurring job {job['id']}")
+                logger.info("Created new submission %s for recurring job %s", new_submission_id, job['id'])
                 
-                # Queue the submission for processing
-                # process_pending_submissions.delay(new_submission_id)
-                logger.info(f"Queued submission {new_submission_id} for processing")
+                # Queue the submission for processing, behind interactive and refresh work
+                enqueue(scrape_reviews, (new_submission_id, original_submission['url']), queue=RECURRING_QUEUE,
+                        link=analyze_reviews.s(new_submission_id).set(queue=RECURRING_QUEUE))
+                logger.info("Queued submission %s for processing", new_submission_id)
                 
                 # Calculate next run date
                 next_run = calculate_next_run(job['interval'], job.get('day_of_week'), today)
                 
                 # Update the recurring job
-                update_response = supabase_client.table('recurring_analyses').update({
+                update_response = get_supabase().table('recurring_analyses').update({
                     'last_run': today_str,
                     'next_run': next_run.isoformat(),
                     'updated_at': datetime.now().isoformat()
                 }).eq('id', job['id']).execute()
                 
-                logger.info(f"Updated recurring job {job['id']}, next run: {next_run.isoformat()}")
+                logger.info("Updated recurring job %s, next run: %s", job['id'], next_run.isoformat())
                 
             except Exception as e:
-                logger.exception(f"Error processing recurring job {job['id']}: {e}")
+                logger.exception("Error processing recurring job %s: %s", job['id'], e)
         
-        logger.info(f"Completed processing {len(due_jobs)} recurring jobs")
+        logger.info("Completed processing %s recurring jobs", len(due_jobs))
         
     except Exception as e:
-        logger.exception(f"Error running midnight scheduler: {e}")
+        logger.exception("Error running midnight scheduler: %s", e)
 
 
 def calculate_next_run(interval, day_of_week, from_date):
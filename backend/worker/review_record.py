@@ -0,0 +1,297 @@
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from worker.logging_config import SampledLogger
+from worker.sentiment import label_for
+
+logger = logging.getLogger(__name__)
+review_log = SampledLogger(logger)
+
+# Helper function to extract helpful votes count from text
+def extract_helpful_votes(votes_text: str) -> int:
+    """Extract the helpful votes count from a text like '93 people found this helpful'"""
+    if not votes_text:
+        return 0
+    
+    # Use regex to extract the number
+    match = re.search(r'(\d+)', votes_text)
+    if match:
+        return int(match.group(1))
+    return 0
+
+def parse_amazon_review_date(date_text: str) -> str:
+    """
+    Parse a date string from Amazon review format to ISO format
+    Handles the RapidAPI format: "Reviewed in the United States on September 18, 2024"
+    """
+    if not date_text or not date_text.strip():
+        review_log.debug("No review date provided in API response")
+        return ""  # Return empty string for missing dates
+    
+    # Log the date format we're trying to parse for debugging purposes
+    review_log.debug("Attempting to parse review date: '%s'", date_text)
+    
+    # If it's already in ISO format
+    if re.match(r'^\d{4}-\d{2}-\d{2}T', date_text):
+        review_log.debug("Date is already in ISO format: %s", date_text)
+        return date_text
+
+    # Match "Reviewed in X on DATE" pattern
+    # This is the standard format from RapidAPI as documented
+    reviewed_in_match = re.search(r'Reviewed in .+? on (.+?)$', date_text)
+    if reviewed_in_match:
+        date_part = reviewed_in_match.group(1).strip()
+        review_log.debug("Extracted date part: '%s'", date_part)
+        try:
+            # Try "Month Day, Year" format (September 18, 2024)
+            parsed_date = datetime.strptime(date_part, "%B %d, %Y")
+            iso_date = parsed_date.isoformat()
+            review_log.debug("Successfully parsed date '%s' to ISO format: %s", date_part, iso_date)
+            return iso_date
+        except ValueError as e:
+            review_log.warning("Failed to parse standard date format '%s': %s", date_part, e)
+            
+            # Try alternative formats
+            alternative_formats = [
+                "%b %d, %Y",      # Sep 18, 2024
+                "%d %B, %Y",      # 18 September, 2024
+                "%d %b, %Y",      # 18 Sep, 2024
+                "%B %d %Y",       # September 18 2024
+                "%d %B %Y"        # 18 September 2024
+            ]
+            
+            for fmt in alternative_formats:
+                try:
+                    parsed_date = datetime.strptime(date_part, fmt)
+                    iso_date = parsed_date.isoformat()
+                    review_log.debug("Successfully parsed date '%s' with alternative format %s to ISO: %s", date_part, fmt, iso_date)
+                    return iso_date
+                except ValueError:
+                    continue
+    
+    # Match any direct date format that might be in the string, like "September 18, 2024"
+    # This is a fallback in case the "Reviewed in" pattern changes
+    date_patterns = [
+        r'([A-Za-z]+ \d{1,2}, \d{4})',             # September 18, 2024
+        r'(\d{1,2} [A-Za-z]+,? \d{4})',            # 18 September, 2024 or 18 September 2024
+        r'(\d{4}-\d{2}-\d{2})'                     # 2024-09-18
+    ]
+    
+    for pattern in date_patterns:
+        match = re.search(pattern, date_text)
+        if match:
+            date_part = match.group(1).strip()
+            review_log.debug("Matched date pattern %s with result: '%s'", pattern, date_part)
+            
+            # Try different date formats
+            formats_to_try = [
+                "%B %d, %Y",      # September 18, 2024
+                "%b %d, %Y",      # Sep 18, 2024
+                "%d %B, %Y",      # 18 September, 2024
+                "%d %b, %Y",      # 18 Sep, 2024
+                "%d %B %Y",       # 18 September 2024
+                "%d %b %Y",       # 18 Sep 2024
+                "%Y-%m-%d"        # 2024-09-18
+            ]
+            
+            for fmt in formats_to_try:
+                try:
+                    parsed_date = datetime.strptime(date_part, fmt)
+                    iso_date = parsed_date.isoformat()
+                    review_log.debug("Successfully parsed direct date '%s' with format %s to ISO: %s", date_part, fmt, iso_date)
+                    return iso_date
+                except ValueError:
+                    continue
+    
+    # As a last resort, try dateutil parser which can handle many formats
+    try:
+        from dateutil import parser
+        parsed_date = parser.parse(date_text, fuzzy=True)
+        iso_date = parsed_date.isoformat()
+        review_log.debug("Parsed date with dateutil: '%s' to ISO: %s", date_text, iso_date)
+        return iso_date
+    except Exception as e:
+        review_log.warning("Even dateutil parser failed on '%s': %s", date_text, e)
+    
+    # Still couldn't parse, log and return empty string
+    review_log.warning("Could not parse date string: '%s' with any known format", date_text)
+    return ""
+
+
+class ReviewRecord:
+    """
+    Compact, slotted representation of one review as it moves from the scraper to the
+    insert step. Built once by a `from_*` constructor (the only normalisation step) and
+    turned into a `reviews` row by `to_row` (the only serialisation step). The raw API
+    review is not kept; it lives in the payload archive (see payload_archive.py).
+    """
+
+    __slots__ = (
+        'submission_id', 'review_id', 'title', 'text', 'rating', 'review_date', 'author',
+        'verified_purchase', 'helpful_votes', 'helpful_votes_text', 'is_vine', 'images',
+        'country', 'raw_payload_sha256', 'raw_payload_offset', 'sentiment',
+    )
+
+    def __init__(self, submission_id: str, review_id: Optional[str] = None, title: Optional[str] = None,
+                 text: Optional[str] = None, rating: Optional[float] = None, review_date: Optional[str] = None,
+                 author: Optional[str] = None, verified_purchase: bool = False, helpful_votes: int = 0,
+                 helpful_votes_text: Optional[str] = None, is_vine: bool = False,
+                 images: Optional[List[str]] = None, country: Optional[str] = None,
+                 raw_payload_sha256: Optional[str] = None, raw_payload_offset: Optional[int] = None,
+                 sentiment: Optional[float] = None):
+        self.submission_id = submission_id
+        self.review_id = review_id
+        self.title = title
+        self.text = text
+        self.rating = rating
+        self.review_date = review_date
+        self.author = author
+        self.verified_purchase = verified_purchase
+        self.helpful_votes = helpful_votes
+        self.helpful_votes_text = helpful_votes_text
+        self.is_vine = is_vine
+        self.images = images
+        self.country = country
+        self.raw_payload_sha256 = raw_payload_sha256
+        self.raw_payload_offset = raw_payload_offset
+        self.sentiment = sentiment  # compound score, set in bulk by sentiment.score_records
+
+    def __repr__(self) -> str:
+        return f"ReviewRecord(review_id={self.review_id!r}, rating={self.rating!r}, review_date={self.review_date!r})"
+
+    @classmethod
+    def from_rapidapi(cls, submission_id: str, review: Dict[str, Any], country: str = "US",
+                      payload_sha256: Optional[str] = None, payload_offset: Optional[int] = None) -> 'ReviewRecord':
+        """Normalise one review object from the RapidAPI /product-reviews response."""
+        # parse_amazon_review_date returns an ISO datetime (or ""); the reviews.review_date column is a date
+        review_date = parse_amazon_review_date(review.get("review_date", ""))
+        helpful_text = review.get("helpful_vote_statement") or None
+        return cls(
+            submission_id=submission_id,
+            review_id=review.get("review_id"),
+            title=_clean_text(review.get("review_title")),
+            text=_clean_text(review.get("review_comment")),
+            rating=_to_rating(review.get("review_star_rating")),
+            review_date=review_date[:10] if review_date else None,
+            author=review.get("review_author"),
+            verified_purchase=bool(review.get("is_verified_purchase", False)),
+            helpful_votes=extract_helpful_votes(helpful_text),
+            helpful_votes_text=helpful_text,
+            is_vine=bool(review.get("is_vine", False)),
+            images=review.get("review_images") or None,
+            country=country,
+            raw_payload_sha256=payload_sha256,
+            raw_payload_offset=payload_offset if payload_sha256 else None,
+        )
+
+    @classmethod
+    def from_shopify(cls, submission_id: str, app: str, review: Dict[str, Any],
+                     payload_sha256: Optional[str] = None, payload_offset: Optional[int] = None) -> 'ReviewRecord':
+        """Normalise one review from a Shopify review app's JSON API (see shopify.py)."""
+        (id_path, title_path, text_path, rating_path, date_path, author_path,
+         verified_path, helpful_path, images_path) = SHOPIFY_REVIEW_FIELDS[app]
+        date_match = re.match(r'\d{4}-\d{2}-\d{2}', str(_dig(review, date_path) or ''))
+        verified = _dig(review, verified_path)
+        helpful = _dig(review, helpful_path) if helpful_path else None
+        review_id = _dig(review, id_path)
+        helpful_votes = int(helpful) if isinstance(helpful, (int, float)) else 0
+        return cls(
+            submission_id=submission_id,
+            review_id=f"{app}:{review_id}" if review_id is not None else None,
+            title=_clean_text(_dig(review, title_path)),
+            text=_clean_text(_dig(review, text_path)),
+            rating=_to_rating(_dig(review, rating_path)),
+            review_date=date_match.group(0) if date_match else None,
+            author=_clean_text(_dig(review, author_path)),
+            verified_purchase=bool(verified) and str(verified).lower() not in ('nothing', 'false', 'no', '0', 'none'),
+            helpful_votes=helpful_votes,
+            # The reviews table only has the text column; keep the count parseable from it
+            helpful_votes_text=str(helpful_votes) if helpful_votes else None,
+            images=_image_urls(_dig(review, images_path)) or None,
+            raw_payload_sha256=payload_sha256,
+            raw_payload_offset=payload_offset if payload_sha256 else None,
+        )
+
+    def to_row(self) -> Dict[str, Any]:
+        """Serialise to a `reviews` table row, omitting empty columns."""
+        row = {
+            "submission_id": self.submission_id,
+            "review_text": self.text,
+            "review_rating": self.rating,
+            "review_date": self.review_date,
+            "review_title": self.title,
+            "review_images": self.images,
+            "verified_purchase": self.verified_purchase,
+            "api_review_id": self.review_id,
+            "review_author": self.author,
+            "helpful_votes_text": self.helpful_votes_text,
+            "is_vine_review": self.is_vine,
+            "country": self.country,
+            "raw_payload_sha256": self.raw_payload_sha256,
+            "raw_payload_offset": self.raw_payload_offset,
+            "sentiment_score": self.sentiment,
+            "sentiment_label": label_for(self.sentiment),
+        }
+        return {k: v for k, v in row.items() if v is not None}
+
+
+# Where each Shopify review app keeps a review's fields (dotted paths into its JSON):
+# (id, title, text, rating, date, author, verified, helpful votes, images)
+SHOPIFY_REVIEW_FIELDS = {
+    'judgeme': ('id', 'title', 'body', 'rating', 'created_at', 'reviewer.name', 'verified', None, 'pictures'),
+    'yotpo': ('id', 'title', 'content', 'score', 'created_at', 'user.display_name', 'verified_buyer',
+              'votes_up', 'images_data'),
+    'okendo': ('reviewId', 'title', 'body', 'rating', 'dateCreated', 'reviewer.displayName', 'reviewer.isVerified',
+               'helpfulCount', 'media'),
+    'stamped': ('id', 'reviewTitle', 'reviewMessage', 'reviewRating', 'dateCreated', 'author', 'reviewVerifiedType',
+                'reviewVotesUp', 'reviewUserPhotos'),
+}
+
+_IMAGE_URL_KEYS = ('original_url', 'fullSizeUrl', 'largeUrl', 'url', 'original', 'src')
+
+
+def _dig(data: Dict[str, Any], path: str) -> Any:
+    for key in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _image_urls(value: Any) -> List[str]:
+    """Image URLs from a review app's media field: a list of URLs or objects, or a comma-separated string."""
+    if isinstance(value, str):
+        return [url.strip() for url in value.split(',') if url.strip()]
+    urls = []
+    for item in value or []:
+        if isinstance(item, str):
+            urls.append(item)
+        elif isinstance(item, dict):
+            item = item.get('urls', item)
+            url = next((item[key] for key in _IMAGE_URL_KEYS if isinstance(item.get(key), str)), None)
+            if url:
+                urls.append(url)
+    return urls
+
+
+def _clean_text(value: Any) -> Optional[str]:
+    if not value or not isinstance(value, str):
+        return None
+    return value.strip() or None
+
+
+def _to_rating(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        review_log.warning("Skipping invalid review rating: %s", value)
+        return None
+
+
+def to_rows(records: Iterable[ReviewRecord]) -> List[Dict[str, Any]]:
+    """Serialise a batch of records for a bulk insert."""
+    return [record.to_row() for record in records]
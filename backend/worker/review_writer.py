@@ -0,0 +1,74 @@
+import logging
+import os
+from typing import Callable, Optional, Sequence, Tuple
+
+from worker.clients import get_supabase
+from worker.logging_config import SampledLogger
+from worker.review_record import ReviewRecord, to_rows
+from worker.sentiment import score_records
+
+logger = logging.getLogger(__name__)
+review_log = SampledLogger(logger)
+
+# Rows per bulk INSERT. PostgREST handles a few hundred rows per request comfortably;
+# larger batches mostly grow the request body without saving round trips.
+REVIEW_INSERT_BATCH_SIZE = int(os.getenv('REVIEW_INSERT_BATCH_SIZE', '500'))
+
+
+def insert_reviews(submission_id: str, records: Sequence[ReviewRecord],
+                   batch_size: int = REVIEW_INSERT_BATCH_SIZE,
+                   on_batch: Optional[Callable[[Sequence[ReviewRecord]], None]] = None) -> Tuple[int, int]:
+    """
+    Write scraped reviews to the `reviews` table in bulk, whatever platform they came from.
+
+    Reviews are sentiment-scored in one vectorised pass first (sentiment.py), so every row
+    is stored with its sentiment_score and sentiment_label.
+
+    Each batch is one INSERT with `return=minimal`, so nothing is echoed back. If a batch
+    is rejected (one bad row fails the whole statement) it is split in half and retried,
+    which isolates the bad rows in O(log n) extra requests instead of falling back to one
+    request per review.
+
+    Args:
+        submission_id: The submission the reviews belong to (for logging)
+        records: Normalised reviews from any scraper
+        batch_size: Rows per INSERT
+        on_batch: Optional; called with each batch once it has been written, rows the database
+            rejected included (scrape checkpoints record the stored review ids so a resumed
+            scrape doesn't insert them again)
+
+    Returns:
+        Tuple of (inserted, failed) row counts
+    """
+    score_records(records)
+    inserted = failed = 0
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        ok, bad = _insert_batch(submission_id, batch)
+        if on_batch is not None:
+            on_batch(batch)
+        inserted += ok
+        failed += bad
+        logger.info("[Submission ID: %s] Inserted %d/%d reviews so far.", submission_id, inserted, len(records))
+    return inserted, failed
+
+
+def _insert_batch(submission_id: str, batch: Sequence[ReviewRecord]) -> Tuple[int, int]:
+    if not batch:
+        return 0, 0
+    try:
+        # missing=default (default_to_null=False) lets columns a row omits take their DB default
+        get_supabase().table("reviews").insert(
+            to_rows(batch), returning='minimal', default_to_null=False).execute()
+        return len(batch), 0
+    except Exception as e:
+        if len(batch) == 1:
+            review_log.log(logging.ERROR, "[Submission ID: %s] Error inserting review %s: %s",
+                           submission_id, batch[0].review_id or 'N/A', e)
+            return 0, 1
+        logger.warning("[Submission ID: %s] Batch insert of %d reviews failed (%s); splitting",
+                       submission_id, len(batch), e)
+        middle = len(batch) // 2
+        left = _insert_batch(submission_id, batch[:middle])
+        right = _insert_batch(submission_id, batch[middle:])
+        return left[0] + right[0], left[1] + right[1]
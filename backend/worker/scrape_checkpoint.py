@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+from worker.review_record import ReviewRecord
+
+logger = logging.getLogger(__name__)
+
+# 'redis' keeps per-submission scrape progress so a redelivered task resumes; 'off' disables it
+SCRAPE_CHECKPOINTS = os.getenv('SCRAPE_CHECKPOINTS', 'redis')
+# How long an unfinished scrape's checkpoint is kept; well past the broker's visibility timeout
+SCRAPE_CHECKPOINT_TTL = int(os.getenv('SCRAPE_CHECKPOINT_TTL', '86400'))
+
+_KEY_PREFIX = 'rivalrecon:checkpoint:'
+
+
+class ScrapeCheckpoint:
+    """
+    Progress of one submission's scrape, kept in Redis until the scrape is stored.
+
+    For each review shard (marketplace and star filter) it records the last page completed
+    and the reviews that page added, as compact records. A redelivered scrape_reviews
+    restores those reviews and seen review ids and continues with the next page, so no
+    page is requested twice whether or not the payload archive is on. With the archive on,
+    the product-details response per marketplace is replayed from it as well. Review ids
+    already inserted and whether the product details were written are recorded too, so
+    storing the scrape can resume as well, skipping rows an earlier attempt wrote.
+
+    Like the product cache, the checkpoint never fails a scrape: a Redis error is logged
+    and the scrape carries on without one.
+    """
+
+    def __init__(self, submission_id: Optional[str], redis_client=None, enabled: bool = True):
+        self.submission_id = submission_id
+        self.key = f"{_KEY_PREFIX}{submission_id}"
+        self.redis_client = redis_client
+        self.enabled = enabled and bool(submission_id) and SCRAPE_CHECKPOINTS == 'redis'
+        self.fields: Dict[str, str] = {}
+        self.page_reviews: Dict[str, str] = {}  # '<country>:<shard>:<page>' -> JSON list of review records
+        self.stored_ids: Set[str] = set()
+
+    @classmethod
+    def load(cls, submission_id: Optional[str]) -> 'ScrapeCheckpoint':
+        """The submission's checkpoint, empty for a first attempt."""
+        checkpoint = cls(submission_id)
+        if not checkpoint.enabled:
+            return checkpoint
+        try:
+            client = checkpoint._redis()
+            fields, stored = client.hgetall(checkpoint.key), client.smembers(checkpoint.key + ':stored')
+            page_reviews = client.hgetall(checkpoint.key + ':reviews')
+        except Exception as e:
+            checkpoint._failed('read', e)
+            return checkpoint
+        checkpoint.fields = {_text(field): _text(value) for field, value in fields.items()}
+        checkpoint.page_reviews = {_text(field): _text(value) for field, value in page_reviews.items()}
+        checkpoint.stored_ids = {_text(review_id) for review_id in stored}
+        if checkpoint.resumed:
+            logger.info("[Submission ID: %s] Resuming scrape from checkpoint: %d review pages done, %d reviews already stored",
+                        submission_id, len(checkpoint.page_reviews), len(checkpoint.stored_ids))
+        return checkpoint
+
+    @classmethod
+    def disabled(cls) -> 'ScrapeCheckpoint':
+        """A checkpoint that records nothing (refreshes, tools)."""
+        return cls(None, enabled=False)
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.fields or self.page_reviews or self.stored_ids)
+
+    def _redis(self):
+        if self.redis_client is None:
+            from worker.clients import get_redis
+            self.redis_client = get_redis()
+        return self.redis_client
+
+    def _failed(self, action: str, e: Exception) -> None:
+        logger.warning("[Submission ID: %s] Scrape checkpoint %s failed (%s); continuing without it", self.submission_id, action, e)
+        self.enabled = False
+
+    def _save(self, field: str, value: str) -> None:
+        self.fields[field] = value
+        if not self.enabled:
+            return
+        try:
+            client = self._redis()
+            client.hset(self.key, field, value)
+            client.expire(self.key, SCRAPE_CHECKPOINT_TTL)
+        except Exception as e:
+            self._failed('write', e)
+
+    # --- Fetching ---
+
+    def product_payload(self, country: str) -> Optional[str]:
+        """Archive hash of the marketplace's product-details response, if it was fetched."""
+        return self.fields.get(f"product:{country}")
+
+    def product_fetched(self, country: str, payload_ref: Optional[str]) -> None:
+        if payload_ref:
+            self._save(f"product:{country}", payload_ref)
+
+    def last_page(self, country: str, shard: str) -> int:
+        """The shard's last completed review page (0 if none)."""
+        return int(self.fields.get(f"page:{country}:{shard}", 0))
+
+    def shard_finished(self, country: str, shard: str) -> bool:
+        """Whether the shard already stopped on its own (no more pages, or its budget is full)."""
+        return self.fields.get(f"finished:{country}:{shard}") == '1'
+
+    def shard_reviews(self, country: str, shard: str) -> List[ReviewRecord]:
+        """The reviews the shard's completed pages added, page 1 first."""
+        records = []
+        for page in range(1, self.last_page(country, shard) + 1):
+            for fields in json.loads(self.page_reviews.get(f"{country}:{shard}:{page}", '[]')):
+                records.append(ReviewRecord(**fields))
+        return records
+
+    def page_done(self, country: str, shard: str, page: int, reviews: List[ReviewRecord], finished: bool = False) -> None:
+        """
+        Record review page `page` of a shard as processed, with the reviews it added.
+        Pages must complete in order; `finished` marks the shard's last page.
+        """
+        if page != self.last_page(country, shard) + 1:
+            return
+        page_field = f"{country}:{shard}:{page}"
+        records = json.dumps([{slot: getattr(review, slot) for slot in ReviewRecord.__slots__} for review in reviews])
+        self.page_reviews[page_field] = records
+        self.fields[f"page:{country}:{shard}"] = str(page)
+        if finished:
+            self.fields[f"finished:{country}:{shard}"] = '1'
+        if not self.enabled:
+            return
+        try:
+            pipe = self._redis().pipeline()
+            pipe.hset(self.key + ':reviews', page_field, records)
+            pipe.hset(self.key, f"page:{country}:{shard}", page)
+            if finished:
+                pipe.hset(self.key, f"finished:{country}:{shard}", '1')
+            pipe.expire(self.key, SCRAPE_CHECKPOINT_TTL)
+            pipe.expire(self.key + ':reviews', SCRAPE_CHECKPOINT_TTL)
+            pipe.execute()
+        except Exception as e:
+            self._failed('write', e)
+
+    # --- Storing ---
+
+    @property
+    def details_stored(self) -> bool:
+        return self.fields.get('details_stored') == '1'
+
+    def mark_details_stored(self) -> None:
+        self._save('details_stored', '1')
+
+    def mark_reviews_stored(self, review_ids: Iterable[Optional[str]]) -> None:
+        ids = [review_id for review_id in review_ids if review_id]
+        self.stored_ids.update(ids)
+        if not self.enabled or not ids:
+            return
+        try:
+            client = self._redis()
+            client.sadd(self.key + ':stored', *ids)
+            client.expire(self.key + ':stored', SCRAPE_CHECKPOINT_TTL)
+        except Exception as e:
+            self._failed('write', e)
+
+    def clear(self) -> None:
+        """Drop the checkpoint once the scrape is fully stored."""
+        if not self.enabled:
+            return
+        try:
+            self._redis().delete(self.key, self.key + ':stored', self.key + ':reviews')
+        except Exception as e:
+            logger.warning("[Submission ID: %s] Could not clear scrape checkpoint: %s", self.submission_id, e)
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
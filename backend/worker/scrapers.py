@@ -0,0 +1,99 @@
+import logging
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Pattern, Sequence
+
+from worker.rate_limit import AsyncRateLimiter
+from worker.review_record import ReviewRecord
+from worker.scrape_checkpoint import ScrapeCheckpoint
+
+logger = logging.getLogger(__name__)
+
+
+class ScrapeContext:
+    """What an adapter gets for one submission, and where it leaves the product details."""
+
+    __slots__ = ('submission_id', 'url', 'session', 'limiter', 'marketplaces', 'checkpoint', 'product_details')
+
+    def __init__(self, submission_id: str, url: str, session, limiter=None,
+                 marketplaces: Optional[List[str]] = None, checkpoint: Optional[ScrapeCheckpoint] = None):
+        self.submission_id = submission_id
+        self.url = url
+        self.session = session
+        # This platform's budget for the current event loop, or None for a one-off scrape
+        self.limiter = limiter
+        self.marketplaces = marketplaces
+        # Progress of an earlier attempt at this submission (see scrape_checkpoint.py)
+        self.checkpoint = checkpoint or ScrapeCheckpoint.disabled()
+        # Set by the adapter: {"db_fields": {...}} or Amazon's {"raw_api_response": ...} shape
+        self.product_details: Optional[Dict[str, Any]] = None
+
+
+class PlatformScraper:
+    """
+    One review source. Subclasses declare which URLs they handle and how hard the
+    upstream may be hit, and yield normalised ReviewRecords; fetching, storing and
+    analysis are the same for every platform (see worker._fetch_submission).
+    """
+
+    name = ''
+    # Regexes tried against the submitted URL; override matches() for anything more involved
+    url_patterns: Sequence[Pattern] = ()
+    rate_limit = 5.0  # requests per second
+    burst = 5
+    max_concurrency = 5  # in-flight requests
+
+    def matches(self, url: str) -> bool:
+        return any(pattern.search(url) for pattern in self.url_patterns)
+
+    def new_limiter(self):
+        """Rate budget shared by every submission of this platform in one event loop."""
+        return AsyncRateLimiter(rate=self.rate_limit, burst=self.burst, max_concurrency=self.max_concurrency)
+
+    def reviews(self, ctx: ScrapeContext) -> AsyncIterator[ReviewRecord]:
+        """
+        Async generator of the product's reviews; sets ctx.product_details along the way.
+
+        The interface allows streaming, but the Amazon and Shopify adapters still scrape
+        every page before yielding the first review, and _fetch_submission collects the
+        whole list before anything is stored: there is no shared per-page stage handing
+        chunks to insert_reviews yet. A retry does not refetch finished pages, since the
+        Amazon scrape checkpoints them (see scrape_checkpoint.py).
+        """
+        raise NotImplementedError
+
+
+_REGISTRY: List[PlatformScraper] = []
+
+
+def register_scraper(scraper: PlatformScraper) -> PlatformScraper:
+    """Add an adapter. Earlier registrations win when several match a URL."""
+    if any(existing.name == scraper.name for existing in _REGISTRY):
+        raise ValueError(f"Scraper already registered: {scraper.name}")
+    _REGISTRY.append(scraper)
+    return scraper
+
+
+def get_scraper(url: str) -> Optional[PlatformScraper]:
+    """The adapter for a product URL, or None if no platform supports it."""
+    return next((scraper for scraper in _REGISTRY if scraper.matches(url)), None)
+
+
+def registered_scrapers() -> List[str]:
+    return [scraper.name for scraper in _REGISTRY]
+
+
+def url_pattern(*hosts: str) -> Pattern:
+    """Regex matching http(s) URLs on any of the hosts or their subdomains, e.g. url_pattern(r'walmart\\.com')."""
+    return re.compile(rf'^https?://(?:[^/?#]*\.)?(?:{"|".join(hosts)})(?:[:/?#]|$)', re.I)
+
+
+class ScraperBudgets:
+    """Rate limiters for one event loop, created per platform on first use."""
+
+    def __init__(self):
+        self._limiters: Dict[str, Any] = {}
+
+    def for_scraper(self, scraper: PlatformScraper):
+        if scraper.name not in self._limiters:
+            self._limiters[scraper.name] = scraper.new_limiter()
+        return self._limiters[scraper.name]
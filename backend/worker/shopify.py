@@ -0,0 +1,432 @@
+import asyncio
+import html
+import json
+import logging
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from worker.deadlines import deadline_reached, http_timeout
+from worker.html_extract import extract_structured_data, get_html_parser, product_from_structured_data
+from worker.logging_config import SampledLogger
+from worker.payload_archive import get_payload_archive
+from worker.rate_limit import AsyncRateLimiter
+from worker.review_record import ReviewRecord
+from worker.scrapers import PlatformScraper, ScrapeContext
+from worker.usage import record_http_call
+
+logger = logging.getLogger(__name__)
+review_log = SampledLogger(logger)
+
+# Known Shopify domains (add more as needed); stores on custom domains are recognised by /products/<handle>
+KNOWN_SHOPIFY_DOMAINS = ["myshopify.com", "shop.app"]
+
+SHOPIFY_MAX_REVIEWS = int(os.getenv('SHOPIFY_MAX_REVIEWS', '1000'))
+# Budget per scrape for the storefront and its review app together
+SHOPIFY_RATE_LIMIT = float(os.getenv('SHOPIFY_RATE_LIMIT', '4'))  # requests per second
+SHOPIFY_MAX_CONCURRENCY = int(os.getenv('SHOPIFY_MAX_CONCURRENCY', '4'))
+# Lets local stand-ins replace the review apps' API hosts, like RAPIDAPI_BASE_URL does for RapidAPI
+SHOPIFY_REVIEW_APP_BASE_URL = os.getenv('SHOPIFY_REVIEW_APP_BASE_URL')
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9"
+}
+
+_HANDLE_RE = re.compile(r'/products/([^/?#.]+)')
+# Product id in the ShopifyAnalytics/theme JSON every storefront page embeds
+_PAGE_PRODUCT_ID_RE = re.compile(r'"product"\s*:\s*\{\s*"id"\s*:\s*(\d+)')
+_TAG_RE = re.compile(r'<[^>]+>')
+
+# Review app fingerprints in the product page HTML. Matched with regexes over the raw text;
+# no DOM is built for them.
+_JUDGEME_SHOP_RE = re.compile(r'jdgm\.SHOP_DOMAIN\s*=\s*[\'"]([^\'"]+)')
+_JUDGEME_TOKEN_RE = re.compile(r'jdgm\.PUBLIC_TOKEN\s*=\s*[\'"]([^\'"]+)')
+_YOTPO_KEY_RE = re.compile(r'(?:staticw2\.yotpo\.com|cdn-widgetsrepository\.yotpo\.com/v1/loader)/([A-Za-z0-9]{20,})')
+_OKENDO_ID_RE = re.compile(r'(?:"subscriberId"\s*:\s*"|api\.okendo\.io/v1/stores/)([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})')
+_STAMPED_KEY_RE = re.compile(r'(?:data-api-key=|apiKey\s*:\s*)[\'"]([^\'"]+)')
+_STAMPED_STORE_RE = re.compile(r'(?:data-store-url=|storeUrl\s*:\s*)[\'"]([^\'"]+)')
+
+
+# Theme selectors, used only when a page has neither product JSON nor JSON-LD/og: tags
+THEME_SELECTORS = {
+    "title": ['.product-single__title', 'h1.product_name', '.product-title', 'h1'],
+    "price": ['.price__current', '.product-single__price', '.price-item--regular'],
+}
+
+
+def is_shopify_url(url: str) -> bool:
+    lowered = url.lower()
+    return "shopify" in lowered or any(domain in lowered for domain in KNOWN_SHOPIFY_DOMAINS) \
+        or bool(_HANDLE_RE.search(urlsplit(lowered).path))
+
+
+def parse_product_url(url: str) -> Tuple[str, Optional[str]]:
+    """Split a product URL into the store's base URL and the product handle."""
+    parts = urlsplit(url)
+    match = _HANDLE_RE.search(parts.path)
+    return f"{parts.scheme or 'https'}://{parts.netloc}", match.group(1) if match else None
+
+
+class ReviewApp:
+    """One review app's public JSON API: how to request a page and read reviews out of it."""
+
+    name = ''
+    host = ''
+    per_page = 50
+    # Cursor-paginated APIs hand back the next URL; numbered pages can be fetched concurrently
+    cursor = False
+
+    def __init__(self, **config: str):
+        self.config = config
+
+    def base(self) -> str:
+        return SHOPIFY_REVIEW_APP_BASE_URL or self.host
+
+    def request(self, page: int) -> Tuple[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+    def parse(self, payload: Any) -> Tuple[List[Dict[str, Any]], Optional[int], Optional[str]]:
+        """Return (reviews, total review count if known, next page URL for cursor APIs)."""
+        raise NotImplementedError
+
+
+class JudgeMe(ReviewApp):
+    name, host, per_page = 'judgeme', 'https://judge.me', 100
+
+    def request(self, page):
+        return f"{self.base()}/api/v1/reviews", {
+            "shop_domain": self.config["shop_domain"], "api_token": self.config["token"],
+            "product_id": self.config["product_id"], "page": page, "per_page": self.per_page,
+        }
+
+    def parse(self, payload):
+        return payload.get("reviews") or [], None, None
+
+
+class Yotpo(ReviewApp):
+    name, host, per_page = 'yotpo', 'https://api-cdn.yotpo.com', 150
+
+    def request(self, page):
+        return f"{self.base()}/v1/widget/{self.config['app_key']}/products/{self.config['product_id']}/reviews.json", {
+            "page": page, "per_page": self.per_page,
+        }
+
+    def parse(self, payload):
+        response = payload.get("response") or {}
+        return response.get("reviews") or [], (response.get("pagination") or {}).get("total"), None
+
+
+class Okendo(ReviewApp):
+    name, host, per_page, cursor = 'okendo', 'https://api.okendo.io', 100, True
+
+    def request(self, page):
+        return f"{self.base()}/v1/stores/{self.config['subscriber_id']}/products/shopify-{self.config['product_id']}/reviews", {
+            "limit": self.per_page,
+        }
+
+    def parse(self, payload):
+        next_url = payload.get("nextUrl")
+        return payload.get("reviews") or [], None, urljoin(f"{self.base()}/v1/", next_url.lstrip('/')) if next_url else None
+
+
+class Stamped(ReviewApp):
+    name, host, per_page = 'stamped', 'https://stamped.io', 50
+
+    def request(self, page):
+        return f"{self.base()}/api/widget/reviews", {
+            "productId": self.config["product_id"], "apiKey": self.config["api_key"],
+            "storeUrl": self.config["store_url"], "page": page, "take": self.per_page,
+        }
+
+    def parse(self, payload):
+        return payload.get("data") or [], payload.get("total"), None
+
+
+def detect_review_app(page_html: str, product_id: Any, store_host: str) -> Optional[ReviewApp]:
+    """Find the review app a storefront uses from fingerprints in its product page."""
+    if product_id is None:
+        return None
+    shop, token = _JUDGEME_SHOP_RE.search(page_html), _JUDGEME_TOKEN_RE.search(page_html)
+    if shop and token:
+        return JudgeMe(shop_domain=shop.group(1), token=token.group(1), product_id=str(product_id))
+    match = _YOTPO_KEY_RE.search(page_html)
+    if match:
+        return Yotpo(app_key=match.group(1), product_id=str(product_id))
+    match = _OKENDO_ID_RE.search(page_html)
+    if match:
+        return Okendo(subscriber_id=match.group(1), product_id=str(product_id))
+    match = _STAMPED_KEY_RE.search(page_html)
+    if match and 'stamped' in page_html:
+        store = _STAMPED_STORE_RE.search(page_html)
+        return Stamped(api_key=match.group(1), store_url=store.group(1) if store else store_host, product_id=str(product_id))
+    return None
+
+
+async def _get(session, limiter: AsyncRateLimiter, url: str, params: Optional[Dict[str, Any]] = None,
+               headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+    async with limiter.acquire(), session.get(url, params=params, headers=headers or HEADERS,
+                                              timeout=http_timeout()) as response:
+        body = await response.read()
+    record_http_call('storefront', len(body))
+    return response.status, body
+
+
+async def _fetch_product(session, limiter: AsyncRateLimiter, base_url: str, handle: str) -> Tuple[Optional[Dict], bytes]:
+    """Product JSON from /products/<handle>.json, falling back to the theme's /products/<handle>.js."""
+    import aiohttp
+
+    for suffix in ('.json', '.js'):
+        try:
+            status, body = await _get(session, limiter, f"{base_url}/products/{handle}{suffix}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Shopify product%s request for %s failed: %r", suffix, handle, e)
+            continue
+        if status == 200:
+            try:
+                data = json.loads(body)
+            except json.JSONDecodeError:
+                continue
+            # .json wraps the product and prices variants in decimal strings; .js prices in cents
+            if suffix == '.json':
+                return data.get("product"), body
+            data["_price_in_cents"] = True
+            return data, body
+    return None, b''
+
+
+def product_db_fields(product: Dict[str, Any], product_url: str, payload_ref: Optional[str]) -> Dict[str, Any]:
+    """Map a Shopify product JSON object onto the `submissions` product columns."""
+    variants = product.get("variants") or []
+    price = None
+    raw_price = variants[0].get("price") if variants else product.get("price")
+    try:
+        if raw_price is not None:
+            price = float(raw_price) / (100 if product.get("_price_in_cents") else 1)
+    except (TypeError, ValueError):
+        pass
+    images = [image.get("src") if isinstance(image, dict) else image for image in product.get("images") or []]
+    description = product.get("body_html") or product.get("description") or ''
+    return {
+        "product_title": product.get("title"),
+        "brand_name": product.get("vendor"),
+        "category_name": product.get("product_type") or product.get("type") or None,
+        "price": price,
+        "availability": "In Stock" if any(v.get("available", True) for v in variants) else "Out of Stock",
+        # Tags stripped with a regex: the description is stored as text and never needs a DOM
+        "product_description": html.unescape(_TAG_RE.sub(' ', description)).strip() or None,
+        "product_url": product_url,
+        "product_images": json.dumps([image for image in images if image]),
+        "product_variants": json.dumps([
+            {"id": v.get("id"), "title": v.get("title"), "price": v.get("price"), "sku": v.get("sku")} for v in variants
+        ]),
+        "api_response_product_details": json.dumps({"raw_payload_sha256": payload_ref} if payload_ref else product),
+    }
+
+
+def page_db_fields(page_html: str, product_url: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Product columns from the product page when the storefront blocks its JSON endpoints.
+
+    JSON-LD and og: tags are read without building a DOM; the configured HTML parser
+    backend runs only if they do not name the product.
+
+    Returns:
+        Tuple of (db_fields or None if the page has no product, the structured data found)
+    """
+    structured = product_from_structured_data(extract_structured_data(page_html))
+    if not structured["title"] or structured["price"] is None:
+        themed = get_html_parser().select_text(page_html, THEME_SELECTORS)
+        structured["title"] = structured["title"] or themed["title"]
+        if structured["price"] is None and themed["price"]:
+            match = re.search(r'\d[\d,]*(?:\.\d+)?', themed["price"])
+            structured["price"] = float(match.group(0).replace(',', '')) if match else None
+    if not structured["title"]:
+        return None, structured
+    description = structured["description"] or ''
+    return {
+        "product_title": structured["title"],
+        "brand_name": structured["brand"],
+        "price": structured["price"],
+        "availability": "Out of Stock" if structured["availability"] == "OutOfStock" else "In Stock",
+        "product_description": html.unescape(_TAG_RE.sub(' ', description)).strip() or None,
+        "product_url": product_url,
+        "product_images": json.dumps([image for image in structured["images"] if image]),
+    }, structured
+
+
+async def _fetch_app_reviews(submission_id: str, app: ReviewApp, session, limiter: AsyncRateLimiter,
+                             budget: int) -> Tuple[List[ReviewRecord], Optional[int]]:
+    """
+    Page through a review app's API: numbered pages concurrently, cursor APIs in order.
+
+    A page that fails (network error, timeout, or a non-JSON body such as a bot challenge)
+    counts as missing; the reviews from the other pages are kept.
+    """
+    import aiohttp
+
+    payload_archive = get_payload_archive()
+    records: List[ReviewRecord] = []
+    seen = set()
+
+    async def fetch(url: str, params: Optional[Dict[str, Any]]):
+        # Past the scrape deadline no more pages are requested; the ones already fetched are kept
+        if deadline_reached():
+            return None, None
+        try:
+            status, body = await _get(session, limiter, url, params, headers={"Accept": "application/json"})
+            if status != 200:
+                logger.error("[Submission ID: %s] %s reviews request failed: %s", submission_id, app.name, status)
+                return None, None
+            payload = json.loads(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+            logger.error("[Submission ID: %s] %s reviews request failed: %r", submission_id, app.name, e)
+            return None, None
+        payload_ref = await asyncio.to_thread(payload_archive.put, body)
+        return payload, payload_ref
+
+    def collect(payload, payload_ref) -> Tuple[int, Optional[int], Optional[str]]:
+        reviews, total, next_url = app.parse(payload)
+        added = 0
+        for offset, review in enumerate(reviews):
+            if len(records) >= budget:
+                break
+            record = ReviewRecord.from_shopify(submission_id, app.name, review, payload_ref, offset)
+            # Reviews without an id can't be matched across pages, so they are all kept
+            if record.review_id is not None:
+                if record.review_id in seen:
+                    continue
+                seen.add(record.review_id)
+            records.append(record)
+            added += 1
+        return added, total, next_url
+
+    url, params = app.request(1)
+    payload, payload_ref = await fetch(url, params)
+    if payload is None:
+        return records, None
+    added, total, next_url = collect(payload, payload_ref)
+
+    if app.cursor:
+        while next_url and added and len(records) < budget:
+            payload, payload_ref = await fetch(next_url, None)
+            if payload is None:
+                break
+            added, _, next_url = collect(payload, payload_ref)
+    elif total is not None:
+        last_page = math.ceil(min(total, budget) / app.per_page)
+        pages = await asyncio.gather(*(fetch(*app.request(page)) for page in range(2, last_page + 1)))
+        for payload, payload_ref in pages:
+            if payload is not None:
+                collect(payload, payload_ref)
+    else:
+        # No total in the response: walk pages until one comes back empty
+        page = 1
+        while added and len(records) < budget:
+            page += 1
+            payload, payload_ref = await fetch(*app.request(page))
+            if payload is None:
+                break
+            added, _, _ = collect(payload, payload_ref)
+
+    review_log.info("[Submission ID: %s] Collected %d %s reviews", submission_id, len(records), app.name)
+    return records, total
+
+
+async def scrape_shopify_product(submission_id: str, url: str, session,
+                                 limiter: Optional[AsyncRateLimiter] = None) -> Dict[str, Any]:
+    """
+    Fetch a Shopify product and its reviews, preferring JSON endpoints to page parsing.
+
+    Product data comes from the storefront's /products/<handle>.json (or .js), or from the
+    page's JSON-LD and og: tags if those endpoints are blocked. The review app is detected
+    from fingerprints in the product page, and its JSON API is paginated concurrently where
+    the app uses numbered pages.
+
+    Args:
+        submission_id: The ID of the submission in Supabase
+        url: The Shopify product URL
+        session: aiohttp session to use
+        limiter: Optional limiter shared with other Shopify scrapes in the loop; a
+            per-scrape one with the same budget is used otherwise
+
+    Returns:
+        Dictionary with product_details (database-ready `db_fields` plus the title) and reviews keys
+    """
+    result = {"product_details": None, "reviews": []}
+    base_url, handle = parse_product_url(url)
+    if not handle:
+        logger.error("[Submission ID: %s] No product handle in Shopify URL: %s", submission_id, url)
+        return result
+
+    limiter = limiter or ShopifyScraper().new_limiter()
+    product_url = f"{base_url}/products/{handle}"
+    logger.info("[Submission ID: %s] Fetching Shopify product %s from %s", submission_id, handle, base_url)
+    fetched, page = await asyncio.gather(
+        _fetch_product(session, limiter, base_url, handle),
+        _get(session, limiter, product_url),
+        return_exceptions=True,
+    )
+    if isinstance(fetched, BaseException):
+        raise fetched
+    product, product_body = fetched
+    # The page is only needed for fallbacks (review app detection, JSON-LD); losing it keeps the product JSON
+    if isinstance(page, BaseException):
+        logger.warning("[Submission ID: %s] Could not load Shopify product page %s: %r", submission_id, product_url, page)
+        page_status, page_body = None, b''
+    else:
+        page_status, page_body = page
+    page_html = page_body.decode('utf-8', errors='replace') if page_status == 200 else ''
+    structured = None
+    if product:
+        payload_ref = await asyncio.to_thread(get_payload_archive().put, product_body)
+        db_fields = product_db_fields(product, product_url, payload_ref)
+        product_id = product.get("id")
+    else:
+        logger.warning("[Submission ID: %s] No Shopify product JSON for %s; reading the product page", submission_id, handle)
+        db_fields, structured = page_db_fields(page_html, product_url) if page_html else (None, None)
+        if db_fields is None:
+            logger.error("[Submission ID: %s] Could not load Shopify product %s", submission_id, handle)
+            return result
+        match = _PAGE_PRODUCT_ID_RE.search(page_html)
+        product_id = match.group(1) if match else None
+
+    app = detect_review_app(page_html, product_id, urlsplit(base_url).netloc)
+    if app is None:
+        logger.warning("[Submission ID: %s] No supported review app (Judge.me, Yotpo, Okendo, Stamped) found on %s", submission_id, product_url)
+        reviews, total = [], None
+    else:
+        logger.info("[Submission ID: %s] Detected Shopify review app: %s", submission_id, app.name)
+        reviews, total = await _fetch_app_reviews(submission_id, app, session, limiter, SHOPIFY_MAX_REVIEWS)
+
+    ratings = [review.rating for review in reviews if review.rating is not None]
+    if ratings:
+        db_fields["product_overall_rating"] = round(sum(ratings) / len(ratings), 2)
+        db_fields["product_num_ratings"] = total if total is not None else len(reviews)
+    elif page_html:
+        # No review API to page through: the theme's AggregateRating still gives the headline numbers
+        structured = structured or product_from_structured_data(extract_structured_data(page_html))
+        db_fields["product_overall_rating"] = structured["rating"]
+        db_fields["product_num_ratings"] = structured["review_count"] or 0
+
+    result["product_details"] = {"title": db_fields["product_title"], "db_fields": db_fields}
+    result["reviews"] = reviews
+    return result
+
+
+class ShopifyScraper(PlatformScraper):
+    name = 'shopify'
+    rate_limit = SHOPIFY_RATE_LIMIT
+    max_concurrency = SHOPIFY_MAX_CONCURRENCY
+
+    def matches(self, url: str) -> bool:
+        return is_shopify_url(url)
+
+    async def reviews(self, ctx: ScrapeContext):
+        # Yields only once every page is fetched (see PlatformScraper.reviews)
+        scraped = await scrape_shopify_product(ctx.submission_id, ctx.url, ctx.session, limiter=ctx.limiter)
+        ctx.product_details = scraped["product_details"]
+        for review in scraped["reviews"]:
+            yield review
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, Iterator
+
+from worker.deadlines import current_deadline
+
+logger = logging.getLogger(__name__)
+
+# How long the leader's lock lives without a heartbeat; a crashed leader frees it after this
+SINGLE_FLIGHT_LOCK_TTL = float(os.getenv('SINGLE_FLIGHT_LOCK_TTL', '30'))
+# Longest a follower waits for the leader before fetching on its own (never past the stage deadline)
+SINGLE_FLIGHT_MAX_WAIT = float(os.getenv('SINGLE_FLIGHT_MAX_WAIT', '600'))
+
+_KEY_PREFIX = 'rivalrecon:flight:'
+
+# Delete the lock only if this process still holds it
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Extend the lock only if this process still holds it
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+async def _heartbeat(client, lock_key: str, token: str) -> None:
+    """Keep the leader's lock alive while it is still fetching."""
+    ttl_ms = int(SINGLE_FLIGHT_LOCK_TTL * 1000)
+    while True:
+        await asyncio.sleep(SINGLE_FLIGHT_LOCK_TTL / 3)
+        try:
+            await asyncio.to_thread(client.eval, _EXTEND_SCRIPT, 1, lock_key, token, ttl_ms)
+        except Exception as e:
+            # Followers fall back to fetching themselves once the lock expires
+            logger.warning("Failed to extend single-flight lock %s: %s", lock_key, e)
+            return
+
+
+async def _wait_for_leader(client, lock_key: str, channel: str) -> str:
+    """
+    Block until the leader publishes on `channel`, its lock disappears, or we give up.
+
+    A follower gives up at its stage deadline at the latest; it then runs the block
+    itself, where the scraper's deadline checks stop it fetching more pages.
+    """
+    max_wait = SINGLE_FLIGHT_MAX_WAIT
+    stage_deadline = current_deadline()
+    if stage_deadline is not None:
+        max_wait = min(max_wait, stage_deadline.remaining())
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        # Subscribe before re-checking the lock so a release between the two can't be missed
+        await asyncio.to_thread(pubsub.subscribe, channel)
+        deadline = time.monotonic() + max_wait
+        while time.monotonic() < deadline:
+            if not await asyncio.to_thread(client.exists, lock_key):
+                return 'released'
+            message = await asyncio.to_thread(pubsub.get_message, timeout=1.0)
+            if message and message.get('type') == 'message':
+                return message['data'].decode() if isinstance(message['data'], bytes) else str(message['data'])
+        return 'timeout'
+    finally:
+        await asyncio.to_thread(pubsub.close)
+
+
+@contextlib.asynccontextmanager
+async def single_flight(key: str, enabled: bool = True, redis_client=None) -> AsyncIterator[bool]:
+    """
+    Run the enclosed fetch once per key across all worker processes.
+
+    The first caller takes a Redis lock (SET NX with a heartbeat-extended TTL) and runs
+    the block as the leader. Concurrent callers for the same key wait on the key's
+    pub/sub channel until the leader finishes, then run the block themselves, which is
+    served from the product cache the leader just filled. Yields True for the leader.
+    Without Redis the block simply runs, so coalescing never blocks a scrape.
+    """
+    if not enabled:
+        yield True
+        return
+
+    lock_key = f"{_KEY_PREFIX}{key}:lock"
+    channel = f"{_KEY_PREFIX}{key}:done"
+    token = uuid.uuid4().hex
+    try:
+        if redis_client is None:
+            from worker.clients import get_redis
+            redis_client = get_redis()
+        is_leader = bool(await asyncio.to_thread(
+            redis_client.set, lock_key, token, nx=True, px=int(SINGLE_FLIGHT_LOCK_TTL * 1000)))
+        if not is_leader:
+            started = time.monotonic()
+            outcome = await _wait_for_leader(redis_client, lock_key, channel)
+            logger.info("Waited %.1fs for in-flight fetch of %s (%s)", time.monotonic() - started, key, outcome)
+    except Exception as e:
+        logger.warning("Single-flight unavailable for %s (%s); fetching without coalescing", key, e)
+        yield True
+        return
+
+    if not is_leader:
+        yield False
+        return
+
+    heartbeat = asyncio.create_task(_heartbeat(redis_client, lock_key, token))
+    outcome = 'error'
+    try:
+        yield True
+        outcome = 'done'
+    finally:
+        heartbeat.cancel()
+        try:
+            await asyncio.to_thread(redis_client.eval, _RELEASE_SCRIPT, 1, lock_key, token)
+            await asyncio.to_thread(redis_client.publish, channel, outcome)
+        except Exception as e:
+            logger.warning("Failed to release single-flight lock for %s: %s", key, e)
+
+
+@contextlib.contextmanager
+def exclusive(key: str, ttl: float, redis_client=None) -> Iterator[bool]:
+    """
+    Hold a Redis lock on `key` for work that must never run twice at once (e.g. a refresh
+    rewriting one analysis). Yields False, without waiting, when another process holds it.
+
+    The lock expires after `ttl` seconds, which should be the task's hard time limit, so a
+    killed holder can't keep it. Like single_flight, without Redis the block simply runs.
+    """
+    lock_key = f"{_KEY_PREFIX}{key}:exclusive"
+    token = uuid.uuid4().hex
+    try:
+        if redis_client is None:
+            from worker.clients import get_redis
+            redis_client = get_redis()
+        acquired = bool(redis_client.set(lock_key, token, nx=True, px=int(ttl * 1000)))
+    except Exception as e:
+        logger.warning("Lock unavailable for %s (%s); running without it", key, e)
+        yield True
+        return
+
+    if not acquired:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        try:
+            redis_client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            logger.warning("Failed to release lock for %s: %s", key, e)
@@ -1,27 +1,27 @@
-from celery import Celery, chain, shared_task
+from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from typing import Dict, Any, List
+import asyncio
 import os
-from typing import Dict, Any, Union
-import requests
-import json
 from datetime import datetime
-from supabase import create_client, Client
-from dotenv import load_dotenv
 import logging
 
-# Load environment variables
-load_dotenv()
+from worker.analysis_state import AnalysisState, compact_summary
+from worker.circuit_breaker import CircuitOpenError
+from worker.clients import get_supabase
+from worker.deadlines import PARTIAL_STATUS, current_deadline, soft_time_limit, stage_deadline, time_limit
+from worker.near_duplicates import collapse_near_duplicates
+from worker.queues import REFRESH_QUEUE, enqueue
+from worker.review_record import ReviewRecord, to_rows
+from worker.review_writer import insert_reviews
+from worker.scrapers import ScraperBudgets
+from worker.single_flight import exclusive
+from worker.sentiment import ensure_sentiment
+from worker.themes import theme_clusters
+from worker.usage import save_usage, track_usage
 
-# Initialize Celery with the correct namespace
-celery = Celery('worker', broker=os.getenv('CELERY_BROKER_URL'))
-
-# Initialize Supabase client after environment variables are loaded
-supabase_url = os.getenv('SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not supabase_url or not supabase_key:
-    raise ValueError("Supabase URL and key are required")
-
-supabase: Client = create_client(supabase_url, supabase_key)
+# Environment variables are loaded by celery_app.py; the Supabase client is created
+# lazily by clients.get_supabase() and shared with the other worker modules.
 
 logger = logging.getLogger(__name__)
 
@@ -32,193 +32,235 @@ logger = logging.getLogger(__name__)
 # See scrape_amazon_data function in worker.py for the robust implementation
 
 # The Shopify scraping functionality has been moved to worker.py
-# See scrape_shopify_reviews function in worker.py for the robust implementation
+# See ShopifyScraper in shopify.py for the implementation
+
+# Review ids per existence check when a refresh looks for reviews it already has
+REFRESH_ID_CHUNK = 200
 
-@shared_task(name="refresh_submission")
+@shared_task(name="refresh_submission", soft_time_limit=soft_time_limit('refresh'), time_limit=time_limit('refresh'))
 def refresh_submission(submission_id):
+    """Run a refresh (see _refresh_submission) and store what it consumed under the refresh submission."""
+    # Scraping and the LLM call share the whole submission budget; a refresh that reaches its
+    # deadline stores the new reviews it found and keeps the merged numbers (see _merge_into_analysis)
+    with track_usage() as usage, stage_deadline('refresh'):
+        _refresh_submission(submission_id)
+    save_usage(submission_id, 'refresh', usage)
+
+
+def _refresh_submission(submission_id):
     """
     Process a refresh submission which is linked to a parent submission.
     This will:
-    1. Get the original submission and its reviews
-    2. Scrape new reviews only (those after the latest review date)
-    3. Run analysis on only the new reviews
-    4. Update the original analysis with combined results
+    1. Get the original submission and its latest analysis
+    2. Scrape the product and keep only reviews the original doesn't have yet
+    3. Store the new reviews with the original submission
+    4. Fold the scraped reviews the stored analysis state doesn't contain yet into it
+       (O(new reviews)) and regenerate only the qualitative LLM fields, from those reviews
+       plus a compact prior summary
     5. Mark the original submission as 'completed' again
+
+    Analyses stored before analysis_state existed (or with an older STATE_VERSION) are
+    rebuilt with a full analysis instead.
     """
-    logger.info(f"Processing refresh for submission {submission_id}")
+    logger.info("Processing refresh for submission %s", submission_id)
+    parent_id = None
     
     try:
         # Get the refresh submission details
-        response = supabase.table('submissions').select(
+        response = get_supabase().table('submissions').select(
             "*"
         ).eq('id', submission_id).limit(1).execute()
         
         if not response.data:
-            logger.error(f"Refresh submission {submission_id} not found")
+            logger.error("Refresh submission %s not found", submission_id)
             return
             
         refresh_submission = response.data[0]
         parent_id = refresh_submission.get('refresh_parent_id')
         
         if not parent_id:
-            logger.error(f"Refresh submission {submission_id} has no parent ID")
+            logger.error("Refresh submission %s has no parent ID", submission_id)
             return
             
         # Get the original submission
-        parent_response = supabase.table('submissions').select(
+        parent_response = get_supabase().table('submissions').select(
             "*"
         ).eq('id', parent_id).limit(1).execute()
         
         if not parent_response.data:
-            logger.error(f"Parent submission {parent_id} not found")
+            logger.error("Parent submission %s not found", parent_id)
             return
             
         parent_submission = parent_response.data[0]
+        # One refresh per parent at a time: each rewrites the parent's analysis state
+        with exclusive(f"refresh:{parent_id}", time_limit('refresh')) as acquired:
+            if not acquired:
+                logger.info("Parent %s is being refreshed already; refresh %s goes back to pending", parent_id, submission_id)
+                get_supabase().table('submissions').update({'status': 'pending'}).eq('id', submission_id).execute()
+                return
+            _refresh_parent(submission_id, parent_submission)
+
+    except CircuitOpenError as e:
+        # The provider is down: back to pending, so process_pending_refreshes queues it again later
+        logger.warning("Refresh %s deferred: %s", submission_id, e)
+        get_supabase().table('submissions').update({'status': 'pending'}).eq('id', submission_id).execute()
+
+    except SoftTimeLimitExceeded:
+        # Out of time: whatever reviews were stored stay with the parent, whose previous analysis is still valid
+        logger.warning("Refresh %s hit its time limit; marking it %s", submission_id, PARTIAL_STATUS)
+        _end_failed_refresh(submission_id, parent_id, PARTIAL_STATUS)
         
-        # Get the latest review date from the original submission
-        reviews_response = supabase.table('reviews').select(
-            "created_at"
-        ).eq('submission_id', parent_id).order('created_at', {"ascending": False}).limit(1).execute()
-        
-        latest_review_date = None
-        if reviews_response.data:
-            latest_review_date = reviews_response.data[0]['created_at']
-            logger.info(f"Latest review date: {latest_review_date}")
-        
-        # Scrape new reviews only
-        url = parent_submission['url']
-        logger.info(f"Scraping URL for new reviews: {url}")
-        
-        # Call the scraper with the since_date parameter
-        # This would be your web scraper function
-        # For example: scraper.scrape_reviews(url, since_date=latest_review_date)
-        new_reviews = scrape_reviews(url, since_date=latest_review_date)
-        
-        if not new_reviews:
-            logger.info(f"No new reviews found for {url}")
-            # Update status back to completed
-            supabase.table('submissions').update({
+    except Exception as e:
+        logger.exception("Error refreshing submission %s: %s", submission_id, e)
+        _end_failed_refresh(submission_id, parent_id, 'failed')
+
+
+def _refresh_parent(submission_id: str, parent_submission: Dict[str, Any]) -> None:
+    """Steps 2-5 of _refresh_submission, run while holding the parent's refresh lock."""
+    from worker.worker import _analyze_reviews, _fetch_submission, _new_scrape_result
+
+    parent_id = parent_submission['id']
+    get_supabase().table('submissions').update({'status': 'processing'}).eq('id', submission_id).execute()
+
+    # Scrape the product and keep the reviews the original submission doesn't have
+    url = parent_submission['url']
+    logger.info("Scraping URL for new reviews: %s", url)
+    result = _new_scrape_result(submission_id)
+    _, scraped_reviews = asyncio.run(_fetch_submission(
+        submission_id, url, result, budgets=ScraperBudgets(), marketplaces=parent_submission.get('marketplaces')))
+    if result.get('error'):
+        raise RuntimeError(result['error'])
+    new_reviews = _unseen_reviews(parent_id, scraped_reviews)
+    logger.info("Found %d new reviews out of %d scraped", len(new_reviews), len(scraped_reviews))
+
+    # Scraped reviews belong to the original submission, so its review set stays complete
+    for review in scraped_reviews:
+        review.submission_id = parent_id
+    insert_reviews(parent_id, new_reviews)
+
+    analysis_response = get_supabase().table('analyses').select(
+        "*"
+    ).eq('submission_id', parent_id).order('created_at', desc=True).limit(1).execute()
+    analysis = analysis_response.data[0] if analysis_response.data else None
+    state = AnalysisState.from_json(analysis.get('analysis_state')) if analysis else None
+
+    if state is None:
+        logger.info("No mergeable analysis state for %s; running a full analysis", parent_id)
+        outcome = _analyze_reviews(parent_id)
+        if outcome.get('status') == 'deferred':
+            raise CircuitOpenError(outcome['circuit'], outcome['retry_after'])
+        if outcome.get('status') == 'failed':
+            raise RuntimeError(outcome.get('message'))
+    else:
+        # Folded against the state, not the database: reviews an earlier refresh stored but
+        # never merged (its merge or the analysis write failed) are folded now
+        unfolded = _unfolded_reviews(state, scraped_reviews)
+        if unfolded:
+            _merge_into_analysis(analysis, state, parent_submission, unfolded)
+
+    # Mark original submission as completed again
+    get_supabase().table('submissions').update({
+        'status': 'completed',
+        'last_refreshed_at': datetime.now().isoformat()
+    }).eq('id', parent_id).execute()
+    deadline = current_deadline()
+    get_supabase().table('submissions').update({
+        'status': PARTIAL_STATUS if deadline is not None and deadline.reached else 'completed',
+        'reviews_count': len(new_reviews)
+    }).eq('id', submission_id).execute()
+    
+    logger.info("Refresh completed for submission %s", parent_id)
+
+
+def _end_failed_refresh(submission_id: str, parent_id, status: str) -> None:
+    """
+    Give a refresh that didn't finish its final status.
+
+    The parent keeps its previous analysis, so it goes back to 'completed' (a full
+    re-analysis may have left it 'processing_analysis') rather than failing with the refresh.
+    """
+    try:
+        if parent_id:
+            get_supabase().table('submissions').update({
                 'status': 'completed'
             }).eq('id', parent_id).execute()
             
-            # Update refresh submission status
-            supabase.table('submissions').update({
-                'status': 'completed',
-                'reviews_count': 0
-            }).eq('id', submission_id).execute()
-            
-            return
-            
-        logger.info(f"Found {len(new_reviews)} new reviews")
-        
-        # Save new reviews to database with the refresh_submission_id
-        for review in new_reviews:
-            review['submission_id'] = submission_id
-            
-        reviews_response = supabase.table('reviews').insert(
-            new_reviews
-        ).execute()
-        
-        # Update refresh submission with review count
-        supabase.table('submissions').update({
-            'reviews_count': len(new_reviews),
-            'status': 'processing'
+        get_supabase().table('submissions').update({
+            'status': status
         }).eq('id', submission_id).execute()
-        
-        # Analyze the new reviews
-        analyze_reviews(submission_id)
-        
-        # Once analysis is complete, combine results with original analysis
-        original_analysis_response = supabase.table('analyses').select(
-            "*"
-        ).eq('submission_id', parent_id).limit(1).execute()
-        
-        new_analysis_response = supabase.table('analyses').select(
-            "*"
-        ).eq('submission_id', submission_id).limit(1).execute()
-        
-        if original_analysis_response.data and new_analysis_response.data:
-            # Combine analyses (this would be a complex merge operation)
-            # For example, combining sentiment scores, updating trending data, etc.
-            combined_analysis = combine_analyses(
-                original_analysis_response.data[0],
-                new_analysis_response.data[0]
-            )
-            
-            # Update the original analysis with combined results
-            supabase.table('analyses').update(
-                combined_analysis
-            ).eq('id', original_analysis_response.data[0]['id']).execute()
-        
-        # Mark original submission as completed again
-        supabase.table('submissions').update({
-            'status': 'completed',
-            'last_refreshed_at': datetime.now().isoformat()
-        }).eq('id', parent_id).execute()
-        
-        logger.info(f"Refresh completed for submission {parent_id}")
-        
-    except Exception as e:
-        logger.exception(f"Error refreshing submission {submission_id}: {e}")
-        
-        # Update statuses to failed
-        try:
-            if parent_id:
-                supabase.table('submissions').update({
-                    'status': 'failed'
-                }).eq('id', parent_id).execute()
-                
-            supabase.table('submissions').update({
-                'status': 'failed'
-            }).eq('id', submission_id).execute()
-        except Exception as update_error:
-            logger.exception(f"Error updating status after refresh failure: {update_error}")
-
-
-def combine_analyses(original_analysis, new_analysis):
+    except Exception as update_error:
+        logger.exception("Error updating status after refresh failure: %s", update_error)
+
+
+def _unfolded_reviews(state: AnalysisState, reviews: List[ReviewRecord]) -> List[ReviewRecord]:
+    """Scraped reviews whose review id the analysis state hasn't folded in yet, each once."""
+    unfolded, ids = [], state.unfolded(review.review_id for review in reviews)
+    for review in reviews:
+        if review.review_id in ids:
+            ids.discard(review.review_id)
+            unfolded.append(review)
+    return unfolded
+
+
+def _unseen_reviews(parent_id: str, reviews: List[ReviewRecord]) -> List[ReviewRecord]:
+    """Scraped reviews whose review id the parent submission doesn't have yet (checked in chunks, not by loading history)."""
+    ids = list({review.review_id for review in reviews if review.review_id})
+    known = set()
+    for start in range(0, len(ids), REFRESH_ID_CHUNK):
+        response = get_supabase().table('reviews').select('api_review_id').eq(
+            'submission_id', parent_id).in_('api_review_id', ids[start:start + REFRESH_ID_CHUNK]).execute()
+        known.update(row['api_review_id'] for row in response.data or [])
+    unseen, queued = [], set()
+    for review in reviews:
+        if review.review_id and review.review_id not in known and review.review_id not in queued:
+            queued.add(review.review_id)
+            unseen.append(review)
+    return unseen
+
+
+def _merge_into_analysis(analysis: Dict[str, Any], state: AnalysisState, parent_submission: Dict[str, Any],
+                         new_reviews: List[ReviewRecord]) -> None:
     """
-    Combine an original analysis with a new analysis of recent reviews.
-    This is a complex operation that needs to be customized based on your analysis structure.
+    Fold new reviews into a stored analysis.
+
+    The numeric columns come from the merged state and are exact. The LLM sees only the new
+    reviews plus a compact summary of the prior analysis and rewrites the qualitative
+    columns; if that call fails the numbers are still saved and the prior text is kept.
     """
-    # This is a simplified example - the actual implementation would depend on your analysis structure
-    combined = original_analysis.copy()
-    
-    # Update fields that should reflect all data (e.g., review count, date ranges)
-    combined['reviews_analyzed'] = original_analysis.get('reviews_analyzed', 0) + new_analysis.get('reviews_analyzed', 0)
-    combined['updated_at'] = datetime.now().isoformat()
-    
-    # For arrays, append new items (e.g., top_positives, top_negatives)
-    for field in ['top_positives', 'top_negatives', 'key_insights']:
-        if isinstance(combined.get(field), list) and isinstance(new_analysis.get(field), list):
-            # Create a set of existing items to avoid duplicates
-            existing_items = set(item.lower() if isinstance(item, str) else str(item) for item in combined[field])
-            
-            # Add new items that aren't duplicates
-            for item in new_analysis[field]:
-                item_key = item.lower() if isinstance(item, str) else str(item)
-                if item_key not in existing_items:
-                    combined[field].append(item)
-                    existing_items.add(item_key)
-            
-            # Trim to reasonable size
-            combined[field] = combined[field][:20]  # Limit to 20 items
-    
-    # For numeric values, compute weighted average (e.g., sentiment scores)
-    # Weight by number of reviews
-    original_weight = original_analysis.get('reviews_analyzed', 0)
-    new_weight = new_analysis.get('reviews_analyzed', 0)
-    total_weight = original_weight + new_weight
-    
-    if total_weight > 0:
-        for field in ['sentiment_score', 'overall_score']:
-            if field in original_analysis and field in new_analysis:
-                combined[field] = (
-                    (original_analysis[field] * original_weight) + 
-                    (new_analysis[field] * new_weight)
-                ) / total_weight
-    
-    # Return the combined analysis
-    return combined 
+    from worker.worker import analysis_fields, call_deepseek_api, process_deepseek_response
+
+    rows = to_rows(new_reviews)
+    ensure_sentiment(rows)
+    representatives, collapsed = collapse_near_duplicates(rows)
+    delta = AnalysisState().add_reviews(rows, count_words=False).add_representatives(representatives, collapsed)
+    prior_review_count = state.rating_count
+    state.merge(delta)
+
+    analysis_input = {
+        'original_product_name': parent_submission.get('product_title') or 'Unknown Product',
+        'reviews': representatives,
+        'calculated_average_rating': round(state.average_rating, 2),
+        'calculated_distribution': dict(state.rating_distribution),
+        'calculated_monthly_averages': {month: data["average"] for month, data in state.ratings_over_time().items()},
+        'calculated_sentiment': state.sentiment_scores(),
+        # Clusters of the new reviews only (when there are enough); the stored ones stay as they are
+        'theme_clusters': theme_clusters(representatives),
+        'prior_summary': compact_summary(analysis),
+        'prior_review_count': prior_review_count,
+    }
+    processed = None
+    api_key = os.getenv('DEEPSEEK_API_KEY')
+    response = call_deepseek_api(analysis_input, api_key) if api_key else {'error': 'DeepSeek API key missing'}
+    if 'error' not in response:
+        processed = process_deepseek_response(response)
+    if processed is None or 'error' in processed:
+        logger.warning("Qualitative update failed for analysis %s (%s); "
+                       "saving the merged numbers only", analysis['id'], response.get('error') or processed.get('error'))
+        processed = None
+
+    get_supabase().table('analyses').update(analysis_fields(state, processed)).eq('id', analysis['id']).execute()
+    logger.info("Merged %s new reviews (%s near-duplicates) into analysis %s "
+                "(%s rated reviews in total)", len(new_reviews), collapsed, analysis['id'], state.rating_count)
 
 @shared_task(name="process_pending_refreshes")
 def process_pending_refreshes():
@@ -232,7 +274,7 @@ def process_pending_refreshes():
     
     try:
         # Find pending refresh submissions
-        response = supabase.table('submissions').select(
+        response = get_supabase().table('submissions').select(
             "id"
         ).eq('status', 'pending').not_.is_('refresh_parent_id', 'null').execute()
         
@@ -240,13 +282,13 @@ def process_pending_refreshes():
             return
             
         refresh_submissions = response.data
-        logger.info(f"Found {len(refresh_submissions)} pending refresh submissions")
+        logger.info("Found %s pending refresh submissions", len(refresh_submissions))
         
         # Process each refresh submission
         for submission in refresh_submissions:
-            refresh_submission.delay(submission['id'])
+            enqueue(refresh_submission, (submission['id'],), queue=REFRESH_QUEUE)
             
-        logger.info(f"Queued {len(refresh_submissions)} refresh submissions for processing")
+        logger.info("Queued %s refresh submissions for processing", len(refresh_submissions))
         
     except Exception as e:
-        logger.exception(f"Error processing pending refresh submissions: {e}") 
\ No newline at end of file
+        logger.exception("Error processing pending refresh submissions: %s", e) 
\ No newline at end of file
@@ -0,0 +1,268 @@
+import math
+import os
+import string
+from typing import Any, Dict, List, Sequence
+
+from worker.analysis_state import STOP_WORDS
+from worker.prompt_sampler import clip_text
+
+# Theme clusters per analysis; fewer when there are too few reviews to fill them
+THEME_CLUSTER_COUNT = int(os.getenv('THEME_CLUSTER_COUNT', '10'))
+# Below this many reviews with text, the prompt gets sampled snippets instead of clusters
+THEME_MIN_REVIEWS = int(os.getenv('THEME_MIN_REVIEWS', '40'))
+THEME_MIN_CLUSTER_REVIEWS = 5  # average reviews per cluster when choosing the cluster count
+THEME_VOCABULARY_SIZE = 5000  # terms (words and word pairs) kept, by document frequency
+THEME_TOP_TERMS = 6
+THEME_EXAMPLES = 2  # quotes per cluster, the reviews closest to its centre
+THEME_EXAMPLE_CHARS = 220
+KMEANS_BATCH_SIZE = 256
+KMEANS_EPOCHS = 3
+KMEANS_RUNS = 3  # k-means++ starts; the run whose centres fit the reviews best is kept
+
+_PUNCTUATION = str.maketrans({c: ' ' for c in string.punctuation if c != "'"})
+_SEPARATOR = '\x00'  # between texts; never in stored text
+_MIX = 0x9E3779B97F4A7C15
+
+
+def _weight(review: Dict[str, Any]) -> int:
+    return review.get('duplicate_count') or 1
+
+
+def theme_clusters(reviews: Sequence[Dict[str, Any]], clusters: int = THEME_CLUSTER_COUNT,
+                   seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Cluster reviews into themes locally and describe each cluster.
+
+    Every review becomes a TF-IDF vector over words and adjacent word pairs (stop words
+    dropped, terms hashed and counted with numpy rather than a Python vocabulary). The
+    vectors are clustered with mini-batch k-means (KMEANS_RUNS k-means++ starts, each with
+    KMEANS_EPOCHS passes of KMEANS_BATCH_SIZE, keeping the run whose centres are closest to
+    their reviews) in the vocabulary's dense space, which stays small because only the
+    THEME_VOCABULARY_SIZE most frequent terms are kept. The same reviews and seed always give
+    the same clusters.
+
+    Args:
+        reviews: Review rows (review_text, review_rating, sentiment_label; duplicate_count
+            on near-duplicate representatives counts as that many reviews)
+        clusters: Upper bound on the number of clusters
+        seed: k-means seed
+
+    Returns:
+        Clusters, largest first: {"terms", "reviews", "share", "average_rating",
+        "rating_skew" (average minus the overall average), "low_star_share", "high_star_share",
+        "negative_share", "examples"}; empty if there are fewer than THEME_MIN_REVIEWS texts
+    """
+    import numpy as np
+
+    texts = [review for review in reviews if (review.get('review_text') or '').strip()]
+    if len(texts) < THEME_MIN_REVIEWS:
+        return []
+    vectors = _tfidf([review['review_text'] for review in texts])
+    if vectors is None:
+        return []
+    indptr, indices, data, terms, docs = vectors
+    k = max(2, min(clusters, len(docs) // THEME_MIN_CLUSTER_REVIEWS))
+    rng = np.random.default_rng(seed)
+    # One k-means++ start can put two centres inside one theme and split it, so a few runs are
+    # made and the one with the lowest inertia (squared distance of rows to their centres) kept
+    best = None
+    for _ in range(KMEANS_RUNS):
+        centres = _minibatch_kmeans(indptr, indices, data, len(terms), k, rng)
+        scores = _scores(indptr, indices, data, centres, 0, len(docs))
+        distances = (centres * centres).sum(axis=1) - 2 * scores
+        assignment = np.argmin(distances, axis=1)
+        inertia = distances[np.arange(len(docs)), assignment].sum()
+        if best is None or inertia < best[0]:
+            best = (inertia, centres, scores, assignment)
+    _, centres, scores, assignment = best
+    closeness = scores[np.arange(len(docs)), assignment]
+
+    members = [texts[i] for i in docs]
+    weights = np.array([_weight(review) for review in members], dtype=np.float64)
+    ratings = np.array([_rating(review) for review in members], dtype=np.float64)
+    rated = ~np.isnan(ratings)
+    overall = np.average(ratings[rated], weights=weights[rated]) if rated.any() else math.nan
+    negative = np.array([review.get('sentiment_label') == 'negative' for review in members])
+    # Terms that set a cluster apart: its centre's weight above the corpus-wide mean
+    distinctive = centres - np.average(centres, axis=0, weights=np.bincount(assignment, minlength=k))
+    total = weights.sum()
+
+    results = []
+    for cluster in range(k):
+        mask = assignment == cluster
+        if not mask.any():
+            continue
+        size = weights[mask].sum()
+        cluster_rated = mask & rated
+        average = np.average(ratings[cluster_rated], weights=weights[cluster_rated]) if cluster_rated.any() else None
+        top = [int(t) for t in np.argsort(-distinctive[cluster])[:THEME_TOP_TERMS] if distinctive[cluster, t] > 0]
+        nearest = np.flatnonzero(mask)[np.argsort(-closeness[mask], kind='stable')[:THEME_EXAMPLES]]
+
+        def share(selected) -> float:
+            return round(float(weights[selected].sum() / size), 3)
+
+        results.append({
+            "terms": [terms[t] for t in top],
+            "reviews": int(size),
+            "share": round(float(size / total), 3),
+            "average_rating": round(float(average), 2) if average is not None else None,
+            "rating_skew": round(float(average - overall), 2) if average is not None else None,
+            "low_star_share": share(cluster_rated & (ratings <= 2)),
+            "high_star_share": share(cluster_rated & (ratings >= 4)),
+            "negative_share": share(mask & negative),
+            "examples": [clip_text(members[i]['review_text'].strip(), THEME_EXAMPLE_CHARS) for i in nearest],
+        })
+    results.sort(key=lambda cluster: -cluster["reviews"])
+    return results
+
+
+def _rating(review: Dict[str, Any]) -> float:
+    try:
+        rating = float(review.get('review_rating'))
+    except (TypeError, ValueError):
+        return math.nan
+    return rating if 1.0 <= rating <= 5.0 else math.nan
+
+
+def _tfidf(texts: List[str]):
+    """
+    Row-normalised TF-IDF matrix in CSR form over the most frequent words and word pairs.
+
+    Returns:
+        (indptr, indices, data, term strings, row -> index into `texts`), with texts that
+        have no kept term left out; None if no term is frequent enough
+    """
+    import numpy as np
+
+    n = len(texts)
+    tokens = f' {_SEPARATOR} '.join(texts).lower().translate(_PUNCTUATION).split()
+    count = len(tokens)
+    is_separator = np.fromiter((token == _SEPARATOR for token in tokens), dtype=bool, count=count)
+    doc = np.cumsum(is_separator)
+    content = np.fromiter((len(token) > 2 and token.isalpha() and token not in STOP_WORDS for token in tokens),
+                          dtype=bool, count=count)
+    positions = np.flatnonzero(content)
+    hashes = np.fromiter((hash(tokens[p]) for p in positions.tolist()), dtype=np.int64,
+                         count=len(positions)).view(np.uint64)
+    content_docs = doc[positions]
+
+    # Terms: every content word, and every pair of consecutive content words in one text
+    pair = content_docs[1:] == content_docs[:-1]
+    term_hashes = np.concatenate([hashes, hashes[:-1][pair] * np.uint64(_MIX) + hashes[1:][pair]])
+    term_docs = np.concatenate([content_docs, content_docs[:-1][pair]])
+    term_first = np.concatenate([positions, positions[:-1][pair]])
+    term_second = np.concatenate([np.full(len(positions), -1), positions[1:][pair]])
+    if not len(term_hashes):
+        return None
+
+    vocabulary, first_seen, term_ids = np.unique(term_hashes, return_index=True, return_inverse=True)
+    pairs, frequency = np.unique(term_docs * len(vocabulary) + term_ids, return_counts=True)
+    pair_docs, pair_terms = pairs // len(vocabulary), pairs % len(vocabulary)
+    df = np.bincount(pair_terms, minlength=len(vocabulary))
+    # Keep terms in at least two reviews and at most half of them, the most frequent first
+    eligible = np.flatnonzero((df >= 2) & (df <= max(2, n // 2)))
+    if not len(eligible):
+        return None
+    kept = eligible[np.argsort(-df[eligible], kind='stable')[:THEME_VOCABULARY_SIZE]]
+    column = np.full(len(vocabulary), -1)
+    column[kept] = np.arange(len(kept))
+
+    keep = column[pair_terms] >= 0
+    pair_docs, pair_terms, frequency = pair_docs[keep], column[pair_terms[keep]], frequency[keep]
+    idf = np.log((1 + n) / (1 + df[kept])) + 1
+    values = (1 + np.log(frequency)) * idf[pair_terms]
+    norms = np.sqrt(np.bincount(pair_docs, weights=values * values, minlength=n + 1))
+    values = values / norms[pair_docs]
+
+    # pair_docs is sorted (unique sorts by doc first), so rows are already contiguous
+    docs, row_lengths = np.unique(pair_docs, return_counts=True)
+    indptr = np.concatenate([[0], np.cumsum(row_lengths)])
+    first, second = term_first[first_seen[kept]], term_second[first_seen[kept]]
+    terms = [tokens[a] if b < 0 else f"{tokens[a]} {tokens[b]}" for a, b in zip(first.tolist(), second.tolist())]
+    return indptr, pair_terms, values, terms, docs.tolist()
+
+
+def _scores(indptr, indices, data, centres, start: int, stop: int):
+    """Dot products of rows start..stop with every centre, as a (rows, centres) array."""
+    import numpy as np
+
+    lo, hi = indptr[start], indptr[stop]
+    contributions = data[lo:hi, None] * centres[:, indices[lo:hi]].T
+    return np.add.reduceat(contributions, indptr[start:stop] - lo, axis=0)
+
+
+def _minibatch_kmeans(indptr, indices, data, dimensions: int, k: int, rng):
+    """Centres from mini-batch k-means (Sculley 2010) over CSR rows with unit norm."""
+    import numpy as np
+
+    rows = len(indptr) - 1
+    dense = np.zeros((k, dimensions))
+
+    def row(i: int):
+        vector = np.zeros(dimensions)
+        vector[indices[indptr[i]:indptr[i + 1]]] = data[indptr[i]:indptr[i + 1]]
+        return vector
+
+    # Greedy k-means++: each next centre is the best of a few rows drawn with probability
+    # proportional to their squared distance, the one leaving the smallest total distance
+    def distances_to(centre):
+        similarity = _scores(indptr, indices, data, centre[None, :], 0, rows)[:, 0]
+        return np.maximum(2 - 2 * similarity, 0)
+
+    dense[0] = row(int(rng.integers(rows)))
+    distance = distances_to(dense[0])
+    for c in range(1, k):
+        total = distance.sum()
+        if total <= 0:
+            dense[c] = row(int(rng.integers(rows)))
+            continue
+        best = None
+        for candidate in rng.choice(rows, size=2 + int(math.log(k)), p=distance / total).tolist():
+            candidate_distance = np.minimum(distance, distances_to(row(candidate)))
+            if best is None or candidate_distance.sum() < best[0].sum():
+                best = (candidate_distance, candidate)
+        distance, dense[c] = best[0], row(best[1])
+
+    # Batches are drawn from a shuffled copy: stored order is grouped (e.g. by star rating)
+    order = rng.permutation(rows)
+    lengths = np.diff(indptr)[order]
+    shuffled_indptr = np.concatenate([[0], np.cumsum(lengths)])
+    entries = np.repeat(indptr[order] - shuffled_indptr[:-1], lengths) + np.arange(shuffled_indptr[-1])
+    indptr, indices, data = shuffled_indptr, indices[entries], data[entries]
+
+    counts = np.zeros(k)
+    row_of_entry = np.repeat(np.arange(rows), lengths)
+    for _ in range(KMEANS_EPOCHS):
+        for start in range(0, rows, KMEANS_BATCH_SIZE):
+            stop = min(rows, start + KMEANS_BATCH_SIZE)
+            scores = _scores(indptr, indices, data, dense, start, stop)
+            nearest = np.argmin((dense * dense).sum(axis=1) - 2 * scores, axis=1)
+            lo, hi = indptr[start], indptr[stop]
+            sums = np.zeros((k, dimensions))
+            np.add.at(sums, (nearest[row_of_entry[lo:hi] - start], indices[lo:hi]), data[lo:hi])
+            assigned = np.bincount(nearest, minlength=k)
+            counts += assigned
+            # Each centre moves towards its new members with a per-centre step of 1 / members so far
+            moved = assigned > 0
+            dense[moved] = (dense[moved] * (1 - assigned[moved] / counts[moved])[:, None]
+                            + sums[moved] / counts[moved][:, None])
+    return dense
+
+
+def render_theme_clusters(clusters: List[Dict[str, Any]]) -> str:
+    """Cluster summaries as prompt lines, one block per cluster."""
+    lines = []
+    for number, cluster in enumerate(clusters, start=1):
+        rating = cluster["average_rating"]
+        skew = cluster["rating_skew"]
+        lines.append(
+            f"Cluster {number}: {cluster['reviews']} reviews ({cluster['share']:.0%}); "
+            f"terms: {', '.join(cluster['terms']) or 'n/a'}; "
+            f"avg rating {rating if rating is not None else 'n/a'}"
+            f"{f' ({skew:+.2f} vs overall)' if skew is not None else ''}; "
+            f"1-2 stars {cluster['low_star_share']:.0%}, 4-5 stars {cluster['high_star_share']:.0%}, "
+            f"negative sentiment {cluster['negative_share']:.0%}"
+        )
+        lines.extend(f'  - "{example}"' for example in cluster["examples"])
+    return "\n".join(lines)
+
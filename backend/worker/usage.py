@@ -0,0 +1,118 @@
+import contextlib
+import contextvars
+import logging
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Counters kept per submission and stage; each is a column of submission_usage
+USAGE_FIELDS = (
+    'prompt_tokens', 'completion_tokens', 'cached_prompt_tokens', 'llm_calls', 'llm_seconds',
+    'rapidapi_calls', 'rapidapi_bytes', 'storefront_calls', 'storefront_bytes', 'db_round_trips',
+)
+# Providers whose HTTP calls are counted: RapidAPI (Amazon) and Shopify storefronts / review apps
+HTTP_PROVIDERS = ('rapidapi', 'storefront')
+
+_current: contextvars.ContextVar[Optional['SubmissionUsage']] = contextvars.ContextVar('submission_usage', default=None)
+
+
+class SubmissionUsage:
+    """
+    What one stage of one submission consumed: LLM tokens and latency, scraper calls and
+    bytes, and Supabase round trips.
+
+    The ledger of the running task lives in a context variable (see track_usage), so the
+    places that make the calls record into it without it being passed around. asyncio
+    tasks and asyncio.to_thread carry the context along, so every submission of a batch
+    scrape keeps its own ledger.
+    """
+
+    __slots__ = USAGE_FIELDS
+
+    def __init__(self):
+        for field in USAGE_FIELDS:
+            setattr(self, field, 0)
+        self.llm_seconds = 0.0
+
+    def add_llm_call(self, seconds: float) -> None:
+        """One LLM request and how long it took, failed ones included."""
+        self.llm_calls += 1
+        self.llm_seconds += seconds
+
+    def add_llm_tokens(self, tokens: Dict[str, int]) -> None:
+        """Token counts of a completed LLM request (analysis_prompt.llm_usage)."""
+        for key, value in tokens.items():
+            setattr(self, key, getattr(self, key) + value)
+
+    def add_http_call(self, provider: str, nbytes: int) -> None:
+        """One scraper request to a provider in HTTP_PROVIDERS and the size of its body."""
+        setattr(self, f'{provider}_calls', getattr(self, f'{provider}_calls') + 1)
+        setattr(self, f'{provider}_bytes', getattr(self, f'{provider}_bytes') + nbytes)
+
+    def to_json(self) -> Dict[str, Any]:
+        counts = {field: getattr(self, field) for field in USAGE_FIELDS}
+        counts['llm_seconds'] = round(self.llm_seconds, 3)
+        return counts
+
+
+@contextlib.contextmanager
+def track_usage() -> Iterator[SubmissionUsage]:
+    """Make a fresh ledger the current one for the duration of the block."""
+    usage = SubmissionUsage()
+    token = _current.set(usage)
+    try:
+        yield usage
+    finally:
+        _current.reset(token)
+
+
+def current_usage() -> Optional[SubmissionUsage]:
+    """The ledger of the running task, or None outside track_usage."""
+    return _current.get()
+
+
+def record_llm_call(seconds: float) -> None:
+    usage = _current.get()
+    if usage is not None:
+        usage.add_llm_call(seconds)
+
+
+def record_llm_tokens(tokens: Dict[str, int]) -> None:
+    usage = _current.get()
+    if usage is not None:
+        usage.add_llm_tokens(tokens)
+
+
+def record_http_call(provider: str, nbytes: int) -> None:
+    usage = _current.get()
+    if usage is not None:
+        usage.add_http_call(provider, nbytes)
+
+
+def count_db_round_trip(request) -> None:
+    """httpx request hook on the PostgREST session (installed by clients.get_supabase)."""
+    usage = _current.get()
+    if usage is not None:
+        usage.db_round_trips += 1
+
+
+def save_usage(submission_id: Optional[str], stage: str, usage: SubmissionUsage) -> None:
+    """
+    Store a stage's ledger as a submission_usage row; the user_usage_daily view adds the rows
+    up per user and day. Accounting never fails a task, so errors are only logged.
+
+    Args:
+        submission_id: The submission the work was for
+        stage: 'scrape', 'analyze' or 'refresh'
+        usage: The ledger from track_usage
+    """
+    if not submission_id:
+        return
+    from worker.clients import get_supabase
+    row = {'submission_id': submission_id, 'stage': stage, **usage.to_json()}
+    try:
+        get_supabase().table('submission_usage').insert(row).execute()
+    except Exception as e:
+        logger.warning("[Submission ID: %s] Could not store %s usage: %s", submission_id, stage, e)
+        return
+    logger.info("[Submission ID: %s] %s usage: %s", submission_id, stage, row)
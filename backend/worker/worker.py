@@ -1,156 +1,50 @@
-import os
-import json
-import logging
-import requests
-import aiohttp
 import asyncio
+import contextlib
 import json
+import logging
 import os
 import re
-import statistics
-import traceback
-import uuid
-import random
-from bs4 import BeautifulSoup
+import time
 from celery import Celery
-from collections import defaultdict
-from datetime import datetime, timedelta
-from pathlib import Path
-from supabase import create_client, Client
+from celery.exceptions import SoftTimeLimitExceeded
+from datetime import datetime
 from typing import Any, Dict, List, Optional, Union
 
-# Helper function to extract helpful votes count from text
-def extract_helpful_votes(votes_text: str) -> int:
-    """Extract the helpful votes count from a text like '93 people found this helpful'"""
-    if not votes_text:
-        return 0
-    
-    # Use regex to extract the number
-    match = re.search(r'(\d+)', votes_text)
-    if match:
-        return int(match.group(1))
-    return 0
-
-def parse_amazon_review_date(date_text: str) -> str:
-    """
-    Parse a date string from Amazon review format to ISO format
-    Handles the RapidAPI format: "Reviewed in the United States on September 18, 2024"
-    """
-    if not date_text or not date_text.strip():
-        logger.debug(f"No review date provided in API response")
-        return ""  # Return empty string for missing dates
-    
-    # Log the date format we're trying to parse for debugging purposes
-    logger.debug(f"Attempting to parse review date: '{date_text}'")
-    
-    # If it's already in ISO format
-    if re.match(r'^\d{4}-\d{2}-\d{2}T', date_text):
-        logger.debug(f"Date is already in ISO format: {date_text}")
-        return date_text
-
-    # Match "Reviewed in X on DATE" pattern
-    # This is the standard format from RapidAPI as documented
-    reviewed_in_match = re.search(r'Reviewed in .+? on (.+?)$', date_text)
-    if reviewed_in_match:
-        date_part = reviewed_in_match.group(1).strip()
-        logger.debug(f"Extracted date part: '{date_part}'")
-        try:
-            # Try "Month Day, Year" format (September 18, 2024)
-            parsed_date = datetime.strptime(date_part, "%B %d, %Y")
-            iso_date = parsed_date.isoformat()
-            logger.debug(f"Successfully parsed date '{date_part}' to ISO format: {iso_date}")
-            return iso_date
-        except ValueError as e:
-            logger.warning(f"Failed to parse standard date format '{date_part}': {e}")
-            
-            # Try alternative formats
-            alternative_formats = [
-                "%b %d, %Y",      # Sep 18, 2024
-                "%d %B, %Y",      # 18 September, 2024
-                "%d %b, %Y",      # 18 Sep, 2024
-                "%B %d %Y",       # September 18 2024
-                "%d %B %Y"        # 18 September 2024
-            ]
-            
-            for fmt in alternative_formats:
-                try:
-                    parsed_date = datetime.strptime(date_part, fmt)
-                    iso_date = parsed_date.isoformat()
-                    logger.debug(f"Successfully parsed date '{date_part}' with alternative format {fmt} to ISO: {iso_date}")
-                    return iso_date
-                except ValueError:
-                    continue
-    
-    # Match any direct date format that might be in the string, like "September 18, 2024"
-    # This is a fallback in case the "Reviewed in" pattern changes
-    date_patterns = [
-        r'([A-Za-z]+ \d{1,2}, \d{4})',             # September 18, 2024
-        r'(\d{1,2} [A-Za-z]+,? \d{4})',            # 18 September, 2024 or 18 September 2024
-        r'(\d{4}-\d{2}-\d{2})'                     # 2024-09-18
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, date_text)
-        if match:
-            date_part = match.group(1).strip()
-            logger.debug(f"Matched date pattern {pattern} with result: '{date_part}'")
-            
-            # Try different date formats
-            formats_to_try = [
-                "%B %d, %Y",      # September 18, 2024
-                "%b %d, %Y",      # Sep 18, 2024
-                "%d %B, %Y",      # 18 September, 2024
-                "%d %b, %Y",      # 18 Sep, 2024
-                "%d %B %Y",       # 18 September 2024
-                "%d %b %Y",       # 18 Sep 2024
-                "%Y-%m-%d"        # 2024-09-18
-            ]
-            
-            for fmt in formats_to_try:
-                try:
-                    parsed_date = datetime.strptime(date_part, fmt)
-                    iso_date = parsed_date.isoformat()
-                    logger.debug(f"Successfully parsed direct date '{date_part}' with format {fmt} to ISO: {iso_date}")
-                    return iso_date
-                except ValueError:
-                    continue
-    
-    # As a last resort, try dateutil parser which can handle many formats
-    try:
-        from dateutil import parser
-        parsed_date = parser.parse(date_text, fuzzy=True)
-        iso_date = parsed_date.isoformat()
-        logger.debug(f"Parsed date with dateutil: '{date_text}' to ISO: {iso_date}")
-        return iso_date
-    except Exception as e:
-        logger.warning(f"Even dateutil parser failed on '{date_text}': {e}")
-    
-    # Still couldn't parse, log and return empty string
-    logger.warning(f"Could not parse date string: '{date_text}' with any known format")
-    return ""
-
-# Set up logging to both file and console
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('celery.log'),
-        logging.StreamHandler()
-    ]
-)
+# aiohttp, bs4, requests and dateutil are imported where they are used so importing this
+# module (worker boot, prefork children, benchmarks) stays cheap.
+from worker.analysis_prompt import analysis_messages, llm_usage
+from worker.analysis_state import AnalysisState
+from worker.circuit_breaker import (LLM_SLOW_CALL_SECONDS, RAPIDAPI_SLOW_CALL_SECONDS, CircuitOpenError, defer_task,
+                                    deferral_countdown, failed_status, get_breaker)
+from worker.clients import get_supabase
+from worker.deadlines import (HTTP_READ_TIMEOUT, LLM_READ_TIMEOUT, PARTIAL_STATUS, current_deadline, deadline_reached,
+                              http_timeout, llm_timeout, soft_time_limit, stage_deadline, time_limit)
+from worker.logging_config import SampledLogger
+from worker.marketplaces import AMAZON_MARKETPLACES, marketplace_url, resolve_marketplaces
+from worker.near_duplicates import collapse_near_duplicates
+from worker.payload_archive import get_payload_archive
+from worker.product_cache import ProductCache, get_product_cache
+from worker.profiling import maybe_profile, profiling_requested
+from worker.queues import current_queue, enqueue
+from worker.rate_limit import RAPIDAPI_BURST, RAPIDAPI_MAX_CONCURRENCY, RAPIDAPI_RATE_LIMIT, AsyncRateLimiter, RateBudgets
+from worker.review_record import ReviewRecord
+from worker.review_writer import insert_reviews
+from worker.sentiment import ensure_sentiment
+from worker.scrape_checkpoint import ScrapeCheckpoint
+from worker.scrapers import PlatformScraper, ScrapeContext, ScraperBudgets, get_scraper, register_scraper, url_pattern
+from worker.shopify import ShopifyScraper
+from worker.themes import theme_clusters
+from worker.usage import record_http_call, record_llm_call, record_llm_tokens, save_usage, track_usage
+from worker.single_flight import single_flight
+
+
+# Logging is configured once per process by logging_config.configure_logging
+# (wired to Celery's setup_logging signal in celery_app.py); the level comes from LOG_LEVEL.
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG) # Explicitly set level for this logger
-
-# Initialize Supabase client
-supabase_url = os.getenv('SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY') # Use the service role key
+# Per-review and per-page lines go through the sampler so large scrapes don't flood the log
+review_log = SampledLogger(logger)
 
-if not supabase_url or not supabase_key:
-    logger.error("Supabase credentials not found in environment variables")
-    raise ValueError("Supabase credentials not configured")
-
-supabase = create_client(supabase_url, supabase_key)
-logger.info("Supabase client initialized successfully")
+# Supabase is reached through clients.get_supabase(): one lazily-created client per process
 
 # Initialize Celery
 app = Celery('rivalrecon',
@@ -166,22 +60,43 @@ app.conf.update(
     broker_transport_options = {'visibility_timeout': 3600} # Example visibility timeout
 )
 
-# Known Shopify domains (add more as needed)
-KNOWN_SHOPIFY_DOMAINS = ["myshopify.com", "shop.app"]
+# Amazon review pagination limits (overridable so the benchmark harness can run larger scrapes)
+AMAZON_MAX_REVIEW_PAGES = int(os.getenv('AMAZON_MAX_REVIEW_PAGES', '100'))
+AMAZON_MAX_REVIEWS = int(os.getenv('AMAZON_MAX_REVIEWS', '1000'))
+AMAZON_PAGE_DELAY = float(os.getenv('AMAZON_PAGE_DELAY', '0.5'))  # seconds between review pages
+# 'off' pages through all reviews (MOST_RECENT); 'stars' fetches each star bucket in parallel
+AMAZON_REVIEW_SHARDING = os.getenv('AMAZON_REVIEW_SHARDING', 'off')
+STAR_RATING_SHARDS = ["5_STARS", "4_STARS", "3_STARS", "2_STARS", "1_STARS"]
+# Reviews to sample from each star bucket in 'stars' mode
+AMAZON_STAR_BUCKET_BUDGET = int(os.getenv('AMAZON_STAR_BUCKET_BUDGET', str(max(1, AMAZON_MAX_REVIEWS // len(STAR_RATING_SHARDS)))))
 
 # Amazon scraping implementation
-async def scrape_amazon_data(submission_id: str, url: str) -> Dict[str, Any]:
+async def scrape_amazon_data(submission_id: str, url: str, session=None,
+                             limiter: Optional[RateBudgets] = None,
+                             marketplaces: Optional[List[str]] = None,
+                             checkpoint: Optional[ScrapeCheckpoint] = None) -> Dict[str, Any]:
     """
     Asynchronously scrape Amazon product details and reviews using RapidAPI.
     
     Args:
         submission_id: The ID of the submission in Supabase
-        url: The Amazon product URL to scrape
+        url: The Amazon product URL to scrape; its domain is the primary marketplace
+        session: Optional shared aiohttp session; one is created (and closed) if not given
+        limiter: Optional shared rate budgets (a shared one plus one per country); when given
+            they pace requests instead of AMAZON_PAGE_DELAY, and a 429 pauses every scrape
+            sharing them before retrying
+        marketplaces: Optional extra country codes to scrape (from submissions.marketplaces)
+        checkpoint: Optional progress of an earlier attempt; review pages it completed are not
+            fetched again, and every page processed now is recorded
         
     Returns:
-        Dictionary with product_details and reviews keys
+        Dictionary with product_details (from the primary marketplace) and reviews keys;
+        reviews from all marketplaces are merged, de-duplicated and tagged with their country
     """
-    logger.info(f"[Submission ID: {submission_id}] Starting Amazon scraping via RapidAPI for URL: {url}")
+    import aiohttp
+
+    checkpoint = checkpoint or ScrapeCheckpoint.disabled()
+    logger.info("[Submission ID: %s] Starting Amazon scraping via RapidAPI for URL: %s", submission_id, url)
     
     product_details = None
     reviews_list = []
@@ -194,7 +109,7 @@ async def scrape_amazon_data(submission_id: str, url: str) -> Dict[str, Any]:
     asin = None
     
     # Log the URL we're processing for debugging
-    logger.info(f"[Submission ID: {submission_id}] Processing URL: {url}")
+    logger.info("[Submission ID: %s] Processing URL: %s", submission_id, url)
     
     # Try multiple regex patterns to extract ASIN from various Amazon URL formats
     asin_patterns = [
@@ -209,23 +124,26 @@ async def scrape_amazon_data(submission_id: str, url: str) -> Dict[str, Any]:
         asin_match = re.search(pattern, url)
         if asin_match:
             asin = asin_match.group(1)
-            logger.info(f"[Submission ID: {submission_id}] Extracted ASIN: {asin} using pattern: {pattern}")
+            logger.info("[Submission ID: %s] Extracted ASIN: %s using pattern: %s", submission_id, asin, pattern)
             break
     
     if not asin:
-        logger.error(f"[Submission ID: {submission_id}] Could not extract ASIN from URL: {url}")
-        supabase.table("submissions").update({"status": "failed", "error_message": "Could not extract ASIN from URL."}).eq("id", submission_id).execute()
+        logger.error("[Submission ID: %s] Could not extract ASIN from URL: %s", submission_id, url)
+        get_supabase().table("submissions").update({"status": "failed", "error_message": "Could not extract ASIN from URL."}).eq("id", submission_id).execute()
         return result # Return empty result
     
+    countries = resolve_marketplaces(url, marketplaces)
+    logger.info("[Submission ID: %s] Marketplaces to scrape: %s", submission_id, countries)
+
     # Clean the original submission URL to remove tracking parameters which might be confusing the system
-    clean_amazon_url = f"https://www.amazon.com/dp/{asin}"
-    logger.info(f"[Submission ID: {submission_id}] Using clean Amazon URL: {clean_amazon_url}")
+    clean_amazon_url = marketplace_url(countries[0], asin)
+    logger.info("[Submission ID: %s] Using clean Amazon URL: %s", submission_id, clean_amazon_url)
     
     # Update the submission with the clean URL immediately to avoid confusion
     try:
-        supabase.table("submissions").update({"product_url": clean_amazon_url}).eq("id", submission_id).execute()
+        get_supabase().table("submissions").update({"product_url": clean_amazon_url}).eq("id", submission_id).execute()
     except Exception as e:
-        logger.warning(f"[Submission ID: {submission_id}] Could not update clean URL: {e}")
+        logger.warning("[Submission ID: %s] Could not update clean URL: %s", submission_id, e)
         # Continue anyway as this is not fatal
         
     # Get RapidAPI configuration from environment
@@ -234,277 +152,395 @@ async def scrape_amazon_data(submission_id: str, url: str) -> Dict[str, Any]:
 
     if not rapidapi_key or not rapidapi_host:
         error_msg = "Missing required RapidAPI environment variables (KEY, HOST)"
-        logger.error(f"[Submission ID: {submission_id}] {error_msg}")
-        supabase.table("submissions").update({"status": "failed", "error_message": error_msg}).eq("id", submission_id).execute()
+        logger.error("[Submission ID: %s] %s", submission_id, error_msg)
+        get_supabase().table("submissions").update({"status": "failed", "error_message": error_msg}).eq("id", submission_id).execute()
         return result
         
     try:
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                "x-rapidapi-key": rapidapi_key,
-                "x-rapidapi-host": rapidapi_host
-            }
-            product_api_url = f"https://{rapidapi_host}/product-details"
-            product_params = {
-                "country": "US", # Or make dynamic if needed
-                "asin": asin
-            }
-
-            # --- Fetch Product Details via RapidAPI --- 
-            logger.info(f"[Submission ID: {submission_id}] Fetching product details from RapidAPI for ASIN: {asin}")
-            async with session.get(product_api_url, headers=headers, params=product_params) as product_response:
-                if product_response.status != 200:
-                    error_text = await product_response.text()
-                    logger.error(f"[Submission ID: {submission_id}] Failed to fetch RapidAPI product details: {product_response.status} - {error_text}")
-                    # Optionally update submission status or continue to reviews?
-                    # For now, we continue to try fetching reviews even if details fail
-                else:
-                    try:
-                        product_data = await product_response.json()
-                        logger.info(f"[Submission ID: {submission_id}] Successfully fetched RapidAPI product details.")
-                        logger.debug(f"[Submission ID: {submission_id}] Raw Product Details API Response Keys: {list(product_data.keys())}")
-                        
-                        # Map API response to our product_details structure
-                        # Extract data from the RapidAPI response - carefully follow the exact format we see in the database
-                        api_data = product_data.get("data", {})
-                        # Get manufacturer from product information if available
-                        manufacturer = None
-                        if api_data.get("product_information") and isinstance(api_data.get("product_information"), dict):
-                            manufacturer = api_data.get("product_information", {}).get("Manufacturer")
-                            
-                        # Use the dedicated function to process the API response into database fields
-                        # This gives us a clean separation between API fetching and database processing
-                        logger.info(f"[Submission ID: {submission_id}] Processing product details using dedicated function")
-                        
-                        # Add the raw product_data to result first
-                        result["raw_api_response"] = product_data
-                        
-                        # Process the API response to get database-ready fields
-                        product_details = {"raw_api_response": product_data}  # Always include the raw response
-                        
-                        # Fallback to first extracting product title if needed
-                        product_title = None
-                        if api_data.get("product_title"):
-                            product_title = api_data.get("product_title")
-                            logger.info(f"[Submission ID: {submission_id}] Found product title in API data: {product_title}")
-                        else:
-                            logger.warning(f"[Submission ID: {submission_id}] No product title found in API data")
-                        
-                        # Add the product title to product_details
-                        product_details["title"] = product_title
-                        
-                        result["product_details"] = product_details # Update result dict
-                        logger.info(f"[Submission ID: {submission_id}] Parsed product details from API.")
-
-                    except json.JSONDecodeError:
-                        logger.error(f"[Submission ID: {submission_id}] Failed to decode JSON from RapidAPI product details response.")
-                    except Exception as e:
-                        logger.exception(f"[Submission ID: {submission_id}] Error processing RapidAPI product details response: {e}")
-
-            # --- Fetch Reviews via RapidAPI --- 
-            logger.info(f"[Submission ID: {submission_id}] Starting RapidAPI Amazon review collection for ASIN: {asin}")
-            # Use the same host for reviews
-            reviews_api_url = f"https://{rapidapi_host}/product-reviews"
-            
-            page_num = 1
-            MAX_PAGES = 100 # Expanded to fetch up to 100 pages of reviews
-            MAX_REVIEWS = 1000 # Limit total reviews to prevent excessive database usage
-            RATE_LIMIT_RETRY_DELAY = 2.0 # seconds to wait if we hit a rate limit
-            
-            while page_num <= MAX_PAGES:
-                review_params = {
-                    "country": "US",
-                    "asin": asin,
-                    "page": str(page_num),
-                    "sort_by": "MOST_RECENT", # Per documentation: TOP_REVIEWS or MOST_RECENT
-                    "star_rating": "ALL", # ALL, 5_STARS, 4_STARS, 3_STARS, 2_STARS, 1_STARS, POSITIVE, CRITICAL
-                    "verified_purchases_only": "false",
-                    "images_or_videos_only": "false"
-                }
-                logger.info(f"[Submission ID: {submission_id}] Fetching reviews page {page_num}")
-                async with session.get(reviews_api_url, headers=headers, params=review_params) as reviews_response:
-                    if reviews_response.status != 200:
-                        error_text = await reviews_response.text()
-                        logger.error(f"[Submission ID: {submission_id}] Failed to fetch RapidAPI reviews page {page_num}: {reviews_response.status} - {error_text}")
-                        break # Stop fetching reviews if a page fails
-
-                    try:
-                        reviews_data = await reviews_response.json()
-                        logger.debug(f"[Submission ID: {submission_id}] Reviews Page {page_num} - Raw Keys: {list(reviews_data.keys())}")
-                        
-                        # Per RAPIDAPI_AMAZON_CONFIG.mdc, reviews are in data.reviews array
-                        data = reviews_data.get("data", {})
-                        page_reviews = data.get("reviews", [])
-                        
-                        # Log full response structure to help debug
-                        logger.debug(f"[Submission ID: {submission_id}] Full Reviews Response: {json.dumps(reviews_data)[:1000]}...")
-                        
-                        if not page_reviews:
-                            logger.info(f"[Submission ID: {submission_id}] No more reviews found on page {page_num}.")
-                            break # Stop if no reviews on the page
-                        
-                        logger.info(f"[Submission ID: {submission_id}] Fetched {len(page_reviews)} reviews from page {page_num}.")
-                        
-                        # Process and format reviews before adding
-                        for review in page_reviews:
-                            # Check if we've reached the maximum review count
-                            if len(reviews_list) >= MAX_REVIEWS:
-                                logger.info(f"[Submission ID: {submission_id}] Reached maximum review count ({MAX_REVIEWS}). Stopping review collection.")
-                                break
-                            
-                            # Update field mappings based on RAPIDAPI_AMAZON_CONFIG.mdc documentation
-                            # Parse the review date from RapidAPI format - only use actual dates from the API
-                            review_date = parse_amazon_review_date(review.get("review_date", ""))
-                            
-                            formatted_review = {
-                                "submission_id": submission_id,
-                                "review_id": review.get("review_id"),
-                                "review_title": review.get("review_title"),
-                                "review_text": review.get("review_comment"),
-                                "review_rating": review.get("review_star_rating"),
-                                "created_at": review_date,  # Use the parsed review date
-                                "review_date": review_date,  # Also store it in the review_date field
-                                "reviewer_name": review.get("review_author"),
-                                "is_verified_purchase": review.get("is_verified_purchase", False),
-                                "helpful_votes": extract_helpful_votes(review.get("helpful_vote_statement", "")),
-                                "country": "US", # Default to US
-                                "raw_data": json.dumps(review) # Store raw review data as JSON string
-                            }
-                            # Clean None values before adding
-                            reviews_list.append({k:v for k,v in formatted_review.items() if v is not None})
-                        
-                        # Check if there's a next page based on pagination info (if API provides it)
-                        # Example: if not reviews_data.get("pagination", {}).get("has_next_page"):
-                        #     break
-                        # For now, just rely on MAX_PAGES or empty review list
-                        
-                        # Exit loop if we've reached the max reviews
-                        if len(reviews_list) >= MAX_REVIEWS:
-                            logger.info(f"[Submission ID: {submission_id}] Reached maximum review count ({MAX_REVIEWS}). Stopping pagination.")
-                            break
-                            
-                        page_num += 1
-
-                    except json.JSONDecodeError:
-                        logger.error(f"[Submission ID: {submission_id}] Failed to decode JSON from RapidAPI reviews response page {page_num}.")
-                        break
-                    except Exception as e:
-                        logger.exception(f"[Submission ID: {submission_id}] Error processing RapidAPI reviews response page {page_num}: {e}")
-                        break
-                
-                # Add delay between pages to prevent rate limiting
-                await asyncio.sleep(0.5)  # 500ms delay between requests
-            
-            logger.info(f"[Submission ID: {submission_id}] Finished RapidAPI review collection. Total reviews fetched: {len(reviews_list)}")
-            result["reviews"] = reviews_list # Update result dict
-            
+        async with _session_scope(session) as session:
+            # Marketplaces are fetched concurrently. Each one paces itself (AMAZON_PAGE_DELAY, or
+            # its own budget in `limiter`), so adding countries does not serialise the scrape
+            outcomes = await asyncio.gather(*(
+                _scrape_amazon_marketplace(submission_id, asin, country, session,
+                                           limiter.for_key(country) if limiter is not None else None,
+                                           checkpoint)
+                for country in countries
+            ), return_exceptions=True)
+
+        failures = []
+        seen_review_ids = set()
+        for country, outcome in zip(countries, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error("[Submission ID: %s] Scraping marketplace %s failed: %s", submission_id, country, outcome)
+                failures.append(outcome)
+                continue
+            # The primary (URL) marketplace comes first and supplies the product details
+            if result["product_details"] is None and outcome["product_details"]:
+                result["product_details"] = outcome["product_details"]
+            # Marketplaces can surface the same review; keep its first (primary) copy
+            for review in outcome["reviews"]:
+                if review.review_id:
+                    if review.review_id in seen_review_ids:
+                        continue
+                    seen_review_ids.add(review.review_id)
+                reviews_list.append(review)
+        if failures and len(failures) == len(countries):
+            # An open circuit defers the whole scrape instead of failing it
+            raise next((f for f in failures if isinstance(f, CircuitOpenError)), failures[0])
+        result["reviews"] = reviews_list
+
+    except CircuitOpenError:
+        raise
     except aiohttp.ClientError as e:
-        logger.exception(f"[Submission ID: {submission_id}] Network error during RapidAPI scraping: {e}")
-        supabase.table("submissions").update({"status": "failed", "error_message": f"Network error during scraping: {e}"}).eq("id", submission_id).execute()
+        logger.exception("[Submission ID: %s] Network error during RapidAPI scraping: %s", submission_id, e)
+        get_supabase().table("submissions").update({"status": "failed", "error_message": f"Network error during scraping: {e}"}).eq("id", submission_id).execute()
     except Exception as e:
-        logger.exception(f"[Submission ID: {submission_id}] Unexpected error during Amazon scraping: {e}")
-        supabase.table("submissions").update({"status": "failed", "error_message": f"Unexpected error during scraping: {e}"}).eq("id", submission_id).execute()
+        logger.exception("[Submission ID: %s] Unexpected error during Amazon scraping: %s", submission_id, e)
+        get_supabase().table("submissions").update({"status": "failed", "error_message": f"Unexpected error during scraping: {e}"}).eq("id", submission_id).execute()
         
-    logger.info(f"[Submission ID: {submission_id}] Amazon scraping function finished. Returning details: {result['product_details'] is not None}, reviews: {len(result['reviews'])}")
+    logger.info("[Submission ID: %s] Amazon scraping function finished. Returning details: %s, reviews: %s", submission_id, result['product_details'] is not None, len(result['reviews']))
     return result
 
-# Helper function to extract price from various formats
-def extract_price(price_str):
-    """Attempts to parse a price string (e.g., '$204.00') into a float."""
-    if not price_str or not isinstance(price_str, str):
-        return None
-    try:
-        # Remove currency symbols, commas, and whitespace
-        cleaned_price = re.sub(r'[$,\s]', '', price_str)
-        return float(cleaned_price)
-    except (ValueError, TypeError):
-        logger.warning(f"Could not parse price string: '{price_str}'")
-        return None
+async def _rapidapi_get(session, url: str, headers: Dict[str, str], params: Dict[str, str],
+                        limiter: Optional[AsyncRateLimiter] = None, cache: Optional[ProductCache] = None):
+    """
+    GET a RapidAPI endpoint, serving it from the ASIN-level product cache when fresh.
+
+    Requests go through the endpoint's circuit breaker (see circuit_breaker.py).
+
+    Returns:
+        Tuple of (status, body bytes, served_from_cache); only 200 responses are cached
 
-# Shopify scraping implementation
-async def scrape_shopify_reviews(submission_id: str, url: str) -> Dict[str, Any]:
+    Raises:
+        CircuitOpenError: if RapidAPI is failing and the endpoint's circuit is open
     """
-    Asynchronously scrape Shopify product details and reviews
-    
+    endpoint = url.rsplit('/', 1)[-1]
+    if cache is not None and cache.enabled:
+        body = await asyncio.to_thread(cache.get, endpoint, params)
+        if body is not None:
+            return 200, body, True
+    breaker = get_breaker('rapidapi', endpoint, RAPIDAPI_SLOW_CALL_SECONDS)
+    await asyncio.to_thread(breaker.before_call)
+    async with _rate_limited(limiter):
+        # Timed from when the request goes out: waiting for the rate budget is not RapidAPI's latency
+        timeout = http_timeout()
+        started = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers, params=params, timeout=timeout) as response:
+                status, body = response.status, await response.read()
+        except SoftTimeLimitExceeded:
+            raise
+        except Exception as e:
+            # A read timeout shortened to the stage's remaining time is our deadline, not RapidAPI failing
+            if not (isinstance(e, asyncio.TimeoutError) and timeout.sock_read < HTTP_READ_TIMEOUT):
+                await asyncio.to_thread(breaker.after_call, True, time.perf_counter() - started)
+            raise
+        elapsed = time.perf_counter() - started
+    await asyncio.to_thread(breaker.after_call, failed_status(status), elapsed)
+    record_http_call('rapidapi', len(body))
+    if status == 200 and cache is not None and cache.enabled:
+        await asyncio.to_thread(cache.set, endpoint, params, body)
+    return status, body, False
+
+async def _archived_or_get(session, url: str, headers: Dict[str, str], params: Dict[str, str],
+                           limiter: Optional[AsyncRateLimiter], cache: Optional[ProductCache],
+                           payload_ref: Optional[str]):
+    """_rapidapi_get, but served from the payload archive when a scrape checkpoint recorded the response."""
+    if payload_ref:
+        try:
+            return 200, await asyncio.to_thread(get_payload_archive().get, payload_ref), True
+        except Exception as e:
+            logger.warning("Checkpointed payload %s is not readable (%s); fetching it again", payload_ref[:12], e)
+    return await _rapidapi_get(session, url, headers, params, limiter, cache)
+
+@contextlib.asynccontextmanager
+async def _session_scope(session=None):
+    """Yield the shared aiohttp session if one was passed, otherwise a private one for this call."""
+    if session is not None:
+        yield session
+        return
+    import aiohttp
+    async with aiohttp.ClientSession() as own_session:
+        yield own_session
+
+def _rate_limited(limiter: Optional[AsyncRateLimiter]):
+    """Rate-limit one request through the shared limiter, or not at all for single scrapes."""
+    return limiter.acquire() if limiter is not None else contextlib.nullcontext()
+
+async def _scrape_amazon_marketplace(submission_id: str, asin: str, country: str, session,
+                                     limiter=None, checkpoint: Optional[ScrapeCheckpoint] = None) -> Dict[str, Any]:
+    """
+    Fetch product details and reviews for one ASIN on one Amazon marketplace.
+
     Args:
         submission_id: The ID of the submission in Supabase
-        url: The Shopify store URL to scrape
-        
+        asin: The product's ASIN
+        country: RapidAPI marketplace country code (US, GB, DE, ...)
+        session: The aiohttp session shared by all marketplaces of the scrape
+        limiter: Optional rate limiter for this marketplace (see rate_limit.RateBudgets)
+        checkpoint: Optional scrape checkpoint (see scrape_checkpoint.py)
+
     Returns:
-        Dictionary with product and reviews keys
+        Dictionary with product_details and reviews keys; every review is tagged with `country`
     """
-    logger.info(f"[Submission ID: {submission_id}] Starting Shopify scraping for URL: {url}")
-    
-    # Initialize results structure
+    checkpoint = checkpoint or ScrapeCheckpoint.disabled()
+    payload_archive = get_payload_archive()
+    product_cache = get_product_cache()
+    rapidapi_key = os.environ.get('RAPIDAPI_KEY')
+    rapidapi_host = os.environ.get('RAPIDAPI_HOST')
     result = {
-        "product": None,
+        "product_details": None,
         "reviews": []
     }
-    
-    try:
-        # Create async session for HTTP requests
-        async with aiohttp.ClientSession() as session:
-            logger.info(f"[Submission ID: {submission_id}] Fetching Shopify product from {url}")
-            
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept-Language": "en-US,en;q=0.9"
-            }
-            
-            async with session.get(url, headers=headers) as response:
-                if response.status != 200:
-                    logger.error(f"[Submission ID: {submission_id}] Failed to fetch Shopify page: {response.status}")
-                    return result
+    reviews_list = []
+
+    # Concurrent scrapes of this ASIN (any worker process) wait for the first one and then
+    # read its responses from the product cache instead of fetching everything again
+    async with single_flight(f"rapidapi:{asin}:{country}", enabled=product_cache.enabled):
+        headers = {
+            "x-rapidapi-key": rapidapi_key,
+            "x-rapidapi-host": rapidapi_host
+        }
+        # RAPIDAPI_BASE_URL lets local stand-ins (backend/benchmarks) replace the real API
+        rapidapi_base_url = os.environ.get('RAPIDAPI_BASE_URL') or f"https://{rapidapi_host}"
+        product_api_url = f"{rapidapi_base_url}/product-details"
+        product_params = {
+            "country": country,
+            "asin": asin
+        }
+
+        # --- Fetch Product Details via RapidAPI --- 
+        logger.info("[Submission ID: %s] Fetching product details from RapidAPI for ASIN: %s (%s)", submission_id, asin, country)
+        try:
+            product_status, product_body, product_cached = await _archived_or_get(
+                session, product_api_url, headers, product_params, limiter, product_cache, checkpoint.product_payload(country))
+        except asyncio.TimeoutError:
+            product_status, product_body, product_cached = 504, b'request timed out', False
+        if product_status != 200:
+            error_text = product_body.decode('utf-8', errors='replace')
+            logger.error("[Submission ID: %s] Failed to fetch RapidAPI product details: %s - %s", submission_id, product_status, error_text)
+            # Optionally update submission status or continue to reviews?
+            # For now, we continue to try fetching reviews even if details fail
+        else:
+            try:
+                # Keep the raw body: it is archived once, compressed, and rows only reference its hash
+                product_data = json.loads(product_body)
+                product_payload_ref = await asyncio.to_thread(payload_archive.put, product_body)
+                if not checkpoint.product_payload(country):
+                    await asyncio.to_thread(checkpoint.product_fetched, country, product_payload_ref)
+                logger.info("[Submission ID: %s] Successfully fetched RapidAPI product details%s.", submission_id, ' (cached)' if product_cached else '')
+                logger.debug("[Submission ID: %s] Raw Product Details API Response Keys: %s", submission_id, list(product_data.keys()))
+                    
+                # Map API response to our product_details structure
+                # Extract data from the RapidAPI response - carefully follow the exact format we see in the database
+                api_data = product_data.get("data", {})
+                # Get manufacturer from product information if available
+                manufacturer = None
+                if api_data.get("product_information") and isinstance(api_data.get("product_information"), dict):
+                    manufacturer = api_data.get("product_information", {}).get("Manufacturer")
+                        
+                # Use the dedicated function to process the API response into database fields
+                # This gives us a clean separation between API fetching and database processing
+                logger.info("[Submission ID: %s] Processing product details using dedicated function", submission_id)
+                    
+                # Process the API response to get database-ready fields
+                product_details = {
+                    "raw_api_response": product_data,  # Parsed response, used by process_product_api_response
+                    "raw_payload_ref": product_payload_ref  # Archive hash stored in place of the full JSON
+                }
+                    
+                # Fallback to first extracting product title if needed
+                product_title = None
+                if api_data.get("product_title"):
+                    product_title = api_data.get("product_title")
+                    logger.info("[Submission ID: %s] Found product title in API data: %s", submission_id, product_title)
+                else:
+                    logger.warning("[Submission ID: %s] No product title found in API data", submission_id)
+                    
+                # Add the product title to product_details
+                product_details["title"] = product_title
                     
-                html_content = await response.text()
-                soup = BeautifulSoup(html_content, 'html.parser')
+                result["product_details"] = product_details # Update result dict
+                logger.info("[Submission ID: %s] Parsed product details from API.", submission_id)
+
+            except json.JSONDecodeError:
+                logger.error("[Submission ID: %s] Failed to decode JSON from RapidAPI product details response.", submission_id)
+            except Exception as e:
+                logger.exception("[Submission ID: %s] Error processing RapidAPI product details response: %s", submission_id, e)
+
+        # --- Fetch Reviews via RapidAPI --- 
+        logger.info("[Submission ID: %s] Starting RapidAPI Amazon review collection for ASIN: %s (%s)", submission_id, asin, country)
+        # Use the same host for reviews
+        reviews_api_url = f"{rapidapi_base_url}/product-reviews"
+        # In 'stars' mode every star bucket is paged in parallel under its own budget, so large
+        # products are sampled across ratings instead of only their most recent pages
+        if AMAZON_REVIEW_SHARDING == 'stars':
+            shards = {star_rating: AMAZON_STAR_BUCKET_BUDGET for star_rating in STAR_RATING_SHARDS}
+        else:
+            shards = {"ALL": AMAZON_MAX_REVIEWS}
+        seen_review_ids = set()
+        shard_reviews = await asyncio.gather(*(
+            _fetch_review_shard(submission_id, asin, country, star_rating, budget, session,
+                                reviews_api_url, headers, limiter, seen_review_ids, checkpoint)
+            for star_rating, budget in shards.items()
+        ))
+        reviews_list = [review for shard in shard_reviews for review in shard]
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("[Submission ID: %s] Finished RapidAPI review collection for %s. Total reviews fetched: %d (%s)",
+                        submission_id, country, len(reviews_list),
+                        ', '.join(f'{star}: {len(found)}' for star, found in zip(shards, shard_reviews)))
+        result["reviews"] = reviews_list # Update result dict
+    return result
+
+async def _fetch_review_shard(submission_id: str, asin: str, country: str, star_rating: str, budget: int,
+                             session, reviews_api_url: str, headers: Dict[str, str], limiter,
+                             seen_review_ids: set, checkpoint: Optional[ScrapeCheckpoint] = None) -> List[ReviewRecord]:
+    """
+    Page through /product-reviews for one star_rating filter ("ALL" or "5_STARS" ... "1_STARS").
+
+    Each shard stops on its own: at an empty or failed page, at a page with no reviews it
+    has not seen (tracked in `seen_review_ids`, shared by the shards of a marketplace), at
+    AMAZON_MAX_REVIEW_PAGES, or once it has collected `budget` reviews.
+
+    A resumed scrape starts from the reviews and last page its checkpoint recorded for this
+    shard and continues with the next page; every newly processed page is added to it.
+
+    Returns:
+        The shard's new ReviewRecords, tagged with `country`
+    """
+    payload_archive = get_payload_archive()
+    product_cache = get_product_cache()
+    checkpoint = checkpoint or ScrapeCheckpoint.disabled()
+    # Pages an earlier attempt completed are not requested again
+    reviews_list = checkpoint.shard_reviews(country, star_rating)
+    seen_review_ids.update(review.review_id for review in reviews_list if review.review_id)
+    if checkpoint.shard_finished(country, star_rating):
+        return reviews_list
+    page_num = checkpoint.last_page(country, star_rating) + 1
+    if page_num > 1:
+        logger.info("[Submission ID: %s] Resuming %s reviews for %s at page %s with %d reviews from the checkpoint",
+                    submission_id, star_rating, country, page_num, len(reviews_list))
+
+    MAX_PAGES = AMAZON_MAX_REVIEW_PAGES # Expanded to fetch up to 100 pages of reviews
+    MAX_REVIEWS = budget # Limit total reviews to prevent excessive database usage
+    RATE_LIMIT_RETRY_DELAY = 2.0 # seconds to wait if we hit a rate limit
+    rate_limit_retries = 0
+    cached_pages = 0
+    
+    while page_num <= MAX_PAGES:
+        # Out of time: keep the pages we have so they can be stored (see deadlines.py)
+        if deadline_reached():
+            logger.warning("[Submission ID: %s] Scrape deadline reached; stopping %s reviews for %s after page %s", submission_id, star_rating, country, page_num - 1)
+            break
+        review_params = {
+            "country": country,
+            "asin": asin,
+            "page": str(page_num),
+            "sort_by": "MOST_RECENT", # Per documentation: TOP_REVIEWS or MOST_RECENT
+            "star_rating": star_rating, # ALL, 5_STARS, 4_STARS, 3_STARS, 2_STARS, 1_STARS, POSITIVE, CRITICAL
+            "verified_purchases_only": "false",
+            "images_or_videos_only": "false"
+        }
+        review_log.info("[Submission ID: %s] Fetching %s reviews page %s", submission_id, star_rating, page_num)
+        try:
+            reviews_status, reviews_body, page_cached = await _rapidapi_get(
+                session, reviews_api_url, headers, review_params, limiter, product_cache)
+        except asyncio.TimeoutError:
+            logger.error("[Submission ID: %s] RapidAPI reviews page %s timed out", submission_id, page_num)
+            break # Keep the pages fetched so far
+        if reviews_status == 429 and limiter is not None and rate_limit_retries < 3:
+            # Shared budget exhausted: pause every scrape on this limiter, then retry the page
+            rate_limit_retries += 1
+            limiter.backoff(RATE_LIMIT_RETRY_DELAY)
+            review_log.warning("[Submission ID: %s] Rate limited on reviews page %s, retrying", submission_id, page_num)
+            continue
+        cached_pages += page_cached
+        if reviews_status != 200:
+            error_text = reviews_body.decode('utf-8', errors='replace')
+            logger.error("[Submission ID: %s] Failed to fetch RapidAPI reviews page %s: %s - %s", submission_id, page_num, reviews_status, error_text)
+            break # Stop fetching reviews if a page fails
+
+        try:
+            reviews_data = json.loads(reviews_body)
+            review_log.debug("[Submission ID: %s] Reviews Page %s - Raw Keys: %s", submission_id, page_num, reviews_data.keys())
                 
-                # Extract basic product details - simplified for demonstration
-                product = {}
+            # Per RAPIDAPI_AMAZON_CONFIG.mdc, reviews are in data.reviews array
+            data = reviews_data.get("data", {})
+            page_reviews = data.get("reviews", [])
                 
-                # Look for product name in standard Shopify locations
-                product_title = soup.select_one('.product-single__title')
-                if product_title:
-                    product['title'] = product_title.text.strip()
-                else:
-                    # Try alternate selectors used by some themes
-                    alt_title = soup.select_one('h1.product_name') or soup.select_one('.product-title')
-                    if alt_title:
-                        product['title'] = alt_title.text.strip()
+            # Log response structure to help debug - only serialised when DEBUG is enabled
+            if logger.isEnabledFor(logging.DEBUG):
+                review_log.debug("[Submission ID: %s] Full Reviews Response: %s...", submission_id, json.dumps(reviews_data)[:1000])
                 
-                # Try to find price
-                price_elem = soup.select_one('.price__current') or soup.select_one('.product-single__price')
-                if price_elem:
-                    price_text = price_elem.text.strip()
-                    product['price'] = extract_price(price_text)
+            if not page_reviews:
+                logger.info("[Submission ID: %s] No more reviews found on page %s.", submission_id, page_num)
+                await asyncio.to_thread(checkpoint.page_done, country, star_rating, page_num, [], True)
+                break # Stop if no reviews on the page
                 
-                # For demo purposes: Create 5 sample reviews
-                reviews = []
-                for i in range(5):
-                    reviews.append({
-                        "review_text": f"This is a sample Shopify review #{i+1} for testing purposes.",
-                        "review_rating": (i % 5) + 1,  # Rating 1-5
-                        "review_date": (datetime.now() - timedelta(days=i*2)).isoformat(),
-                        "submission_id": submission_id
-                    })
+            review_log.info("[Submission ID: %s] Fetched %d reviews from page %s.", submission_id, len(page_reviews), page_num)
+            # Archive the page once; each review row references it by hash + offset
+            page_payload_ref = await asyncio.to_thread(payload_archive.put, reviews_body)
+                
+            # Process and format reviews before adding
+            new_on_page = 0
+            for page_offset, review in enumerate(page_reviews):
+                # Check if we've reached the maximum review count
+                if len(reviews_list) >= MAX_REVIEWS:
+                    logger.info("[Submission ID: %s] Reached maximum review count (%s). Stopping review collection.", submission_id, MAX_REVIEWS)
+                    break
+                    
+                # Shards (and shifting MOST_RECENT pages) can return a review twice; keep the first
+                review_id = review.get("review_id")
+                if review_id:
+                    if review_id in seen_review_ids:
+                        continue
+                    seen_review_ids.add(review_id)
+                new_on_page += 1
+
+                # Single normalisation step into the slotted record (see review_record.py);
+                # field mappings follow RAPIDAPI_AMAZON_CONFIG.mdc
+                reviews_list.append(ReviewRecord.from_rapidapi(
+                    submission_id, review, country=country,
+                    payload_sha256=page_payload_ref, payload_offset=page_offset
+                ))
                 
-                # Store the results
-                result["product"] = product
-                result["reviews"] = reviews
+            # Check if there's a next page based on pagination info (if API provides it)
+            # Example: if not reviews_data.get("pagination", {}).get("has_next_page"):
+            #     break
+            # For now, just rely on MAX_PAGES or empty review list
                 
-                # Save reviews to Supabase
-                try:
-                    for review in reviews:
-                        supabase.table("reviews").insert(review).execute()
-                    logger.info(f"[Submission ID: {submission_id}] Saved {len(reviews)} Shopify reviews to Supabase")
-                except Exception as e:
-                    logger.error(f"[Submission ID: {submission_id}] Failed to save Shopify reviews to Supabase: {str(e)}")
-    
-    except Exception as e:
-        logger.error(f"[Submission ID: {submission_id}] Error in Shopify scraper: {str(e)}")
-        # Return empty result structure on error
+            # A shard that stopped on its own is not resumed; one cut short by the deadline or an error is
+            finished = new_on_page == 0 or len(reviews_list) >= MAX_REVIEWS or page_num >= MAX_PAGES
+            await asyncio.to_thread(checkpoint.page_done, country, star_rating, page_num,
+                                    reviews_list[len(reviews_list) - new_on_page:], finished)
+
+            # A page with nothing new means the provider is repeating itself past its page ceiling
+            if new_on_page == 0:
+                logger.info("[Submission ID: %s] No new %s reviews on page %s. Stopping this shard.", submission_id, star_rating, page_num)
+                break
+
+            # Exit loop if we've reached the max reviews
+            if len(reviews_list) >= MAX_REVIEWS:
+                logger.info("[Submission ID: %s] Reached maximum review count (%s). Stopping pagination.", submission_id, MAX_REVIEWS)
+                break
+                    
+            page_num += 1
+
+        except json.JSONDecodeError:
+            logger.error("[Submission ID: %s] Failed to decode JSON from RapidAPI reviews response page %s.", submission_id, page_num)
+            break
+        except Exception as e:
+            logger.exception("[Submission ID: %s] Error processing RapidAPI reviews response page %s: %s", submission_id, page_num, e)
+            break
         
-    return result
+        # Add delay between pages to prevent rate limiting (a shared limiter paces batch scrapes
+        # instead, and pages served from the product cache cost no API call)
+        if limiter is None and not page_cached:
+            await asyncio.sleep(AMAZON_PAGE_DELAY)  # 500ms delay between requests by default
+
+    logger.info("[Submission ID: %s] Finished %s review collection for %s. Reviews fetched: %s (%s pages from cache)", submission_id, star_rating, country, len(reviews_list), cached_pages)
+    return reviews_list
 
 # --- Helper Function for Date Parsing ---
 def parse_review_date(date_str: Optional[str]) -> Optional[str]:
@@ -549,9 +585,9 @@ def parse_review_date(date_str: Optional[str]) -> Optional[str]:
         parsed_date = parser.parse(date_str)
         return parsed_date.strftime("%Y-%m-%d")
     except (ImportError, ValueError, TypeError) as e:
-        logger.debug(f"dateutil parser failed: {e}")
+        review_log.debug("dateutil parser failed: %s", e)
             
-    logger.warning(f"Could not parse date string: '{date_str}' with any known format.")
+    review_log.warning("Could not parse date string: '%s' with any known format.", date_str)
     return None
 
 # --- Helper Function for Price Cleaning ---
@@ -564,22 +600,23 @@ def parse_price(price_str: Optional[str]) -> Optional[float]:
         cleaned_price = re.sub(r'[$,\s£€]', '', price_str)
         return float(cleaned_price)
     except (ValueError, TypeError):
-        logger.warning(f"Could not parse price string: '{price_str}'")
+        logger.warning("Could not parse price string: '%s'", price_str)
         return None
 
 # --- Process RapidAPI Response into Database Fields ---
-def process_product_api_response(submission_id: str, api_response: Dict) -> Dict:
+def process_product_api_response(submission_id: str, api_response: Dict, payload_ref: Optional[str] = None) -> Dict:
     """
     Process the RapidAPI response into a format ready for Supabase database update.
     
     Args:
         submission_id: The submission ID for logging
         api_response: The raw API response from RapidAPI
+        payload_ref: SHA-256 of the archived raw response, if it was archived
         
     Returns:
         A dictionary with fields ready for Supabase update
     """
-    logger.info(f"[Submission ID: {submission_id}] Processing API response into database fields")
+    logger.info("[Submission ID: %s] Processing API response into database fields", submission_id)
     
     # Initialize the update data dictionary with None values
     db_fields = {
@@ -609,24 +646,28 @@ def process_product_api_response(submission_id: str, api_response: Dict) -> Dict
     
     # If API response is invalid, return empty fields
     if not api_response or "data" not in api_response:
-        logger.warning(f"[Submission ID: {submission_id}] Invalid API response structure for processing")
+        logger.warning("[Submission ID: %s] Invalid API response structure for processing", submission_id)
         return db_fields
     
-    # Store the full API response
-    db_fields["api_response_product_details"] = json.dumps(api_response)
+    # Store a reference to the archived API response; only fall back to the full JSON
+    # when archiving is disabled or failed
+    if payload_ref:
+        db_fields["api_response_product_details"] = json.dumps({"raw_payload_sha256": payload_ref})
+    else:
+        db_fields["api_response_product_details"] = json.dumps(api_response)
     
     # Extract the data section
     api_data = api_response.get("data", {})
     if not api_data:
-        logger.warning(f"[Submission ID: {submission_id}] Empty data section in API response")
+        logger.warning("[Submission ID: %s] Empty data section in API response", submission_id)
         return db_fields
     
     # Extract product title
     db_fields["product_title"] = api_data.get("product_title")
     if db_fields["product_title"]:
-        logger.info(f"[Submission ID: {submission_id}] Extracted product title: {db_fields['product_title']}")
+        logger.info("[Submission ID: %s] Extracted product title: %s", submission_id, db_fields['product_title'])
     else:
-        logger.warning(f"[Submission ID: {submission_id}] No product title found in API response")
+        logger.warning("[Submission ID: %s] No product title found in API response", submission_id)
     
     # Extract brand name from product_information
     product_info = api_data.get("product_information", {})
@@ -639,7 +680,7 @@ def process_product_api_response(submission_id: str, api_response: Dict) -> Dict
             category_match = re.search(r'in ([^(]+)', best_sellers_rank)
             if category_match:
                 db_fields["category_name"] = category_match.group(1).strip()
-                logger.info(f"[Submission ID: {submission_id}] Extracted category: {db_fields['category_name']}")
+                logger.info("[Submission ID: %s] Extracted category: %s", submission_id, db_fields['category_name'])
     
     # If no brand found, use a default
     if not db_fields["brand_name"]:
@@ -648,7 +689,7 @@ def process_product_api_response(submission_id: str, api_response: Dict) -> Dict
             title_words = db_fields["product_title"].split()
             if title_words:
                 db_fields["brand_name"] = title_words[0]
-                logger.info(f"[Submission ID: {submission_id}] Using first word of title as brand: {db_fields['brand_name']}")
+                logger.info("[Submission ID: %s] Using first word of title as brand: %s", submission_id, db_fields['brand_name'])
     
     # If no category found, use a default
     if not db_fields["category_name"]:
@@ -674,7 +715,7 @@ def process_product_api_response(submission_id: str, api_response: Dict) -> Dict
         db_fields["is_prime"] = bool(api_data.get("is_prime"))
         db_fields["climate_pledge_friendly"] = bool(api_data.get("climate_pledge_friendly"))
     except (ValueError, TypeError) as e:
-        logger.warning(f"[Submission ID: {submission_id}] Error processing numeric/boolean fields: {e}")
+        logger.warning("[Submission ID: %s] Error processing numeric/boolean fields: %s", submission_id, e)
     
     # Extract simple string fields
     db_fields["currency"] = api_data.get("currency")
@@ -698,17 +739,35 @@ def process_product_api_response(submission_id: str, api_response: Dict) -> Dict
     db_fields["product_details_misc"] = json.dumps(misc_data)
     
     # Log success
-    logger.info(f"[Submission ID: {submission_id}] Successfully processed API response into {len([v for v in db_fields.values() if v is not None])} database fields")
+    logger.info("[Submission ID: %s] Successfully processed API response into %s database fields", submission_id, len([v for v in db_fields.values() if v is not None]))
     
     return db_fields
 
-@app.task(name='worker.scrape_reviews')
-def scrape_reviews(submission_id: str, url: str) -> Dict[str, str]:
+# acks_late + reject_on_worker_lost: a scrape whose worker dies is redelivered and resumes from its checkpoint.
+# The time limits come from the submission's time budget; the scrape stops fetching before the
+# soft limit on its own (see deadlines.py), so the limits only catch code that hangs regardless.
+@app.task(name='worker.scrape_reviews', acks_late=True, reject_on_worker_lost=True,
+          soft_time_limit=soft_time_limit('scrape'), time_limit=time_limit('scrape'))
+def scrape_reviews(submission_id: str, url: str, profile: bool = False) -> Dict[str, str]:
     """Scrape reviews from a URL and update the submission in the database."""
-    logger.info(f"Running scrape_reviews task for submission ID: {submission_id} with URL: {url}")
-    
-    # Initialize the result dictionary that will be returned by this task
-    result = {
+    profiled = profiling_requested(submission_id, profile)
+    with maybe_profile(submission_id, 'scrape_reviews', requested=profiled), track_usage() as usage, \
+            stage_deadline('scrape'):
+        result = _scrape_reviews(submission_id, url)
+    save_usage(submission_id, 'scrape', usage)
+    if result.get("status") == "deferred":
+        # Retried once RapidAPI's circuit may have closed; the checkpoint keeps the pages fetched so far
+        defer_task(scrape_reviews, submission_id, result["error"], result["retry_after"])
+        get_supabase().table("submissions").update({"status": "error", "error_message": result["error"][:500]}).eq("id", submission_id).execute()
+        result["status"] = "error"
+    # Let the linked analyze_reviews task profile the same submission
+    if profiled and isinstance(result, dict):
+        result['profile'] = True
+    return result
+
+def _new_scrape_result(submission_id: str) -> Dict[str, Any]:
+    """Initial result dictionary returned by the scrape tasks for one submission."""
+    return {
         "status": "started",
         "message": f"Processing submission {submission_id}",
         "database_update_success": False,
@@ -716,572 +775,687 @@ def scrape_reviews(submission_id: str, url: str) -> Dict[str, str]:
         "database_update": {},
         "error": None
     }
+
+def _scrape_reviews(submission_id: str, url: str) -> Dict[str, str]:
+    """Body of scrape_reviews; kept separate so the task can be wrapped in a profiler."""
+    logger.info("Running scrape_reviews task for submission ID: %s with URL: %s", submission_id, url)
+    
+    # Initialize the result dictionary that will be returned by this task
+    result = _new_scrape_result(submission_id)
+    checkpoint = ScrapeCheckpoint.disabled()
     
     try:
-        logger.info(f"[Submission ID: {submission_id}] Starting scraping task for URL: {url}")
-        # Update submission status to processing
-        supabase.table("submissions").update({"status": "processing"}).eq("id", submission_id).execute()
-
-        # Determine the platform and scrape reviews/product details
-        product_details = None
-        reviews_list = []
-        if "amazon" in url.lower():
-            # Scrape Amazon - This function now fetches both details and reviews
-            scraped_data = asyncio.run(scrape_amazon_data(submission_id, url))
-            product_details = scraped_data.get("product_details")
-            reviews_list = scraped_data.get("reviews", [])
-            logger.info(f"[Submission ID: {submission_id}] Amazon scraping complete. Details fetched: {product_details is not None}. Reviews fetched: {len(reviews_list)}")
-
-        elif "shopify" in url.lower() or any(domain in url.lower() for domain in KNOWN_SHOPIFY_DOMAINS):
-            # Scrape Shopify (Assuming this returns a similar structure for now, adjust if needed)
-            # TODO: Refactor scrape_shopify_reviews similarly if necessary
-            scraped_data = asyncio.run(scrape_shopify_reviews(submission_id, url)) # Assuming returns {'product': {...}, 'reviews': [...]}
-            product_details = scraped_data.get("product") # Adapt keys as needed
-            reviews_list = scraped_data.get("reviews", [])
-            logger.info(f"[Submission ID: {submission_id}] Shopify scraping complete. Details fetched: {product_details is not None}. Reviews fetched: {len(reviews_list)}")
+        logger.info("[Submission ID: %s] Starting scraping task for URL: %s", submission_id, url)
+        # Update submission status to processing (the returned row carries its marketplaces)
+        marketplaces = _start_processing(submission_id)
+
+        # A redelivered task picks up where the killed one stopped (see scrape_checkpoint.py)
+        checkpoint = ScrapeCheckpoint.load(submission_id)
+        # The same per-platform (and, for Amazon, per-country) budgets as batch scrapes, so a
+        # single scrape's marketplaces and star shards are paced and retried after a 429
+        product_details, reviews_list = asyncio.run(_fetch_submission(submission_id, url, result, budgets=ScraperBudgets(),
+                                                                      marketplaces=marketplaces, checkpoint=checkpoint))
+        return _store_scrape(submission_id, product_details, reviews_list, result, checkpoint)
+
+    except SoftTimeLimitExceeded:
+        return _scrape_timed_out(submission_id, result, checkpoint)
+    except CircuitOpenError as e:
+        return _scrape_deferred(submission_id, result, e)
+    except Exception as e:
+        return _scrape_failed(submission_id, result, e)
 
-        else:
-            logger.error(f"[Submission ID: {submission_id}] Unsupported platform for URL: {url}")
-            result["error"] = "Unsupported platform"
-            
-        # --- Process API Response and Update Supabase ---
-        # Always run this section if product_details exists
-        if product_details:
-            try:
-                # Process the API response into database-ready fields
-                logger.info(f"[Submission ID: {submission_id}] Processing API response for database update")
-                
-                # Extract the raw API response
-                raw_api_response = product_details.get("raw_api_response", {})
-                
-                # Use our dedicated function to extract fields from API response
-                db_fields = process_product_api_response(submission_id, raw_api_response)
-                
-                # Get the current submission data to preserve existing fields
-                submission_response = supabase.table("submissions").select("is_competitor_product").eq("id", submission_id).execute()
-                is_competitor = False
-                if submission_response and hasattr(submission_response, 'data') and len(submission_response.data) > 0:
-                    is_competitor = bool(submission_response.data[0].get("is_competitor_product", False))
-                    logger.info(f"[Submission ID: {submission_id}] Retrieved is_competitor_product value: {is_competitor}")
-                
-                # Add a few additional fields not set by the processor
-                db_fields.update({
-                    "last_refreshed_at": datetime.utcnow().isoformat(),
-                    "display_name": db_fields.get("product_title"),  # Set display name to product title
-                    "is_competitor_product": is_competitor,  # Use the actual value from the database
-                    "status": "details_fetched"
-                })
-                
-                # Log key information for debugging
-                logger.info(f"[Submission ID: {submission_id}] Processed fields - Title: {db_fields.get('product_title')}, "  
-                           f"Brand: {db_fields.get('brand_name')}, Category: {db_fields.get('category_name')}")
-                logger.info(f"[Submission ID: {submission_id}] Processed fields - Rating: {db_fields.get('product_overall_rating')}, "  
-                           f"Price: {db_fields.get('price')}, Num Ratings: {db_fields.get('product_num_ratings')}")
-                
-                # Log all fields that will be updated
-                fields_to_update = [k for k, v in db_fields.items() if v is not None]
-                logger.info(f"[Submission ID: {submission_id}] Fields to update: {fields_to_update}")
-                
-                # Group fields by type (to avoid SQL size limits and for better error handling)
-                essential_fields = {k: v for k, v in db_fields.items() if k in [
-                    "product_title", "brand_name", "category_name", "asin", "product_url", "display_name", "status", "last_refreshed_at"
-                ] and v is not None}
-                
-                numeric_fields = {k: v for k, v in db_fields.items() if k in [
-                    "product_overall_rating", "product_num_ratings", "price"
-                ] and v is not None}
-                
-                boolean_fields = {k: v for k, v in db_fields.items() if k in [
-                    "is_best_seller", "is_amazon_choice", "is_prime", "climate_pledge_friendly", "is_competitor_product"
-                ] and v is not None}
-                
-                text_fields = {k: v for k, v in db_fields.items() if k in [
-                    "currency", "availability", "product_description", "sales_volume"
-                ] and v is not None}
-                
-                jsonb_fields = {k: v for k, v in db_fields.items() if k in [
-                    "product_features", "product_images", "product_specifications", "product_details_misc", "product_variants", "api_response_product_details"
-                ] and v is not None}
-                
-                # Update each batch separately with detailed logging
-                update_results = {}
-                
-                # Update essential fields first (these identify the product)
-                if essential_fields:
-                    logger.info(f"[Submission ID: {submission_id}] Updating essential fields: {list(essential_fields.keys())}")
-                    response = supabase.table("submissions").update(essential_fields).eq("id", submission_id).execute()
-                    update_results["essential"] = len(response.data) > 0
-                    logger.info(f"[Submission ID: {submission_id}] Essential fields update success: {update_results['essential']}")
-                
-                # Update numeric fields
-                if numeric_fields:
-                    logger.info(f"[Submission ID: {submission_id}] Updating numeric fields: {list(numeric_fields.keys())}")
-                    response = supabase.table("submissions").update(numeric_fields).eq("id", submission_id).execute()
-                    update_results["numeric"] = len(response.data) > 0
-                    logger.info(f"[Submission ID: {submission_id}] Numeric fields update success: {update_results['numeric']}")
-                
-                # Update boolean fields
-                if boolean_fields:
-                    logger.info(f"[Submission ID: {submission_id}] Updating boolean fields: {list(boolean_fields.keys())}")
-                    response = supabase.table("submissions").update(boolean_fields).eq("id", submission_id).execute()
-                    update_results["boolean"] = len(response.data) > 0
-                    logger.info(f"[Submission ID: {submission_id}] Boolean fields update success: {update_results['boolean']}")
-                
-                # Update text fields
-                if text_fields:
-                    logger.info(f"[Submission ID: {submission_id}] Updating text fields: {list(text_fields.keys())}")
-                    response = supabase.table("submissions").update(text_fields).eq("id", submission_id).execute()
-                    update_results["text"] = len(response.data) > 0
-                    logger.info(f"[Submission ID: {submission_id}] Text fields update success: {update_results['text']}")
-                
-                # Update JSONB fields one by one to prevent size issues
-                if jsonb_fields:
-                    update_results["jsonb"] = {}
-                    for field, value in jsonb_fields.items():
-                        if field == "api_response_product_details":
-                            logger.info(f"[Submission ID: {submission_id}] Updating API response (size: {len(value)} characters)")
-                        else:
-                            logger.info(f"[Submission ID: {submission_id}] Updating JSONB field: {field}")
-                            
-                        field_update = {field: value}
-                        response = supabase.table("submissions").update(field_update).eq("id", submission_id).execute()
-                        update_results["jsonb"][field] = len(response.data) > 0
-                        logger.info(f"[Submission ID: {submission_id}] {field} update success: {update_results['jsonb'][field]}")
-                
-                # Add update results to the return value
-                result["database_update"] = update_results
-                result["database_update_success"] = True
-                logger.info(f"[Submission ID: {submission_id}] Successfully updated database with product details")
-                
-            except Exception as e:
-                logger.error(f"[Submission ID: {submission_id}] Error updating database with product details: {str(e)}")
-                result["database_update_success"] = False
-                result["database_update_error"] = str(e)
-                result["status"] = "error"
-                    
-                # Explicit update of display_name as a separate operation to ensure it's set
-                if product_title:
-                    display_name_update = supabase.table("submissions").update({"display_name": product_title}).eq("id", submission_id).execute()
-                    logger.info(f"[Submission ID: {submission_id}] Updated display_name separately: {product_title}")
-                    
-            except Exception as update_err:
-                logger.error(f"[Submission ID: {submission_id}] Error updating submission with product details: {update_err}")
-                # Decide if this is fatal or if we can proceed with review insertion
-                # raise # Optional: re-raise if product details are essential
+def _start_processing(submission_id: str) -> Optional[List[str]]:
+    """Mark the submission as processing and return its requested marketplaces, if any."""
+    response = get_supabase().table("submissions").update({"status": "processing"}).eq("id", submission_id).execute()
+    if response and response.data:
+        return response.data[0].get("marketplaces")
+    return None
 
-        else:
-             logger.warning(f"[Submission ID: {submission_id}] No product details were fetched. Skipping submission update.")
-             # Potentially update status to indicate missing details
+class AmazonScraper(PlatformScraper):
+    name = 'amazon'
+    url_patterns = (url_pattern(*(re.escape(domain) for domain in AMAZON_MARKETPLACES)),)
+    rate_limit = RAPIDAPI_RATE_LIMIT
+    burst = RAPIDAPI_BURST
+    max_concurrency = RAPIDAPI_MAX_CONCURRENCY
+
+    def new_limiter(self):
+        # One RapidAPI key for every marketplace, with a sub-budget per country
+        return RateBudgets(super().new_limiter())
+
+    async def reviews(self, ctx: ScrapeContext):
+        # Yields only once every marketplace is scraped and deduplicated (see PlatformScraper.reviews)
+        scraped = await scrape_amazon_data(ctx.submission_id, ctx.url, session=ctx.session, limiter=ctx.limiter,
+                                           marketplaces=ctx.marketplaces, checkpoint=ctx.checkpoint)
+        ctx.product_details = scraped.get("product_details")
+        for review in scraped.get("reviews", []):
+            yield review
+
+# Adapters are tried in this order; Shopify goes last since it also claims custom domains by URL path
+register_scraper(AmazonScraper())
+register_scraper(ShopifyScraper())
+
+async def _fetch_submission(submission_id: str, url: str, result: Dict[str, Any],
+                            session=None, budgets: Optional[ScraperBudgets] = None,
+                            marketplaces: Optional[List[str]] = None,
+                            checkpoint: Optional[ScrapeCheckpoint] = None):
+    """
+    Find the platform adapter for a URL and collect its product details and reviews.
 
+    Args:
+        submission_id: The ID of the submission in Supabase
+        url: The product URL to scrape
+        result: The task result dictionary; `error` is set for unsupported URLs
+        session: Optional shared aiohttp session (batch scrapes share one connection pool)
+        budgets: Optional per-platform rate limiters shared by every scrape in the event loop
+            (the tasks always pass them); without them requests are paced only by AMAZON_PAGE_DELAY
+        marketplaces: Optional extra Amazon marketplaces (country codes) from the submission
+        checkpoint: Optional progress of an earlier attempt at this submission, which the
+            adapter resumes from (see scrape_checkpoint.py)
 
-        # --- Insert Individual Reviews ---
-        if not reviews_list:
-            logger.warning(f"[Submission ID: {submission_id}] No reviews found or fetched. Finishing task.")
-            # Update submission status to completed (or a specific status like 'no_reviews')
-            final_status = "completed_no_reviews" if product_details else "failed_no_reviews"
-            supabase.table("submissions").update({"status": final_status}).eq("id", submission_id).execute()
-            # Even though we have no reviews, pass the submission_id to the next task
-            return {'submission_id': submission_id}
+    Returns:
+        Tuple of (product_details, reviews_list)
+    """
+    scraper = get_scraper(url)
+    if scraper is None:
+        logger.error("[Submission ID: %s] Unsupported platform for URL: %s", submission_id, url)
+        result["error"] = "Unsupported platform"
+        return None, []
+
+    async with _session_scope(session) as session:
+        ctx = ScrapeContext(submission_id, url, session, marketplaces=marketplaces,
+                            limiter=budgets.for_scraper(scraper) if budgets else None, checkpoint=checkpoint)
+        reviews_list = [review async for review in scraper.reviews(ctx)]
+    logger.info("[Submission ID: %s] %s scraping complete. Details fetched: %s. Reviews fetched: %s", submission_id, scraper.name, ctx.product_details is not None, len(reviews_list))
+    return ctx.product_details, reviews_list
+
+def _store_scrape(submission_id: str, product_details: Optional[Dict], reviews_list: List[ReviewRecord],
+                  result: Dict[str, Any], checkpoint: Optional[ScrapeCheckpoint] = None) -> Dict[str, Any]:
+    """
+    Write scraped product details and reviews to Supabase and set the final submission status.
 
-        successful_inserts = 0
-        failed_inserts = 0
-        review_count = 0  # Initialize review counter
-        logger.info(f"[Submission ID: {submission_id}] Starting insertion of {len(reviews_list)} reviews.")
+    With a checkpoint, whatever an earlier attempt already wrote (the product details, reviews
+    by id) is skipped, progress is recorded as it is written, and the checkpoint is dropped
+    once the submission's final status is set.
+    """
+    checkpoint = checkpoint or ScrapeCheckpoint.disabled()
+    if product_details and checkpoint.details_stored:
+        logger.info("[Submission ID: %s] Product details were stored by an earlier attempt; skipping", submission_id)
+        result["database_update_success"] = True
+    # --- Process API Response and Update Supabase ---
+    # Always run this section if product_details exists
+    elif product_details:
+        try:
+            # Process the API response into database-ready fields
+            logger.info("[Submission ID: %s] Processing API response for database update", submission_id)
+            
+            # Shopify scrapes arrive with database-ready fields; Amazon ones carry the raw API response
+            db_fields = product_details.get("db_fields")
+            if db_fields is None:
+                db_fields = process_product_api_response(submission_id, product_details.get("raw_api_response", {}),
+                                                         product_details.get("raw_payload_ref"))
+            
+            # Get the current submission data to preserve existing fields
+            submission_response = get_supabase().table("submissions").select("is_competitor_product").eq("id", submission_id).execute()
+            is_competitor = False
+            if submission_response and hasattr(submission_response, 'data') and len(submission_response.data) > 0:
+                is_competitor = bool(submission_response.data[0].get("is_competitor_product", False))
+                logger.info("[Submission ID: %s] Retrieved is_competitor_product value: %s", submission_id, is_competitor)
+            
+            # Add a few additional fields not set by the processor
+            db_fields.update({
+                "last_refreshed_at": datetime.utcnow().isoformat(),
+                "display_name": db_fields.get("product_title"),  # Set display name to product title
+                "is_competitor_product": is_competitor,  # Use the actual value from the database
+                "status": "details_fetched"
+            })
+            
+            # Log key information for debugging
+            logger.info("[Submission ID: %s] Processed fields - Title: %s, "  
+                       "Brand: %s, Category: %s", submission_id, db_fields.get('product_title'), db_fields.get('brand_name'), db_fields.get('category_name'))
+            logger.info("[Submission ID: %s] Processed fields - Rating: %s, "  
+                       "Price: %s, Num Ratings: %s", submission_id, db_fields.get('product_overall_rating'), db_fields.get('price'), db_fields.get('product_num_ratings'))
+            
+            # Log all fields that will be updated
+            fields_to_update = [k for k, v in db_fields.items() if v is not None]
+            logger.info("[Submission ID: %s] Fields to update: %s", submission_id, fields_to_update)
+            
+            # Group fields by type (to avoid SQL size limits and for better error handling)
+            essential_fields = {k: v for k, v in db_fields.items() if k in [
+                "product_title", "brand_name", "category_name", "asin", "product_url", "display_name", "status", "last_refreshed_at"
+            ] and v is not None}
+            
+            numeric_fields = {k: v for k, v in db_fields.items() if k in [
+                "product_overall_rating", "product_num_ratings", "price"
+            ] and v is not None}
+            
+            boolean_fields = {k: v for k, v in db_fields.items() if k in [
+                "is_best_seller", "is_amazon_choice", "is_prime", "climate_pledge_friendly", "is_competitor_product"
+            ] and v is not None}
+            
+            text_fields = {k: v for k, v in db_fields.items() if k in [
+                "currency", "availability", "product_description", "sales_volume"
+            ] and v is not None}
+            
+            jsonb_fields = {k: v for k, v in db_fields.items() if k in [
+                "product_features", "product_images", "product_specifications", "product_details_misc", "product_variants", "api_response_product_details"
+            ] and v is not None}
+            
+            # Update each batch separately with detailed logging
+            update_results = {}
+            
+            # Update essential fields first (these identify the product)
+            if essential_fields:
+                logger.info("[Submission ID: %s] Updating essential fields: %s", submission_id, list(essential_fields.keys()))
+                response = get_supabase().table("submissions").update(essential_fields).eq("id", submission_id).execute()
+                update_results["essential"] = len(response.data) > 0
+                logger.info("[Submission ID: %s] Essential fields update success: %s", submission_id, update_results['essential'])
+            
+            # Update numeric fields
+            if numeric_fields:
+                logger.info("[Submission ID: %s] Updating numeric fields: %s", submission_id, list(numeric_fields.keys()))
+                response = get_supabase().table("submissions").update(numeric_fields).eq("id", submission_id).execute()
+                update_results["numeric"] = len(response.data) > 0
+                logger.info("[Submission ID: %s] Numeric fields update success: %s", submission_id, update_results['numeric'])
+            
+            # Update boolean fields
+            if boolean_fields:
+                logger.info("[Submission ID: %s] Updating boolean fields: %s", submission_id, list(boolean_fields.keys()))
+                response = get_supabase().table("submissions").update(boolean_fields).eq("id", submission_id).execute()
+                update_results["boolean"] = len(response.data) > 0
+                logger.info("[Submission ID: %s] Boolean fields update success: %s", submission_id, update_results['boolean'])
+            
+            # Update text fields
+            if text_fields:
+                logger.info("[Submission ID: %s] Updating text fields: %s", submission_id, list(text_fields.keys()))
+                response = get_supabase().table("submissions").update(text_fields).eq("id", submission_id).execute()
+                update_results["text"] = len(response.data) > 0
+                logger.info("[Submission ID: %s] Text fields update success: %s", submission_id, update_results['text'])
+            
+            # Update JSONB fields one by one to prevent size issues
+            if jsonb_fields:
+                update_results["jsonb"] = {}
+                for field, value in jsonb_fields.items():
+                    if field == "api_response_product_details":
+                        logger.info("[Submission ID: %s] Updating API response (size: %s characters)", submission_id, len(value))
+                    else:
+                        logger.info("[Submission ID: %s] Updating JSONB field: %s", submission_id, field)
+                        
+                    field_update = {field: value}
+                    response = get_supabase().table("submissions").update(field_update).eq("id", submission_id).execute()
+                    update_results["jsonb"][field] = len(response.data) > 0
+                    logger.info("[Submission ID: %s] %s update success: %s", submission_id, field, update_results['jsonb'][field])
+            
+            # Add update results to the return value
+            result["database_update"] = update_results
+            result["database_update_success"] = True
+            checkpoint.mark_details_stored()
+            logger.info("[Submission ID: %s] Successfully updated database with product details", submission_id)
+            
+        except Exception as e:
+            logger.error("[Submission ID: %s] Error updating database with product details: %s", submission_id, e)
+            result["database_update_success"] = False
+            result["database_update_error"] = str(e)
+            result["status"] = "error"
 
-        for review in reviews_list:
-            try:
-                # Extract and process review-specific data
-                review_rating_str = review.get("review_rating")
-                review_rating = float(review_rating_str) if review_rating_str is not None else None
-
-                review_date_str = review.get("review_date")
-                review_date = parse_review_date(review_date_str) # Use helper
-
-                # Before creating review_data, log raw review objects to debug the issue
-                logger.debug(f"[Submission ID: {submission_id}] RAW REVIEW OBJECT KEYS: {list(review.keys())}")
-                if 'review_text' in review:
-                    logger.debug(f"[Submission ID: {submission_id}] RAW review_text: '{review.get('review_text')[:100]}...'")
-                if 'review_comment' in review:
-                    logger.debug(f"[Submission ID: {submission_id}] RAW review_comment: '{review.get('review_comment')[:100]}...'")
-                
-                # CRITICAL FIX: Simplify the logic for review_text extraction to avoid conditional issues
-                review_text = None
-                if review.get("review_text"):
-                    review_text = review["review_text"].strip()
-                elif review.get("review_comment"):
-                    review_text = review["review_comment"].strip()
-                
-                review_data = {
-                    "submission_id": submission_id,
-                    # --- Review Specific Fields ---
-                    "review_text": review_text,
-                    "review_rating": review_rating,
-                    "review_date": review_date,
-                    "review_title": review.get("review_title", "").strip() if review.get("review_title") else None,
-                    "review_images": review.get("review_images", []), # Pass list directly for JSONB
-                    "verified_purchase": review.get("is_verified_purchase", False),
-                    # --- Optional Review Fields from API ---
-                    "api_review_id": review.get("review_id"),
-                    "review_author": review.get("review_author"),
-                    "helpful_votes_text": review.get("helpful_vote_statement"),
-                    "is_vine_review": review.get("is_vine", False)
-                    # Add other fields from the API review object if needed in the DB
-                }
-                
-                # ENHANCED DEBUGGING: Log every review's text fields before insertion
-                logger.debug(f"[Submission ID: {submission_id}] PRE-INSERT REVIEW #{review_count}: DATA KEYS = {list(review_data.keys())}")
-                if 'review_text' in review_data:
-                    logger.debug(f"[Submission ID: {submission_id}] PRE-INSERT REVIEW #{review_count}: review_text = '{review_data['review_text'][:100] if review_data['review_text'] else 'EMPTY'}...'")
-                else:
-                    logger.debug(f"[Submission ID: {submission_id}] PRE-INSERT REVIEW #{review_count}: NO review_text field!")
-                    
-                # For debugging - ensure review_text is actually being passed
-                if review.get("review_comment") and not review_data["review_text"]:
-                    logger.warning(f"[Submission ID: {submission_id}] review_comment exists but review_text is empty: {review.get('review_comment')[:30]}...")
+    else:
+         logger.warning("[Submission ID: %s] No product details were fetched. Skipping submission update.", submission_id)
+         # Potentially update status to indicate missing details
+
+
+    # --- Insert Individual Reviews ---
+    if not reviews_list:
+        logger.warning("[Submission ID: %s] No reviews found or fetched. Finishing task.", submission_id)
+        # Update submission status to completed (or a specific status like 'no_reviews')
+        final_status = "completed_no_reviews" if product_details else "failed_no_reviews"
+        get_supabase().table("submissions").update({"status": final_status}).eq("id", submission_id).execute()
+        checkpoint.clear()
+        # Even though we have no reviews, pass the submission_id to the next task
+        return {'submission_id': submission_id}
+
+    logger.info("[Submission ID: %s] Starting insertion of %s reviews.", submission_id, len(reviews_list))
+    if logger.isEnabledFor(logging.DEBUG):
+        for review in reviews_list[:5]:
+            logger.debug("[Submission ID: %s] Inserting review data: %s", submission_id, json.dumps(review.to_row(), default=str))
+
+    # Reviews an earlier attempt already inserted count as stored and are not written again
+    pending = [review for review in reviews_list if not review.review_id or review.review_id not in checkpoint.stored_ids]
+    if len(pending) < len(reviews_list):
+        logger.info("[Submission ID: %s] %s reviews were stored by an earlier attempt", submission_id, len(reviews_list) - len(pending))
+
+    # Bulk insert shared by every platform (see review_writer.py)
+    successful_inserts, failed_inserts = insert_reviews(
+        submission_id, pending, on_batch=lambda batch: checkpoint.mark_reviews_stored(review.review_id for review in batch))
+    successful_inserts += len(reviews_list) - len(pending)
+
+    logger.info("[Submission ID: %s] Completed review insertion. Success: %s, Failed: %s", submission_id, successful_inserts, failed_inserts)
+
+    # --- Final Submission Status Update ---
+    final_status = "completed" if successful_inserts > 0 else "failed"
+    if failed_inserts > 0:
+        final_status = "completed_with_errors" # Or another status to indicate partial success
+    # Fetching stopped at the stage deadline: what was stored is only part of the reviews
+    deadline = current_deadline()
+    partial = successful_inserts > 0 and deadline is not None and deadline.reached
+    if partial:
+        final_status = PARTIAL_STATUS
+
+    logger.info("[Submission ID: %s] Setting final status to: %s", submission_id, final_status)
+    get_supabase().table('submissions').update({'status': final_status, 'last_refreshed_at': datetime.utcnow().isoformat()}).eq('id', submission_id).execute()
+    checkpoint.clear()
+
+    logger.info("[Submission ID: %s] Task finished.", submission_id)
+    
+    # Update the result with final status
+    result.update({
+        "status": PARTIAL_STATUS if partial else "completed",
+        "reviews_count": successful_inserts,
+        "message": f"Successfully processed {successful_inserts} reviews for submission {submission_id}"
+    })
+    return result
 
-                # Remove None values before insertion
-                review_data_cleaned = {k: v for k, v in review_data.items() if v is not None}
+def _scrape_failed(submission_id: str, result: Dict[str, Any], e: Exception) -> Dict[str, Any]:
+    """Record an unhandled scrape error on the submission and in the task result."""
+    logger.exception("[Submission ID: %s] Unhandled error in scrape_reviews task: %s", submission_id, e)
+    
+    # Update result with error information
+    result.update({
+        "status": "error",
+        "error": str(e),
+        "message": f"Failed to process submission {submission_id}",
+        "database_update_success": False
+    })
+    
+    # Update status to indicate failure
+    try:
+        get_supabase().table("submissions").update({"status": "error", "error_message": str(e)[:500]}).eq("id", submission_id).execute()
+    except Exception as update_error:
+        logger.error("[Submission ID: %s] Failed to update error status: %s", submission_id, update_error)
+    
+    # Return the result with error info instead of re-raising
+    return result
 
-                # Log sample of the data being inserted (first review only)
-                # if successful_inserts == 0:
-                #    logger.debug(f"[Submission ID: {submission_id}] Sample review data for insertion: {json.dumps(review_data_cleaned, default=str)}")
-                
-                # Log data for first 5 inserts for debugging
-                if successful_inserts < 5:
-                    logger.debug(f"[Submission ID: {submission_id}] Inserting review #{successful_inserts + 1} data: {json.dumps(review_data_cleaned, default=str)}")
+def _scrape_deferred(submission_id: str, result: Dict[str, Any], e: CircuitOpenError) -> Dict[str, Any]:
+    """Result for a scrape stopped by an open circuit; the caller queues it again and the submission stays processing."""
+    logger.warning("[Submission ID: %s] Scrape stopped: %s", submission_id, e)
+    result.update({
+        "status": "deferred",
+        "error": str(e),
+        "retry_after": e.retry_after,
+        "message": f"Deferred submission {submission_id} until {e.circuit} recovers"
+    })
+    return result
 
-                # Execute insert
-                insert_response = supabase.table("reviews").insert(review_data_cleaned).execute()
+def _scrape_timed_out(submission_id: str, result: Dict[str, Any], checkpoint: ScrapeCheckpoint) -> Dict[str, Any]:
+    """
+    Finish a scrape stopped by the task's soft time limit.
 
-                # Check for errors in insert response if the API provides detailed errors
-                if hasattr(insert_response, 'error') and insert_response.error:
-                   logger.error(f"[Submission ID: {submission_id}] Supabase insert error: {insert_response.error.message}")
-                   failed_inserts += 1
-                   continue # Skip to next review
+    Reviews are only inserted once fetching is done, so the only reviews stored at this point
+    are those of an earlier attempt or of batches inserted before storing overran the limit
+    (both recorded by the checkpoint). Those stay, and the submission is marked partially
+    complete so analysis can run on them; without any it is an error. Reviews fetched but not
+    yet inserted are lost; the deadline normally stops fetching early enough to avoid this.
+    """
+    stored = len(checkpoint.stored_ids)
+    if not stored:
+        return _scrape_failed(submission_id, result, TimeoutError("Scrape exceeded its time limit"))
+    logger.warning("[Submission ID: %s] Scrape hit its time limit with %s reviews stored; marking it %s", submission_id, stored, PARTIAL_STATUS)
+    try:
+        get_supabase().table('submissions').update({'status': PARTIAL_STATUS, 'last_refreshed_at': datetime.utcnow().isoformat()}).eq('id', submission_id).execute()
+        checkpoint.clear()
+    except Exception as update_error:
+        logger.error("[Submission ID: %s] Failed to update partial status: %s", submission_id, update_error)
+    result.update({
+        "status": PARTIAL_STATUS,
+        "reviews_count": stored,
+        "message": f"Stored {stored} reviews for submission {submission_id} before the time limit"
+    })
+    return result
 
-                successful_inserts += 1
+@app.task(name='worker.scrape_reviews_batch', acks_late=True, reject_on_worker_lost=True,
+          soft_time_limit=soft_time_limit('scrape'), time_limit=time_limit('scrape'))
+def scrape_reviews_batch(submissions: List[Union[Dict[str, str], List[str]]], analyze: bool = True) -> Dict[str, Any]:
+    """
+    Scrape a product and its competitors concurrently in one event loop.
 
-                if successful_inserts % 50 == 0:  # Log progress every 50 reviews
-                    logger.info(f"[Submission ID: {submission_id}] Successfully inserted {successful_inserts}/{len(reviews_list)} reviews so far.")
+    Every submission shares one aiohttp connection pool and one rate limiter per platform
+    (see scrapers.py and rate_limit.py), so a competitor set finishes in roughly the time of its slowest
+    product instead of the sum of all of them. Each submission is written to Supabase as
+    soon as its own scrape finishes, and failures are isolated per submission.
 
-            except Exception as insert_error:
-                failed_inserts += 1
-                logger.error(f"[Submission ID: {submission_id}] Error processing or inserting review: {insert_error}. Review data: {review.get('review_id', 'N/A')}")
-                # Log the problematic review data for debugging if possible
-                logger.debug(f"[Submission ID: {submission_id}] Failed review data sample: {json.dumps(review, default=str)}")
-                continue # Continue to next review
+    Args:
+        submissions: [{"submission_id": ..., "url": ...}, ...] or [[submission_id, url], ...]
+        analyze: Queue analyze_reviews for each submission once its scrape is stored
 
-        logger.info(f"[Submission ID: {submission_id}] Completed review insertion loop. Success: {successful_inserts}, Failed: {failed_inserts}")
+    Returns:
+        Dictionary with the overall status and per-submission results keyed by submission ID
+    """
+    pairs = {}
+    for item in submissions or []:
+        if isinstance(item, dict):
+            submission_id, url = item.get("submission_id") or item.get("id"), item.get("url")
+        else:
+            submission_id, url = item
+        if submission_id and url:
+            pairs[submission_id] = url  # A submission listed twice is scraped once
+    logger.info("Running scrape_reviews_batch task for %s submissions", len(pairs))
 
-        # --- Final Submission Status Update ---
-        final_status = "completed" if successful_inserts > 0 else "failed"
-        if failed_inserts > 0:
-            final_status = "completed_with_errors" # Or another status to indicate partial success
+    try:
+        with stage_deadline('scrape'):
+            results = asyncio.run(_scrape_batch(pairs)) if pairs else {}
+    except SoftTimeLimitExceeded:
+        # Each submission keeps the reviews its checkpoint says were stored (see _scrape_timed_out)
+        logger.error("scrape_reviews_batch hit its time limit; finishing %s submissions with what they stored", len(pairs))
+        results = {submission_id: _scrape_timed_out(submission_id, _new_scrape_result(submission_id),
+                                                     ScrapeCheckpoint.load(submission_id))
+                   for submission_id in pairs}
+
+    for submission_id, result in results.items():
+        if result.get("status") == "deferred":
+            # Queued again on its own once the circuit may have closed, with its analysis linked
+            queue = current_queue()
+            try:
+                enqueue(scrape_reviews, (submission_id, pairs[submission_id]), queue=queue,
+                        countdown=deferral_countdown(result["retry_after"]),
+                        link=analyze_reviews.s(submission_id).set(queue=queue) if analyze else None)
+            except Exception as e:
+                logger.error("[Submission ID: %s] Failed to queue deferred scrape: %s", submission_id, e)
+        elif analyze and result.get("status") != "error":
+            try:
+                enqueue(analyze_reviews, (None, submission_id), queue=current_queue())
+            except Exception as e:
+                logger.error("[Submission ID: %s] Failed to queue analyze_reviews: %s", submission_id, e)
 
-        logger.info(f"[Submission ID: {submission_id}] Setting final status to: {final_status}")
-        supabase.table('submissions').update({'status': final_status, 'last_refreshed_at': datetime.utcnow().isoformat()}).eq('id', submission_id).execute()
+    failed = [sid for sid, r in results.items() if r.get("status") == "error"]
+    logger.info("scrape_reviews_batch finished: %s succeeded, %s failed", len(results) - len(failed), len(failed))
+    return {
+        "status": "completed" if not failed else ("error" if len(failed) == len(results) else "completed_with_errors"),
+        "submissions": results,
+    }
 
-        logger.info(f"[Submission ID: {submission_id}] Task finished.")
-        
-        # Update the result with final status
-        result.update({
-            "status": "completed",
-            "reviews_count": successful_inserts,
-            "message": f"Successfully processed {successful_inserts} reviews for submission {submission_id}"
-        })
-        return result
+async def _scrape_batch(pairs: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """Run every submission's scrape on one session and set of limiters; returns results by submission ID."""
+    import aiohttp
+
+    budgets = ScraperBudgets()
+    connector = aiohttp.TCPConnector(limit=RAPIDAPI_MAX_CONCURRENCY)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        outcomes = await asyncio.gather(*(
+            _scrape_one(submission_id, url, session, budgets) for submission_id, url in pairs.items()
+        ))
+    return dict(zip(pairs, outcomes))
+
+async def _scrape_one(submission_id: str, url: str, session, budgets: ScraperBudgets) -> Dict[str, Any]:
+    """One submission of a batch, with its own usage ledger and deadline flag (each gathered coroutine runs in its own context)."""
+    with track_usage() as usage, stage_deadline('scrape'):
+        result = await _scrape_one_tracked(submission_id, url, session, budgets)
+    await asyncio.to_thread(save_usage, submission_id, 'scrape', usage)
+    return result
 
+async def _scrape_one_tracked(submission_id: str, url: str, session, budgets: ScraperBudgets) -> Dict[str, Any]:
+    """The same steps as _scrape_reviews, with DB writes off the event loop."""
+    result = _new_scrape_result(submission_id)
+    try:
+        marketplaces = await asyncio.to_thread(_start_processing, submission_id)
+        checkpoint = await asyncio.to_thread(ScrapeCheckpoint.load, submission_id)
+        product_details, reviews_list = await _fetch_submission(submission_id, url, result, session=session,
+                                                                budgets=budgets, marketplaces=marketplaces,
+                                                                checkpoint=checkpoint)
+        # Supabase calls are blocking; run them in a thread so other submissions keep fetching
+        return await asyncio.to_thread(_store_scrape, submission_id, product_details, reviews_list, result, checkpoint)
+    except CircuitOpenError as e:
+        return _scrape_deferred(submission_id, result, e)
     except Exception as e:
-        logger.exception(f"[Submission ID: {submission_id}] Unhandled error in scrape_reviews task: {str(e)}")
-        
-        # Update result with error information
-        result.update({
-            "status": "error",
-            "error": str(e),
-            "message": f"Failed to process submission {submission_id}",
-            "database_update_success": False
-        })
-        
-        # Update status to indicate failure
-        try:
-            supabase.table("submissions").update({"status": "error", "error_message": str(e)[:500]}).eq("id", submission_id).execute()
-        except Exception as update_error:
-            logger.error(f"[Submission ID: {submission_id}] Failed to update error status: {update_error}")
-        
-        # Return the result with error info instead of re-raising
-        return result
+        return await asyncio.to_thread(_scrape_failed, submission_id, result, e)
 
-@app.task(name='worker.analyze_reviews')
-def analyze_reviews(result, submission_id: str = None):
+@app.task(name='worker.analyze_reviews', soft_time_limit=soft_time_limit('analyze'), time_limit=time_limit('analyze'))
+def analyze_reviews(result, submission_id: str = None, profile: bool = False):
     """Fetches reviews for a submission, analyzes them, and updates the analyses table."""
     # Extract submission_id from the result of the previous task if provided
     if isinstance(result, dict) and 'submission_id' in result:
         submission_id = result.get('submission_id')
+    requested = profile or (isinstance(result, dict) and bool(result.get('profile')))
+    with maybe_profile(submission_id, 'analyze_reviews', requested=requested), track_usage() as usage, \
+            stage_deadline('analyze'):
+        outcome = _analyze_reviews(submission_id)
+    save_usage(submission_id, 'analyze', usage)
+    if outcome.get('status') == 'deferred':
+        defer_task(analyze_reviews, submission_id, outcome['message'], outcome['retry_after'])
+        get_supabase().table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
+        outcome = {'status': 'failed', 'message': outcome['message']}
+    return outcome
+
+def _analyze_reviews(submission_id: Optional[str]):
+    """Body of analyze_reviews; kept separate so the task can be wrapped in a profiler."""
     # If no submission_id from previous task and none provided as direct parameter
     if not submission_id:
         logger.error("[Analyze Task] No submission_id provided. Cannot proceed with analysis.")
         return {'status': 'failed', 'message': 'No submission_id provided'}
     try:
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Starting analysis.")
+        logger.info("[Analyze Task - Submission ID: %s] Starting analysis.", submission_id)
         # Fetch submission details including product title
-        submission_response = supabase.table('submissions').select('id, product_title, status').eq('id', submission_id).single().execute()
+        submission_response = get_supabase().table('submissions').select('id, product_title, status').eq('id', submission_id).single().execute()
         if hasattr(submission_response, 'error') and submission_response.error:
-             logger.error(f"[Analyze Task - Submission ID: {submission_id}] Error fetching submission: {submission_response.error}")
+             logger.error("[Analyze Task - Submission ID: %s] Error fetching submission: %s", submission_id, submission_response.error)
              return {'status': 'failed', 'message': f'Error fetching submission: {submission_response.error}'}
         if not submission_response.data:
-            logger.error(f"[Analyze Task - Submission ID: {submission_id}] Submission not found.")
+            logger.error("[Analyze Task - Submission ID: %s] Submission not found.", submission_id)
             return {'status': 'failed', 'message': 'Submission not found'}
             
         submission_data = submission_response.data
+        # A scrape cut short by its deadline stays marked partial once analysed
+        partial = submission_data.get('status') == PARTIAL_STATUS
         original_product_title = submission_data.get('product_title', 'Unknown Product') # Get product title
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Original Product Title: {original_product_title}")
+        logger.info("[Analyze Task - Submission ID: %s] Original Product Title: %s", submission_id, original_product_title)
 
         # Update submission status to 'processing_analysis'
-        status_update_response = supabase.table('submissions').update({'status': 'processing_analysis'}).eq('id', submission_id).execute()
+        status_update_response = get_supabase().table('submissions').update({'status': 'processing_analysis'}).eq('id', submission_id).execute()
 
-        # Fetch reviews from database - select text, rating, and date
-        reviews_response = supabase.table('reviews').select('review_text, review_rating, review_date, created_at').eq('submission_id', submission_id).execute()
+        # Fetch reviews from database - select text, rating, date, and the id the analysis state records
+        # created_at is only the insert time (review_date holds the posting date), so it isn't fetched
+        reviews_response = get_supabase().table('reviews').select('api_review_id, review_text, review_rating, review_date, helpful_votes_text, sentiment_label').eq('submission_id', submission_id).execute()
 
         if not reviews_response.data:
-             logger.warning(f"[Analyze Task - Submission ID: {submission_id}] No reviews found in DB for analysis.")
+             logger.warning("[Analyze Task - Submission ID: %s] No reviews found in DB for analysis.", submission_id)
              return {'status': 'skipped', 'message': 'No reviews found for analysis'}
 
         reviews_data_for_prompt = reviews_response.data
 
         if not reviews_data_for_prompt:
-            logger.warning(f"[Analyze Task - Submission ID: {submission_id}] No review data available for prompt generation.")
+            logger.warning("[Analyze Task - Submission ID: %s] No review data available for prompt generation.", submission_id)
             return {'status': 'skipped', 'message': 'No review data available'}
 
-        # --- Calculate core metrics locally --- 
-        total_rating = 0.0
-        rating_count = 0
-        local_rating_distribution = defaultdict(int)
-        valid_ratings_list = []
-
-        for review in reviews_data_for_prompt:
-            rating_str = review.get('review_rating')
-            if rating_str is not None:
-                try:
-                    rating = float(rating_str) # Convert rating string to float
-                    if 1.0 <= rating <= 5.0:
-                        valid_ratings_list.append(rating)
-                        rating_key = int(rating) # Use int for distribution keys
-                        local_rating_distribution[rating_key] += 1
-                        rating_count += 1
-                except (ValueError, TypeError):
-                    logger.warning(f"[Analyze Task - Submission ID: {submission_id}] Skipping invalid rating format: {rating_str}")
-
-        local_average_rating = statistics.mean(valid_ratings_list) if valid_ratings_list else 0.0
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Locally calculated average rating: {local_average_rating:.2f}, Distribution: {dict(local_rating_distribution)}")
-
-        # --- Calculate ratings over time locally (existing logic) ---
-        # (Keep the existing logic for month_ratings calculation here)
-        # Calculate ratings over time (monthly averages with review counts)
-        month_ratings = defaultdict(list)
-        for review in reviews_data_for_prompt:
-            # Use review_date (when the review was posted on Amazon)
-            # Do not fall back to created_at as it doesn't represent the actual review date
-            date_str = review.get('review_date', '')
-            rating_str = review.get('review_rating')
-            
-            # Skip reviews without valid rating
-            if rating_str is None:
-                continue
-                
-            try:
-                # Only include valid ratings between 1-5
-                rating = float(rating_str)
-                if 1.0 <= rating <= 5.0:
-                    # Skip reviews that still have no valid date even after fallback
-                    if not date_str or not date_str.strip():
-                        logger.debug(f"Skipping rating for monthly average: no valid date available")
-                        continue
-                        
-                    try:
-                        # Try to parse ISO format (2024-05-05T14:30:00)
-                        if 'T' in date_str:
-                            dt = datetime.fromisoformat(date_str.split('.')[0])
-                            month_key = dt.strftime('%Y-%m')
-                            month_ratings[month_key].append(rating)
-                            
-                        # Try to parse YYYY-MM-DD format
-                        elif '-' in date_str and len(date_str.split('-')) == 3:
-                            try:
-                                dt = datetime.strptime(date_str.strip(), '%Y-%m-%d')
-                                month_key = dt.strftime('%Y-%m')
-                                month_ratings[month_key].append(rating)
-                            except ValueError as e:
-                                logger.debug(f"Skipping unparseable date for monthly average: '{date_str}'. Error: {e}")
-                                continue
-                        
-                        # Only use dateutil parser as last resort
-                        else:
-                            try:
-                                from dateutil import parser
-                                dt = parser.parse(date_str)
-                                month_key = dt.strftime('%Y-%m')
-                                month_ratings[month_key].append(rating)
-                            except Exception as e:
-                                logger.debug(f"Failed to parse date with dateutil for monthly average: '{date_str}'. Error: {e}")
-                                continue
-                    except Exception as e:
-                        logger.debug(f"Skipping review for monthly average due to date parsing error: '{date_str}'. Error: {e}")
-                        continue
-            except (ValueError, TypeError) as e:
-                # Skip review if rating or date is invalid/missing
-                logger.warning(f"[Analyze Task - Submission ID: {submission_id}] Skipping review for monthly calc due to invalid data: rating='{rating_str}', date='{date_str}'. Error: {e}")
-                continue
-        
-        # Enhanced data structure: include both average rating and count for each month
-        monthly_ratings_with_counts = {}
-        for month, ratings in month_ratings.items():
-            if ratings:  # Only include months with valid ratings
-                monthly_ratings_with_counts[month] = {
-                    "average": round(statistics.mean(ratings), 2),
-                    "count": len(ratings)
-                }
-        
-        # Sort months by date (newest first) and limit to last 12 months if there are more
-        sorted_months = sorted(monthly_ratings_with_counts.keys(), reverse=True)
-        if len(sorted_months) > 12:
-            sorted_months = sorted_months[:12]
-            # Create new dict with only the last 12 months
-            limited_monthly_ratings = {}
-            for month in sorted_months:
-                limited_monthly_ratings[month] = monthly_ratings_with_counts[month]
-            monthly_ratings_with_counts = limited_monthly_ratings
-        
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Locally calculated monthly data: {monthly_ratings_with_counts}")
+        # --- Calculate core metrics locally ---
+        # Sentiment is scored locally for every review when it is stored; rows from before that are scored here
+        rescored = ensure_sentiment(reviews_data_for_prompt)
+        if rescored:
+            logger.info("[Analyze Task - Submission ID: %s] Scored sentiment for %s reviews stored without it", submission_id, rescored)
+        # Kept as additive counts and stored with the analysis, so a refresh can fold in
+        # just the new reviews instead of recomputing over all of them (see analysis_state.py)
+        # Near-identical reviews (copy-paste, templated incentivised reviews) are collapsed to one
+        # representative each: ratings still count every review, words and the prompt don't
+        representatives, collapsed = collapse_near_duplicates(reviews_data_for_prompt)
+        state = AnalysisState().add_reviews(reviews_data_for_prompt, count_words=False).add_representatives(
+            representatives, collapsed)
+        logger.info("[Analyze Task - Submission ID: %s] Collapsed %s near-duplicate reviews "
+                    "into %s distinct ones (dedup ratio %.1f%%)", submission_id, collapsed, len(representatives),
+                    100 * state.duplicate_ratio)
+        local_average_rating = state.average_rating
+        local_rating_distribution = dict(state.rating_distribution)
+        logger.info("[Analyze Task - Submission ID: %s] Locally calculated average rating: %.2f, Distribution: %s", submission_id, local_average_rating, local_rating_distribution)
+
+        # Monthly averages with review counts for the last 12 months (newest first)
+        monthly_ratings_with_counts = state.ratings_over_time()
+        logger.info("[Analyze Task - Submission ID: %s] Locally calculated monthly data: %s", submission_id, monthly_ratings_with_counts)
         
         # For backwards compatibility, also create the old format
         local_monthly_avg_ratings = {
             month: data["average"] 
             for month, data in monthly_ratings_with_counts.items()
         }
-        # --- End existing ratings_over_time logic ---
+
+        # Themes over every distinct review, clustered locally; the LLM names them instead of
+        # reading raw snippets
+        clusters = theme_clusters(representatives)
+        logger.info("[Analyze Task - Submission ID: %s] Clustered reviews into %s themes", submission_id, len(clusters))
 
         # --- Prepare Input for DeepSeek --- 
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Preparing analysis input for DeepSeek.")
+        logger.info("[Analyze Task - Submission ID: %s] Preparing analysis input for DeepSeek.", submission_id)
         analysis_input = {
             'original_product_name': original_product_title, # Pass original name
-            'reviews': reviews_data_for_prompt, # Pass raw review data
+            'reviews': representatives, # One row per near-duplicate cluster, with duplicate_count
             'calculated_average_rating': round(local_average_rating, 2), # Pass calculated average
             'calculated_distribution': dict(local_rating_distribution), # Pass calculated distribution
-            'calculated_monthly_averages': local_monthly_avg_ratings # Pass calculated monthly averages
+            'calculated_monthly_averages': local_monthly_avg_ratings, # Pass calculated monthly averages
+            'calculated_sentiment': state.sentiment_scores(), # Local sentiment over every review
+            'theme_clusters': clusters, # Sent instead of snippets when there are enough reviews
         }
 
         # --- Trigger DeepSeek Analysis ---
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Triggering analysis.")
+        logger.info("[Analyze Task - Submission ID: %s] Triggering analysis.", submission_id)
         api_key = os.getenv('DEEPSEEK_API_KEY')
         if not api_key:
-            logger.error(f"[Analyze Task - Submission ID: {submission_id}] DeepSeek API key not found in environment variables.")
+            logger.error("[Analyze Task - Submission ID: %s] DeepSeek API key not found in environment variables.", submission_id)
             # Update submission status to failed
-            supabase.table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
+            get_supabase().table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
             return {'status': 'failed', 'message': 'DeepSeek API key missing'}
 
-        deepseek_response = call_deepseek_api(analysis_input, api_key)
-
-        if 'error' in deepseek_response:
+        llm_usage_counts: Dict[str, int] = {}
+        deepseek_response = call_deepseek_api(analysis_input, api_key, usage=llm_usage_counts)
+
+        processed_analysis = None
+        if deepseek_response.get('timed_out'):
+            # Out of time: the locally computed numbers and themes are still worth storing
+            logger.warning("[Analyze Task - Submission ID: %s] DeepSeek call timed out; storing the local analysis only", submission_id)
+            partial = True
+        elif 'retry_after' in deepseek_response:
+            # DeepSeek's circuit is open: no call was made, and the task is queued again
+            return {'status': 'deferred', 'submission_id': submission_id, 'message': deepseek_response['error'],
+                    'circuit': deepseek_response['circuit'], 'retry_after': deepseek_response['retry_after']}
+        elif 'error' in deepseek_response:
             error_message = deepseek_response['error']
-            logger.error(f"[Analyze Task - Submission ID: {submission_id}] DeepSeek API call failed: {error_message}")
+            logger.error("[Analyze Task - Submission ID: %s] DeepSeek API call failed: %s", submission_id, error_message)
             # Update submission status to failed
-            supabase.table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
+            get_supabase().table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
             return {'status': 'failed', 'message': f'DeepSeek API Error: {error_message}'}
+        else:
+            logger.info("[Analyze Task - Submission ID: %s] Processing DeepSeek response.", submission_id)
+            processed_analysis = process_deepseek_response(deepseek_response)
 
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Processing DeepSeek response.")
-        processed_analysis = process_deepseek_response(deepseek_response)
-
-        if 'error' in processed_analysis:
+        if processed_analysis is not None and 'error' in processed_analysis:
              # If processing failed, log it and mark as failed.
              process_error = processed_analysis['error']
-             logger.error(f"[Analyze Task - Submission ID: {submission_id}] Failed to process DeepSeek response: {process_error}")
-             supabase.table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
+             logger.error("[Analyze Task - Submission ID: %s] Failed to process DeepSeek response: %s", submission_id, process_error)
+             get_supabase().table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
              return {'status': 'failed', 'message': f'Analysis Processing Error: {process_error}'}
 
 
         # --- Store Analysis Results in Supabase ---
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Storing analysis results in Supabase.")
-        # Map fields to match the actual database schema per SUPABASE_DATABASE_SCHEMA.mdc
+        logger.info("[Analyze Task - Submission ID: %s] Storing analysis results in Supabase.", submission_id)
         analysis_data_to_insert = {
             'submission_id': submission_id,
-            'sentiment_positive_score': processed_analysis.get('sentiment_positive_score'),
-            'sentiment_negative_score': processed_analysis.get('sentiment_negative_score'),
-            'sentiment_neutral_score': processed_analysis.get('sentiment_neutral_score'),
-            'key_themes': json.dumps(processed_analysis.get('themes', [])),  # Changed 'themes' to 'key_themes'
-            'top_positives': json.dumps(processed_analysis.get('top_positives', [])), 
-            'top_negatives': json.dumps(processed_analysis.get('top_negatives', [])), 
-            'word_map': json.dumps(processed_analysis.get('word_map', {})), 
-            'trending': processed_analysis.get('trending'),
-            'competitive_insights': json.dumps(processed_analysis.get('competitive_insights', [])), 
-            'opportunities': json.dumps(processed_analysis.get('improvement_opportunities', [])),  # Using correct field name 'opportunities'
-            'summary': processed_analysis.get('high_level_summary'),  # Using correct field name 'summary'
-            'display_name': processed_analysis.get('display_name'),  # Add the display_name field from DeepSeek
             'created_at': datetime.now().isoformat(),
-             # Add locally calculated data
-             'average_rating': local_average_rating,
-             'rating_distribution': json.dumps(dict(local_rating_distribution)), 
-             'ratings_over_time': json.dumps(monthly_ratings_with_counts), 
-             'review_count': rating_count
+            **analysis_fields(state, processed_analysis, clusters),
         }
 
         try:
-            insert_response = supabase.table('analyses').insert(analysis_data_to_insert).execute()
+            insert_response = get_supabase().table('analyses').insert(analysis_data_to_insert).execute()
             # Check for errors specifically in the response data or attributes
             if hasattr(insert_response, 'data') and insert_response.data:
-                 logger.info(f"[Analyze Task - Submission ID: {submission_id}] Successfully inserted analysis results.")
+                 logger.info("[Analyze Task - Submission ID: %s] Successfully inserted analysis results.", submission_id)
             elif hasattr(insert_response, 'error') and insert_response.error:
-                 logger.error(f"[Analyze Task - Submission ID: {submission_id}] Failed to insert analysis into Supabase: {insert_response.error}")
-                 supabase.table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
+                 logger.error("[Analyze Task - Submission ID: %s] Failed to insert analysis into Supabase: %s", submission_id, insert_response.error)
+                 get_supabase().table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
                  return {'status': 'failed', 'message': 'Failed to store analysis results'}
             else:
                 # Handle unexpected response structure
-                logger.error(f"[Analyze Task - Submission ID: {submission_id}] Unexpected response structure from Supabase insert: {insert_response}")
-                supabase.table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
+                logger.error("[Analyze Task - Submission ID: %s] Unexpected response structure from Supabase insert: %s", submission_id, insert_response)
+                get_supabase().table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
                 return {'status': 'failed', 'message': 'Failed to store analysis results due to unexpected DB response'}
 
         except Exception as db_exc:
-            logger.exception(f"[Analyze Task - Submission ID: {submission_id}] Unexpected error inserting analysis into Supabase: {db_exc}")
-            supabase.table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
+            logger.exception("[Analyze Task - Submission ID: %s] Unexpected error inserting analysis into Supabase: %s", submission_id, db_exc)
+            get_supabase().table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
             return {'status': 'failed', 'message': 'Unexpected error storing analysis results'}
 
 
         # --- Update Submission Status to Completed ---
-        logger.info(f"[Analyze Task - Submission ID: {submission_id}] Updating submission status to 'Completed'.")
-        update_response = supabase.table('submissions').update({'status': 'Completed', 'last_refreshed_at': datetime.now().isoformat()}).eq('id', submission_id).execute()
+        final_status = PARTIAL_STATUS if partial else 'Completed'
+        logger.info("[Analyze Task - Submission ID: %s] Updating submission status to '%s'.", submission_id, final_status)
+        update_response = get_supabase().table('submissions').update({'status': final_status, 'last_refreshed_at': datetime.now().isoformat()}).eq('id', submission_id).execute()
 
         if hasattr(update_response, 'error') and update_response.error:
-            logger.error(f"[Analyze Task - Submission ID: {submission_id}] Failed to update submission status to Completed: {update_response.error}")
+            logger.error("[Analyze Task - Submission ID: %s] Failed to update submission status to Completed: %s", submission_id, update_response.error)
             return {'status': 'completed_with_warning', 'message': 'Analysis done, but failed to update final submission status'}
         else:
-             logger.info(f"[Analyze Task - Submission ID: {submission_id}] Analysis task finished successfully.")
-             return {'status': 'completed', 'submission_id': submission_id}
+             logger.info("[Analyze Task - Submission ID: %s] Analysis task finished successfully.", submission_id)
+             return {'status': PARTIAL_STATUS if partial else 'completed', 'submission_id': submission_id,
+                     'duplicate_ratio': round(state.duplicate_ratio, 4), 'llm_usage': llm_usage_counts}
 
     except Exception as e:
-        logger.exception(f"[Analyze Task - Submission ID: {submission_id}] An unexpected error occurred in analyze_reviews: {e}")
+        logger.exception("[Analyze Task - Submission ID: %s] An unexpected error occurred in analyze_reviews: %s", submission_id, e)
         # Ensure submission status reflects failure
         try:
-            supabase.table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
+            get_supabase().table('submissions').update({'status': 'Failed'}).eq('id', submission_id).execute()
         except Exception as final_update_err:
-             logger.error(f"[Analyze Task - Submission ID: {submission_id}] Failed to update submission status to Failed after task error: {final_update_err}")
+             logger.error("[Analyze Task - Submission ID: %s] Failed to update submission status to Failed after task error: %s", submission_id, final_update_err)
         return {'status': 'failed', 'message': f'Unexpected error: {e}'}
 
+def analysis_fields(state: AnalysisState, processed_analysis: Optional[Dict[str, Any]] = None,
+                    clusters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    `analyses` columns for an analysis: numbers from the state, qualitative fields from the LLM.
+
+    Args:
+        state: Counts over every review the analysis covers
+        processed_analysis: Output of process_deepseek_response; when None only the
+            state-derived columns are returned, leaving the stored qualitative ones as they are
+        clusters: Theme clusters the LLM was given (themes.theme_clusters); stored when not None
+
+    Returns:
+        Column values, including the serialised state for later refreshes
+    """
+    fields = {
+        **state.sentiment_scores(),
+        # Counted locally over all reviews; the LLM's word_map only saw the prompt's snippets
+        'word_map': json.dumps(state.word_map()),
+        'average_rating': state.average_rating,
+        'rating_distribution': json.dumps(dict(state.rating_distribution)),
+        'ratings_over_time': json.dumps(state.ratings_over_time()),
+        'review_count': state.rating_count,
+        'analysis_state': json.dumps(state.to_json()),
+    }
+    if clusters is not None:
+        fields['theme_clusters'] = json.dumps(clusters)
+    if processed_analysis is None:
+        return fields
+    # Map fields to match the actual database schema per SUPABASE_DATABASE_SCHEMA.mdc
+    fields.update({
+        'key_themes': json.dumps(processed_analysis.get('themes', [])),  # Changed 'themes' to 'key_themes'
+        'top_positives': json.dumps(processed_analysis.get('top_positives', [])),
+        'top_negatives': json.dumps(processed_analysis.get('top_negatives', [])),
+        'trending': processed_analysis.get('trending'),
+        'competitive_insights': json.dumps(processed_analysis.get('competitive_insights', [])),
+        'opportunities': json.dumps(processed_analysis.get('improvement_opportunities', [])),  # Using correct field name 'opportunities'
+        'summary': processed_analysis.get('high_level_summary'),  # Using correct field name 'summary'
+        'display_name': processed_analysis.get('display_name'),  # Add the display_name field from DeepSeek
+    })
+    return fields
+
 def process_deepseek_response(response_json: Dict) -> Dict[str, Any]:
     """
     Processes the raw JSON response from DeepSeek API.
     Extracts ONLY the specifically requested fields based on the refined prompt.
     Provides defaults or logs warnings if expected fields are missing.
     """
-    logger.debug(f"Processing DeepSeek response. Raw keys: {list(response_json.keys())}")
+    logger.debug("Processing DeepSeek response. Raw keys: %s", list(response_json.keys()))
 
-    # Define the exact keys we expect based on the refined prompt (with new sentiment breakdown)
+    # Define the exact keys we expect based on the refined prompt.
+    # Sentiment and word counts are computed locally (sentiment.py, analysis_state.py), so only
+    # the qualitative fields are asked for
     expected_keys_from_api = [
-        "sentiment_positive_score", # New
-        "sentiment_negative_score", # New
-        "sentiment_neutral_score",  # New
         "themes",
         "top_positives",
         "top_negatives",
-        "word_map",
         "trending",
         "competitive_insights",
         "improvement_opportunities",
@@ -1300,54 +1474,42 @@ def process_deepseek_response(response_json: Dict) -> Dict[str, Any]:
 
     # Iterate through ONLY the expected keys and extract them
     for key in expected_keys_from_api:
-        if key in ["sentiment_positive_score", "sentiment_negative_score", "sentiment_neutral_score"]:
-             # Ensure these are floats/numbers
-             value = data.get(key)
-             processed[key] = value if isinstance(value, (float, int)) else None
-             if key in data and not isinstance(value, (float, int)):
-                  logger.warning(f"Expected number for '{key}' but got {type(value)}. Using None.")
-        elif key in ["themes", "top_positives", "top_negatives", "competitive_insights", "improvement_opportunities"]:
+        if key in ["themes", "top_positives", "top_negatives", "competitive_insights", "improvement_opportunities"]:
             # Ensure these are lists
             value = data.get(key)
             processed[key] = value if isinstance(value, list) else []
             if not isinstance(value, list):
-                 logger.warning(f"Expected list for '{key}' but got {type(value)}. Using default [].")
-        elif key == "word_map":
-            # Ensure this is a dict
-            value = data.get(key)
-            processed[key] = value if isinstance(value, dict) else {}
-            if not isinstance(value, dict):
-                 logger.warning(f"Expected dict for '{key}' but got {type(value)}. Using default {{}}.")
+                 logger.warning("Expected list for '%s' but got %s. Using default [].", key, type(value))
         elif key == "trending":
             # Expecting a string
             value = data.get(key)
             processed[key] = value if isinstance(value, str) else None
             if key in data and not isinstance(value, str):
-                 logger.warning(f"Expected string for '{key}' but got {type(value)}. Using None.")
+                 logger.warning("Expected string for '%s' but got %s. Using None.", key, type(value))
         elif key == "high_level_summary":
             # Expecting a string
             value = data.get(key)
             processed[key] = value if isinstance(value, str) else None
             if key in data and not isinstance(value, str):
-                 logger.warning(f"Expected string for '{key}' but got {type(value)}. Using None.")
+                 logger.warning("Expected string for '%s' but got %s. Using None.", key, type(value))
         else:
              # Fallback for any other explicitly expected keys (currently none)
              processed[key] = data.get(key)
 
         # Log if an expected key was entirely missing from the source data
         if key not in data:
-            logger.warning(f"Expected field '{key}' not found in DeepSeek response data.")
+            logger.warning("Expected field '%s' not found in DeepSeek response data.", key)
 
     # Log any unexpected keys found in the response data for monitoring
     unexpected_keys = [k for k in data.keys() if k not in expected_keys_from_api]
     if unexpected_keys:
-        logger.warning(f"DeepSeek response included unexpected keys: {unexpected_keys}")
+        logger.warning("DeepSeek response included unexpected keys: %s", unexpected_keys)
 
-    logger.debug(f"Processed DeepSeek response keys (strict extraction): {list(processed.keys())}")
+    logger.debug("Processed DeepSeek response keys (strict extraction): %s", list(processed.keys()))
     return processed
 
 
-def call_deepseek_api(analysis_input: Dict[str, Any], api_key: str) -> Dict:
+def call_deepseek_api(analysis_input: Dict[str, Any], api_key: str, usage: Optional[Dict[str, int]] = None) -> Dict:
     """
     Calls the DeepSeek API (or compatible OpenAI API endpoint) to analyze product reviews.
 
@@ -1357,119 +1519,54 @@ def call_deepseek_api(analysis_input: Dict[str, Any], api_key: str) -> Dict:
             - 'reviews': List of raw review dictionaries.
             - 'calculated_average_rating': Locally calculated average rating (float).
             - 'calculated_distribution': Locally calculated rating distribution (dict).
+            - 'calculated_sentiment': Local sentiment proportions over all reviews (dict).
+            - 'theme_clusters': Optional output of themes.theme_clusters; when present it is
+              sent instead of review snippets.
+            - 'prior_summary': Optional compact qualitative summary of the existing analysis
+              (analysis_state.compact_summary); set on refreshes, where 'reviews' holds only
+              the reviews added since.
         api_key (str): The DeepSeek API key.
+        usage (Dict): Optional; filled with the call's token counts (analysis_prompt.llm_usage),
+            including the prompt tokens served from DeepSeek's context cache.
 
     Returns:
-        Dict: The JSON response from the API, or an error dictionary.
+        Dict: The JSON response from the API, or an error dictionary. The error has
+            'timed_out' set if the request timed out, and 'retry_after' (seconds) if it was
+            not made because DeepSeek's circuit breaker is open.
     """
+    import requests
+
     if not api_key:
         logger.error("DeepSeek API key is missing.")
         return {"error": "API key not configured"}
 
     # Check if we actually have reviews to analyze
     reviews = analysis_input.get('reviews', [])
-    original_product_title = analysis_input.get('original_product_name', 'Product') # Get original title
-    
+
     if not reviews:
         logger.warning("No reviews provided for DeepSeek analysis")
         return {
-            "sentiment_positive_score": None,
-            "sentiment_negative_score": None,
-            "sentiment_neutral_score": None,
             "themes": [],
             "top_positives": [],
             "top_negatives": [],
-            "word_map": {},
             "trending": "Not enough data for analysis.",
             "competitive_insights": [],
             "improvement_opportunities": [],
             "high_level_summary": "Insufficient data for summary."
         }
 
-    # Join the review texts together with newlines for the prompt
-    review_texts_for_prompt = []
-    for r in reviews:
-        # Skip None values
-        if not isinstance(r, dict):
-            continue
-            
-        rating = r.get('review_rating', 'N/A')
-        date = r.get('created_at', 'N/A')
-        text = r.get('review_text', '')
-        if text:
-            # Truncate individual reviews to 200 chars
-            text = text[:200]
-            
-        review_texts_for_prompt.append(f"Rating: {rating}, Date: {date}, Text: {text}")
-
-    # Maximum number of characters in the review text section of prompt
-    MAX_REVIEW_CHARS = 50000
-    
-    # Join all review texts with newlines
-    prompt_review_text = "\n".join(review_texts_for_prompt)
-    
-    # Truncate if necessary
-    if len(prompt_review_text) > MAX_REVIEW_CHARS:
-        prompt_review_text = prompt_review_text[:MAX_REVIEW_CHARS] + "\n... (truncated)"
-        logger.warning("Review text truncated for DeepSeek prompt due to length.")
-
-    logger.info(f"Processed {len(review_texts_for_prompt)} reviews for analysis")
-
-    # Construct the refined prompt incorporating local calculations and stricter output format
-    prompt = f"""
-TASK: Analyze product reviews for key insights and generate a concise display name.
-
-PRODUCT CONTEXT:
-- Original Product Name: {original_product_title}
-
-REVIEW DATA:
-a. You are provided with pre-calculated metrics; use them as context and focus ONLY on the qualitative insights requested below.
-
-**Contextual Metrics (PROVIDED FOR CONTEXT - DO NOT RECALCULATE OR INCLUDE IN RESPONSE):**
-- Average Rating: {analysis_input.get('calculated_average_rating', 'N/A')}
-- Rating Distribution (Star: Count): {analysis_input.get('calculated_distribution', 'N/A')}
-- Monthly Average Ratings ({len(analysis_input.get('calculated_monthly_averages', {}))} months): {analysis_input.get('calculated_monthly_averages', 'N/A')}
-
-**Review Data Snippets:**
---- Start Review Data ---
-{prompt_review_text}
---- End Review Data ---
-
-**Analysis Tasks & REQUIRED JSON Output Structure:**
-
-You MUST return ONLY a single, valid JSON object containing EXACTLY the following keys and value types. The sentiment scores MUST sum precisely to 1.0. DO NOT include any other keys or introductory text.
-
-1.  `"sentiment_positive_score"`: (Float) Proportion of positive sentiment (0.0-1.0) based ONLY on review texts.
-2.  `"sentiment_negative_score"`: (Float) Proportion of negative sentiment (0.0-1.0) based ONLY on review texts.
-3.  `"sentiment_neutral_score"`: (Float) Proportion of neutral sentiment (0.0-1.0) based ONLY on review texts.
-    *Constraint: sentiment_positive_score + sentiment_negative_score + sentiment_neutral_score MUST equal 1.0.*
-4.  `"themes"`: (List of Strings, max 10) Main themes discussed (e.g., "Customer Service", "Battery Life").
-5.  `"top_positives"`: (List of Strings, max 5) Top positive points mentioned in text.
-6.  `"top_negatives"`: (List of Strings, max 5) Top negative points mentioned in text. Briefly explain any major discrepancies between sentiment/ratings if observed.
-7.  `"word_map"`: (Dictionary Object, max 50 key-value pairs) Most frequent meaningful words (exclude common stop words) and their counts.
-8.  `"trending"`: (String) Analysis of *reasons* for rating changes over time, based on Monthly Average Ratings and review text themes.
-9.  `"improvement_opportunities"`: (List of Strings, max 5) Concrete suggestions for product improvements based on the negative feedback and themes.
-10. `"competitive_insights"`: (List of Strings, max 5) Insights comparing this product to competitors *if explicitly mentioned* in the reviews, or potential competitive advantages/disadvantages identified.
-11. `"high_level_summary"`: (String, 3-4 sentences) A concise summary of the overall findings, highlighting key sentiments, themes, and potential actions.
-12. `"display_name"`: (String) A product display name that MUST start with the exact brand name followed by the specific product identifier. REQUIRED FORMAT: "[EXACT BRAND NAME] [SPECIFIC PRODUCT NAME]" where brand name is the manufacturer (e.g., "HERBIVORE", "SAMSUNG", "NIKE") and product name is the specific product (e.g., "Bakuchiol Retinol", "Galaxy S23", "Air Jordan 4"). NEVER use generic descriptors like "Gentle Serum" or "Retinol Alternative" alone. ALWAYS retain the exact brand name from '{original_product_title}' as the first word(s) and then the specific product identifier. Examples: For "HERBIVORE Bakuchiol Retinol Alternative" use "HERBIVORE Bakuchiol Retinol"; For "L'Oreal Paris Age Perfect Cell Renewal" use "L'Oreal Paris Age Perfect". Limit to 3-6 words total.
-
-**CRITICAL:** Your response MUST be ONLY the single, valid JSON object described above, containing exactly the 12 specified keys and adhering strictly to their defined types. The three sentiment scores MUST sum precisely to 1.0.
-{{ ... }}
-"""
     # Prepare the payload for the API
     payload = {
         "model": "deepseek-chat", # Or the specific model you use
-        "messages": [
-            {"role": "system", "content": "You are an expert review analysis assistant. Your task is to analyze the provided review data and return insights ONLY in the specified JSON format."},            
-            {"role": "user", "content": prompt}
-        ],
+        # Static instructions first (a byte-stable, cacheable prefix), product data last; see analysis_prompt.py
+        "messages": analysis_messages(analysis_input),
         "response_format": {"type": "json_object"}, # Request JSON output if API supports
         "temperature": 0.5, # Adjust for desired creativity/determinism
         "max_tokens": 2048 # Adjust based on expected output size
     }
 
     # Use the OpenAI compatible endpoint if DeepSeek provides one, or their specific URL
-    api_url = "https://api.deepseek.com/chat/completions" # Verify DeepSeek endpoint
+    api_url = os.getenv('DEEPSEEK_API_URL', "https://api.deepseek.com/chat/completions") # Verify DeepSeek endpoint
     headers = {
         'Authorization': f'Bearer {api_key}',
         'Content-Type': 'application/json'
@@ -1477,15 +1574,46 @@ You MUST return ONLY a single, valid JSON object containing EXACTLY the followin
 
     try:
         logger.info("Calling DeepSeek API with refined prompt...")
-        logger.debug(f"DeepSeek Payload Keys: {list(payload.keys())}") # Don't log full payload
+        logger.debug("DeepSeek Payload Keys: %s", list(payload.keys())) # Don't log full payload
         
-        # Increased timeout to 180 seconds (3 minutes)
-        response = requests.post(api_url, headers=headers, json=payload, timeout=180)
+        # Fail fast while DeepSeek is down instead of waiting out the timeout (see circuit_breaker.py)
+        breaker = get_breaker('deepseek', 'chat-completions', LLM_SLOW_CALL_SECONDS)
+        try:
+            breaker.before_call()
+        except CircuitOpenError as e:
+            logger.error("DeepSeek API call skipped: %s", e)
+            return {"error": str(e), "retry_after": e.retry_after, "circuit": e.circuit}
+
+        # Connect and read timeouts (LLM_READ_TIMEOUT, 180 s by default), cut short by the stage deadline
+        timeout = llm_timeout()
+        started = time.perf_counter()
+        failed = True  # None: the call ended for reasons of our own and says nothing about DeepSeek
+        try:
+            response = requests.post(api_url, headers=headers, json=payload, timeout=timeout)
+            failed = failed_status(response.status_code, count_429=True)
+        except SoftTimeLimitExceeded:
+            failed = None
+            raise
+        except requests.exceptions.Timeout:
+            if timeout[1] < LLM_READ_TIMEOUT:
+                failed = None  # the read timeout was shortened to the stage's remaining time
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            record_llm_call(elapsed)
+            if failed is not None:
+                breaker.after_call(failed, elapsed)
         response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
 
-        logger.info("DeepSeek API call successful.")
         response_json = response.json()
-        logger.debug(f"DeepSeek Raw Response Snippet: {str(response_json)[:200]}...") # Log snippet
+        call_usage = llm_usage(response_json)
+        record_llm_tokens(call_usage)
+        if usage is not None:
+            usage.update(call_usage)
+        logger.info("DeepSeek API call successful: %s prompt tokens "
+                    "(%s from cache), %s completion tokens", call_usage['prompt_tokens'], call_usage['cached_prompt_tokens'], call_usage['completion_tokens'])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("DeepSeek Raw Response Snippet: %.200s...", str(response_json)) # Log snippet
 
         # --- Safely extract the structured JSON content --- 
         analysis_result = None
@@ -1498,13 +1626,13 @@ You MUST return ONLY a single, valid JSON object containing EXACTLY the followin
                     analysis_result = json.loads(message_content)
                     # Basic validation: check if it's a dictionary
                     if not isinstance(analysis_result, dict):
-                         logger.error(f"Parsed content from DeepSeek is not a JSON object (dict), type: {type(analysis_result)}")
+                         logger.error("Parsed content from DeepSeek is not a JSON object (dict), type: %s", type(analysis_result))
                          return {"error": "API returned non-dictionary JSON content"}
                     logger.info("Successfully parsed JSON content from DeepSeek response.")
-                    logger.debug(f"Parsed DeepSeek JSON keys: {list(analysis_result.keys())}")
+                    logger.debug("Parsed DeepSeek JSON keys: %s", list(analysis_result.keys()))
                 except json.JSONDecodeError as json_err:
-                    logger.error(f"Failed to parse JSON from DeepSeek message content: {json_err}")
-                    logger.debug(f"Non-JSON Content Received: {message_content[:500]}...") # Log problematic content snippet
+                    logger.error("Failed to parse JSON from DeepSeek message content: %s", json_err)
+                    logger.debug("Non-JSON Content Received: %.500s...", message_content) # Log problematic content snippet
                     return {"error": f"Failed to parse API JSON response: {json_err}"}
             else:
                  logger.error("No 'content' found in DeepSeek response message.")
@@ -1518,9 +1646,9 @@ You MUST return ONLY a single, valid JSON object containing EXACTLY the followin
 
     except requests.exceptions.Timeout:
         logger.error("DeepSeek API request timed out.")
-        return {"error": "API request timed out"}
+        return {"error": "API request timed out", "timed_out": True}
     except requests.exceptions.RequestException as e:
-        logger.error(f"DeepSeek API request failed: {e}")
+        logger.error("DeepSeek API request failed: %s", e)
         # Log response body if available for non-timeout errors
         error_details = "No response body available."
         if e.response is not None:
@@ -1528,8 +1656,8 @@ You MUST return ONLY a single, valid JSON object containing EXACTLY the followin
                 error_details = e.response.text
             except Exception:
                 error_details = "Could not read response body."
-        logger.error(f"DeepSeek Error Details: {error_details}")
+        logger.error("DeepSeek Error Details: %s", error_details)
         return {"error": f"API request failed: {e}"}
     except Exception as e:
-        logger.exception(f"An unexpected error occurred during DeepSeek API call: {e}")
+        logger.exception("An unexpected error occurred during DeepSeek API call: %s", e)
         return {"error": f"An unexpected error occurred: {e}"}
\ No newline at end of file